@@ -0,0 +1,641 @@
+# YOLOv1 benchmarks and numerical checks. Run as a script, e.g.: python YOLOv1_Benchmark.py loss
+#   python YOLOv1_Benchmark.py backbones --variants darknet:1:dense separable:0.5:conv
+#   python YOLOv1_Benchmark.py imports
+#   python YOLOv1_Benchmark.py suite --nImages 256 --out results.json
+#   python YOLOv1_Benchmark.py compare baseline.json results.json
+#   python YOLOv1_Benchmark.py decode --sourceSize 4000 3000 --filters bicubic bilinear
+import os
+import sys
+import json
+import time
+import glob
+import platform
+import argparse
+import tempfile
+import subprocess
+
+# For importing datahandler methods from the parent directory
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image, ImageDraw
+from dataHandler import encodeGroundTruth_YOLOv1, annotationsToDataframe, generateGroundTruth_YOLOv1, readImage, jpegDraftRatio
+from dataPipeline import dataGenerator_YOLOv1
+from dataAugmentation import batchAugmenter
+from utils import iouUtils, calcIOU
+from YOLOv1_Loss import YOLOv1_loss, YOLOv1_loss_legacy
+from YOLOv1_Model import YOLOV1_Model, modelReport
+from YOLOv1_Config import YOLOv1_Config
+
+def randomLossInputs(batchSize, params = (7, 7, 2, 1), nBoxes = 2, seed = 0):
+    """
+    Makes a random ground truth (Encoded by encodeGroundTruth_YOLOv1) and a random prediction
+    (Passed through a sigmoid, like the outputs of the model) for the loss function.
+
+    Args:
+        batchSize: int: Number of images
+        params: tuple: Output parameters of the model in (Sx, Sy, B, C) format
+        nBoxes: int: Average number of objects in each image
+        seed: int: Seed of the random generator
+
+    Returns:
+        A tuple of (yTrue, yPred) tensors
+    """
+    __rng = np.random.default_rng(seed)
+    __Sx, __Sy, __B, __C = params
+    __n = batchSize * nBoxes
+
+    __boxes = __rng.uniform(.05, .95, (__n, 4)).astype(np.float32) * np.array([1, 1, .5, .5], np.float32)
+    __classes = __rng.integers(0, __C, __n)
+    __imgIdx = __rng.integers(0, batchSize, __n)
+    yTrue = encodeGroundTruth_YOLOv1(__boxes, __classes, __imgIdx, batchSize, (__Sx, __Sy, 1, __C))
+    yPred = tf.sigmoid(__rng.normal(0, 2, (batchSize, __Sx, __Sy, 5 * __B + __C)).astype(np.float32))
+
+    return tf.constant(yTrue), yPred
+
+def checkLossEquivalence(batchSize = 16, nTrials = 10, rtol = 1e-4):
+    """
+    Checks that YOLOv1_loss and the legacy implementation (YOLOv1_loss_legacy) give the same loss and
+    gradients on random inputs. Raises an exception if they don't.
+
+    Args:
+        batchSize: int: Number of images in each trial
+        nTrials: int: Number of random trials
+        rtol: float: Allowed relative error of the loss and the gradients
+
+    Returns:
+        A list of (loss, legacy loss, max gradient difference) tuples, one for each trial
+    """
+    __results = []
+
+    for i in range(nTrials):
+        yTrue, yPred = randomLossInputs(batchSize, seed = i)
+
+        with tf.GradientTape(persistent = True) as tape:
+            tape.watch(yPred)
+            __loss = YOLOv1_loss(yTrue, yPred)
+            __lossLegacy = YOLOv1_loss_legacy(yTrue, yPred)
+
+        __grad = tape.gradient(__loss, yPred)
+        __gradLegacy = tape.gradient(__lossLegacy, yPred)
+        __gradDiff = float(tf.reduce_max(tf.abs(__grad - __gradLegacy)))
+
+        if not np.isclose(float(__loss), float(__lossLegacy), rtol = rtol):
+            raise Exception(f"Loss mismatch in trial {i}: {float(__loss)} != {float(__lossLegacy)}")
+        if __gradDiff > rtol * float(tf.reduce_max(tf.abs(__gradLegacy))):
+            raise Exception(f"Gradient mismatch in trial {i}: max difference is {__gradDiff}")
+
+        __results.append((float(__loss), float(__lossLegacy), __gradDiff))
+
+    return __results
+
+def benchmarkLoss(lossFn, batchSize = 64, nSteps = 50, jitCompile = False):
+    """
+    Measures the time of the forward and backward pass of a loss function.
+
+    Args:
+        lossFn: function: The loss function with (yTrue, yPred) signature
+        batchSize: int: Number of images in each step
+        nSteps: int: Number of timed steps (After one warm-up step)
+        jitCompile: bool: Whether to compile the step with XLA
+
+    Returns:
+        Average time of each step in milliseconds
+    """
+    yTrue, yPred = randomLossInputs(batchSize)
+
+    @tf.function(jit_compile = jitCompile)
+    def step(yTrue, yPred):
+        with tf.GradientTape() as tape:
+            tape.watch(yPred)
+            __loss = lossFn(yTrue, yPred)
+        return __loss, tape.gradient(__loss, yPred)
+
+    # Warm-up (Tracing and compilation)
+    step(yTrue, yPred)[1].numpy()
+
+    __start = time.perf_counter()
+    for _ in range(nSteps):
+        __out = step(yTrue, yPred)
+    __out[1].numpy()
+
+    return (time.perf_counter() - __start) / nSteps * 1000
+
+def benchmarkBackbones(variants, config = None, batchSize = 1, nSteps = 20):
+    """
+    Builds the model variants and reports their number of parameters, FLOPs, size of the weights and
+    the CPU inference latency.
+
+    Args:
+        variants: list: A list of (backbone, widthMultiplier, head) tuples, see YOLOV1_Model
+        config: YOLOv1_Config: The configuration of the network. The defaults if None.
+        batchSize: int: Number of images in each forward pass
+        nSteps: int: Number of timed forward passes (After one warm-up pass)
+
+    Returns:
+        A list of the dictionaries of modelReport, with an extra "latencyMs" key
+    """
+    config = config if config is not None else YOLOv1_Config()
+    __x = tf.constant(np.random.default_rng(0).integers(0, 256, (batchSize,) + config.inputShape(), dtype = np.uint8))
+    results = []
+
+    for backbone, widthMultiplier, head in variants:
+        model = YOLOV1_Model(config, backbone, widthMultiplier, head).getModel("uint8")
+        __report = modelReport(model)
+
+        @tf.function
+        def forward(x):
+            return model(x, training = False)
+
+        # Warm-up (Tracing)
+        forward(__x).numpy()
+
+        __start = time.perf_counter()
+        for _ in range(nSteps):
+            __out = forward(__x)
+        __out.numpy()
+
+        __report["latencyMs"] = (time.perf_counter() - __start) / nSteps * 1000
+        results.append(__report)
+
+        # Free the memory of the large variants before building the next one
+        del model, forward
+        tf.keras.backend.clear_session()
+
+    return results
+
+def checkImports(module = "dataHandler", code = "", forbidden = ("tensorflow", "keras", "matplotlib"), maxSeconds = None):
+    """
+    Imports a module in a new interpreter and checks that none of the forbidden (heavy) modules are
+    imported with it, so e.g. parsing the annotations does not pay for importing tensorflow. Raises
+    an exception if the check fails.
+
+    Args:
+        module: str: The module to import (From the parent directory of this file)
+        code: str: Python code to run after the import, e.g. calling some functions of the module
+        forbidden: tuple: Names of the top-level packages that should not be imported
+        maxSeconds: float: Maximum allowed time of the import (and the code). Not checked if None.
+
+    Returns:
+        A dictionary with the time of the import (seconds) and the peak memory of the interpreter (MB,
+        None if not on Linux)
+    """
+    # The peak memory is read from /proc (Linux), ru_maxrss would include the memory of this process
+    # before the fork
+    __script = (f"import sys, time, json\n__start = time.perf_counter()\nimport {module}\n{code}\n"
+                "__seconds = time.perf_counter() - __start\n"
+                "__status = open('/proc/self/status').read() if sys.platform == 'linux' else ''\n"
+                "__peak = [int(l.split()[1]) / 1024 for l in __status.splitlines() if l.startswith('VmHWM')]\n"
+                "print(json.dumps({'seconds': __seconds, 'modules': sorted(sys.modules), 'peakMB': __peak[0] if __peak else None}))")
+    __out = subprocess.run([sys.executable, "-c", __script], cwd = parent, capture_output = True, text = True)
+    if __out.returncode != 0:
+        raise Exception(f"Importing {module} failed:\n{__out.stderr}")
+
+    __result = json.loads(__out.stdout.strip().splitlines()[-1])
+    __loaded = sorted({name.split(".")[0] for name in __result["modules"]} & set(forbidden))
+    if 0 < len(__loaded):
+        raise Exception(f"Importing {module} also imports {', '.join(__loaded)}")
+    if maxSeconds is not None and maxSeconds < __result["seconds"]:
+        raise Exception(f"Importing {module} took {__result['seconds']:.2f} seconds (Maximum is {maxSeconds})")
+
+    return {"module": module, "seconds": __result["seconds"], "peakMB": __result["peakMB"]}
+
+def makeSyntheticDataset(outDir, nImages = 256, imgSize = (640, 480), nClass = 1, maxBoxes = 5, seed = 0):
+    """
+    Writes a synthetic dataset in the layout of the real data: jpg images in outDir/images/train and
+    YOLO txt labels ([class centerX centerY width height], relative to the image) in
+    outDir/labels/train. Each image has a gradient background and 1 to maxBoxes filled rectangles,
+    one for each box, so the images compress and decode like photos rather than noise.
+
+    Args:
+        outDir: str: The directory of the dataset
+        nImages: int: Number of images
+        imgSize: tuple: Size of the images (width, height) in pixels
+        nClass: int: Number of classes
+        maxBoxes: int: Maximum number of boxes in each image
+        seed: int: Seed of the random generator
+
+    Returns:
+        A tuple of (image directory, label directory)
+    """
+    __rng = np.random.default_rng(seed)
+    imgDir, labelDir = os.path.join(outDir, "images/train"), os.path.join(outDir, "labels/train")
+    os.makedirs(imgDir, exist_ok = True)
+    os.makedirs(labelDir, exist_ok = True)
+
+    __W, __H = imgSize
+    __gradient = np.linspace(0, 1, __W, dtype = np.float32)[None, :, None] * np.linspace(0, 1, __H, dtype = np.float32)[:, None, None]
+
+    for i in range(nImages):
+        __img = Image.fromarray((__gradient * __rng.integers(64, 256, 3)).astype(np.uint8))
+        __draw = ImageDraw.Draw(__img)
+
+        __n = __rng.integers(1, maxBoxes + 1)
+        __wh = __rng.uniform(.05, .5, (__n, 2))
+        __xy = __rng.uniform(__wh / 2, 1 - __wh / 2)
+        __classes = __rng.integers(0, nClass, __n)
+
+        for (x, y), (w, h) in zip(__xy, __wh):
+            __draw.rectangle([(x - w / 2) * __W, (y - h / 2) * __H, (x + w / 2) * __W, (y + h / 2) * __H], fill = tuple(int(c) for c in __rng.integers(0, 256, 3)))
+
+        __img.save(os.path.join(imgDir, f"img{i:05d}.jpg"), quality = 90)
+        with open(os.path.join(labelDir, f"img{i:05d}.txt"), "w") as f:
+            f.writelines(f"{c} {x:.6f} {y:.6f} {w:.6f} {h:.6f}\n" for c, (x, y), (w, h) in zip(__classes, __xy, __wh))
+
+    return imgDir, labelDir
+
+def timeRepeats(fn, repeats = 5, warmup = 1):
+    """
+    Calls a function several times and returns the statistics of its run time.
+
+    Args:
+        fn: function: The function to time, called without arguments
+        repeats: int: Number of timed calls
+        warmup: int: Number of calls before the timed ones (Tracing, caches, ...)
+
+    Returns:
+        A dictionary with the median, minimum and mean time of the calls in milliseconds
+    """
+    for _ in range(warmup):
+        fn()
+
+    __times = []
+    for _ in range(repeats):
+        __start = time.perf_counter()
+        fn()
+        __times.append((time.perf_counter() - __start) * 1000)
+
+    return {"ms": float(np.median(__times)), "minMs": float(np.min(__times)), "meanMs": float(np.mean(__times)), "repeats": repeats}
+
+def runSuite(dataDir, config, batchSize = 16, repeats = 5, variant = ("separable", .5, "conv"), nWorkers = 0):
+    """
+    Times the hot paths of the training on a dataset written by makeSyntheticDataset. "ms" of each
+    result is the median time of one call of the benchmarked operation:
+        annotationsToDataframe:      Parsing all the labels (Without the cache)
+        generateGroundTruth_YOLOv1:  Encoding the ground truth of all the labels
+        dataGenerator.__getitem__:   One batch of the generator (Averaged over an epoch)
+        YOLOv1_loss:                 Forward and backward pass of the loss on one batch
+        calcIOU:                     IOU of the predicted and true boxes of one batch
+        trainStep:                   One training step of the model on one batch
+
+    Args:
+        dataDir: str: The directory of the synthetic dataset
+        config: YOLOv1_Config: The configuration of the network
+        batchSize: int: Batch size of the generator, loss, IOU and training step
+        repeats: int: Number of timed calls of each benchmark
+        variant: tuple: (backbone, widthMultiplier, head) of the model, see YOLOV1_Model
+        nWorkers: int: Number of threads of the generator
+
+    Returns:
+        A dictionary of the results of timeRepeats, some with an extra throughput ("imagesPerSecond")
+    """
+    imgDir, labelDir = os.path.join(dataDir, "images/train"), os.path.join(dataDir, "labels/train")
+    __nImages = len([item for item in os.listdir(imgDir) if item.endswith(".jpg")])
+    results = {}
+
+    # The benchmarks of the labels should not time an empty run
+    __nLabels = len(glob.glob(os.path.join(labelDir, "*.txt")))
+    if __nLabels == 0:
+        raise Exception(f"No labels found in {labelDir}")
+    if len(generateGroundTruth_YOLOv1(labelDir, "txt", config.targetParams())) != __nLabels:
+        raise Exception(f"generateGroundTruth_YOLOv1 did not encode the {__nLabels} labels of {labelDir}")
+
+    results["annotationsToDataframe"] = timeRepeats(lambda: annotationsToDataframe(labelDir, "txt"), repeats)
+    results["generateGroundTruth_YOLOv1"] = timeRepeats(lambda: generateGroundTruth_YOLOv1(labelDir, "txt", config.targetParams()), repeats)
+
+    annotDf = annotationsToDataframe(labelDir, "txt")
+    generator = dataGenerator_YOLOv1(imgDir, batchSize, config.imgSize, annotDf, config.nClass, False, config.gridCells, nWorkers = nWorkers)
+    __nBatches = len(generator)
+    __epoch = timeRepeats(lambda: [generator[i] for i in range(__nBatches)], repeats)
+    generator.close()
+    results["dataGenerator.__getitem__"] = {k: v / __nBatches if k in ("ms", "minMs", "meanMs") else v for k, v in __epoch.items()}
+    results["dataGenerator.__getitem__"]["imagesPerSecond"] = __nBatches * batchSize / __epoch["ms"] * 1000
+
+    yTrue, yPred = randomLossInputs(batchSize, config.predParams())
+
+    @tf.function
+    def lossStep(yTrue, yPred):
+        with tf.GradientTape() as tape:
+            tape.watch(yPred)
+            __loss = YOLOv1_loss(yTrue, yPred)
+        return __loss, tape.gradient(__loss, yPred)
+
+    results["YOLOv1_loss"] = timeRepeats(lambda: lossStep(yTrue, yPred)[1].numpy(), repeats)
+
+    __C, __B = config.nClass, config.nBoxes
+    __predBoxes = tf.reshape(yPred[..., __C + __B:], yPred.shape[:3] + (__B, 4))
+    __trueBoxes = yTrue[..., None, __C + 1:]
+    __gridRatio = tf.constant(config.gridCells, tf.float32)
+
+    @tf.function
+    def iouStep(predBoxes, trueBoxes):
+        return calcIOU(*iouUtils(predBoxes, __gridRatio), *iouUtils(trueBoxes, __gridRatio))
+
+    results["calcIOU"] = timeRepeats(lambda: iouStep(__predBoxes, __trueBoxes).numpy(), repeats)
+
+    model = YOLOV1_Model(config, *variant).getModel("uint8")
+    __x = np.random.default_rng(0).integers(0, 256, (batchSize,) + config.inputShape(), dtype = np.uint8)
+    __y = yTrue.numpy()
+    results["trainStep"] = timeRepeats(lambda: model.train_on_batch(__x, __y), repeats)
+    results["trainStep"]["imagesPerSecond"] = batchSize / results["trainStep"]["ms"] * 1000
+
+    return results
+
+def compareResults(baseline, current, threshold = .1):
+    """
+    Compares two results of the suite (As written by the suite command).
+
+    Args:
+        baseline: dict: The baseline results
+        current: dict: The new results
+        threshold: float: Relative change of the median time counted as a regression (Slower) or an
+            improvement (Faster)
+
+    Returns:
+        A list of (name, baseline ms, current ms, ratio, status) tuples. status is "regression",
+        "improvement", "ok", or "missing" if the benchmark is only in one of the results.
+    """
+    rows = []
+    for name in sorted(set(baseline["results"]) | set(current["results"])):
+        if name not in baseline["results"] or name not in current["results"]:
+            rows.append((name, baseline["results"].get(name, {}).get("ms"), current["results"].get(name, {}).get("ms"), None, "missing"))
+            continue
+
+        __base, __new = baseline["results"][name]["ms"], current["results"][name]["ms"]
+        __ratio = __new / __base
+        __status = "regression" if 1 + threshold < __ratio else "improvement" if __ratio < 1 - threshold else "ok"
+        rows.append((name, __base, __new, __ratio, __status))
+
+    return rows
+
+def printComparison(rows):
+    """
+    Prints the rows of compareResults as a table.
+    """
+    print(f"{'Benchmark':>28} {'Baseline ms':>12} {'Current ms':>12} {'Ratio':>7}  Status")
+    for name, base, new, ratio, status in rows:
+        __base = f"{base:12.3f}" if base is not None else f"{'-':>12}"
+        __new = f"{new:12.3f}" if new is not None else f"{'-':>12}"
+        __ratio = f"{ratio:7.2f}" if ratio is not None else f"{'-':>7}"
+        print(f"{name:>28} {__base} {__new} {__ratio}  {status}")
+
+def benchmarkDecode(paths, imgSize, draft = True, resample = "bicubic", repeats = 3):
+    """
+    Times readImage on a list of images in a new interpreter and measures the peak memory that
+    reading them adds on top of the imports, so the results of different options do not affect
+    each other.
+
+    Args:
+        paths: list: Paths of the images
+        imgSize: tuple: The size the images are resized to (width, height)
+        draft: bool: Whether to decode the JPEGs at a reduced resolution, see readImage
+        resample: str: The filter of the resize, see resampleFilters
+        repeats: int: Number of passes over the images
+
+    Returns:
+        A dictionary with the median time of reading an image (ms) and the added peak memory (MB,
+        None if not on Linux)
+    """
+    __script = ("import sys, time, json\nfrom dataHandler import readImage\n"
+                "def peak():\n"
+                "    __status = open('/proc/self/status').read() if sys.platform == 'linux' else ''\n"
+                "    __peak = [int(l.split()[1]) / 1024 for l in __status.splitlines() if l.startswith('VmHWM')]\n"
+                "    return __peak[0] if __peak else None\n"
+                "paths, imgSize, draft, resample, repeats = json.loads(sys.argv[1])\n"
+                "__base = peak()\n"
+                "__times = []\n"
+                "for _ in range(repeats):\n"
+                "    for path in paths:\n"
+                "        __start = time.perf_counter()\n"
+                "        readImage(path, tuple(imgSize), False, None, draft, resample)\n"
+                "        __times.append(time.perf_counter() - __start)\n"
+                "__times.sort()\n"
+                "print(json.dumps({'msPerImage': __times[len(__times) // 2] * 1000, 'peakMB': peak() - __base if __base is not None else None}))")
+    __args = json.dumps([list(paths), list(imgSize), draft, resample, repeats])
+    __out = subprocess.run([sys.executable, "-c", __script, __args], cwd = parent, capture_output = True, text = True)
+    if __out.returncode != 0:
+        raise Exception(f"Reading the images failed:\n{__out.stderr}")
+
+    return json.loads(__out.stdout.strip().splitlines()[-1])
+
+def checkDraftRatios(imgSize = (448, 448)):
+    """
+    Checks that buildDataset_YOLOv1 (tf.io.decode_jpeg with the ratio of jpegDraftRatio) and
+    readImage (PIL's draft) decode JPEGs at the same scale, for source sizes just below, at and just
+    above the multiples of imgSize, where rounding differences would change the scale.
+
+    Args:
+        imgSize: tuple: The size the images are resized to (width, height)
+
+    Returns:
+        A list of (source size, ratio) of the checked images, raises an exception if the decoded 
+        sizes of the two paths differ
+    """
+    __sizes = []
+    for r in (2, 4, 8):
+        for d in (-1, 0, 1):
+            __sizes.append((r * imgSize[0] + d, r * imgSize[1] + 1))
+            __sizes.append((r * imgSize[0] + 1, r * imgSize[1] + d))
+
+    results = []
+    with tempfile.TemporaryDirectory() as __tmp:
+        for width, height in __sizes:
+            __path = os.path.join(__tmp, f"{width}x{height}.jpg")
+            Image.new("RGB", (width, height), (90, 160, 30)).save(__path)
+
+            __ratio = jpegDraftRatio(__path, imgSize)
+            with Image.open(__path) as img:
+                img.draft("RGB", tuple(imgSize))
+                __pilSize = img.size
+            __tfShape = tf.io.decode_jpeg(tf.io.read_file(__path), channels = 3, ratio = __ratio).shape
+            if (__tfShape[1], __tfShape[0]) != __pilSize:
+                raise Exception(f"{width}x{height}: PIL decodes at {__pilSize}, tf.io.decode_jpeg(ratio = {__ratio}) at {__tfShape[1]}x{__tfShape[0]}")
+            results.append(((width, height), __ratio))
+
+    return results
+
+def randomAugmentInputs(batchSize, imgSize, nBoxes = 5, seed = 0):
+    """
+    Returns a random uint8 batch of images and random boxes to augment.
+
+    Args:
+        batchSize: int: Number of images
+        imgSize: tuple: Size of the images (width, height)
+        nBoxes: int: Number of boxes of each image
+        seed: int: The seed of the random generator
+
+    Returns:
+        A tuple of (images, boxes, classes, imgIdx), the inputs of batchAugmenter
+    """
+    __rng = np.random.default_rng(seed)
+    images = __rng.integers(0, 256, (batchSize, imgSize[1], imgSize[0], 3), dtype = np.uint8)
+    __size = __rng.uniform(.05, .5, (batchSize * nBoxes, 2))
+    boxes = np.concatenate([__rng.uniform(__size / 2, 1 - __size / 2), __size], axis = -1).astype(np.float32)
+    classes = __rng.integers(0, 3, batchSize * nBoxes)
+    imgIdx = np.repeat(np.arange(batchSize), nBoxes)
+
+    return images, boxes, classes, imgIdx
+
+def checkAugmentation(imgSize = (64, 48)):
+    """
+    Checks that an augmenter without any random change returns its inputs, and that the same key
+    gives the same batch while another key does not.
+
+    Args:
+        imgSize: tuple: Size of the test images (width, height)
+
+    Returns:
+        True, raises an exception if a check fails
+    """
+    images, boxes, classes, imgIdx = randomAugmentInputs(4, imgSize)
+    for __interpolation in ["nearest", "bilinear"]:
+        __identity = batchAugmenter(0, 0, 0, 1, 1, 0, __interpolation, seed = 0)
+        __out = __identity(images, boxes, classes, imgIdx, (0, 0))
+        if not np.array_equal(__out[0], images) or not np.allclose(__out[1], boxes, atol = 1e-6) or not np.array_equal(__out[2], classes):
+            raise Exception(f"The identity augmentation ({__interpolation}) changed the batch")
+
+        __augmenter = batchAugmenter(interpolation = __interpolation, seed = 0)
+        __a, __b, __c = [__augmenter(images, boxes, classes, imgIdx, key)[0] for key in [(0, 0), (0, 0), (1, 0)]]
+        if not np.array_equal(__a, __b) or np.array_equal(__a, __c):
+            raise Exception(f"The augmentation ({__interpolation}) is not deterministic per key")
+
+    return True
+
+def benchmarkAugment(batchSize, imgSize, interpolation = "bilinear", repeats = 5):
+    """
+    Times the augmentation of a batch (Images and boxes) with the default parameters.
+
+    Args:
+        batchSize: int: Number of images in the batch
+        imgSize: tuple: Size of the images (width, height)
+        interpolation: str: "bilinear" or "nearest"
+        repeats: int: Number of timed batches
+
+    Returns:
+        A dictionary with the statistics of timeRepeats and the median time per image (ms)
+    """
+    images, boxes, classes, imgIdx = randomAugmentInputs(batchSize, imgSize)
+    __augmenter = batchAugmenter(interpolation = interpolation, seed = 0)
+
+    r = timeRepeats(lambda: __augmenter(images, boxes, classes, imgIdx), repeats)
+    r["msPerImage"] = r["ms"] / batchSize
+    return r
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "YOLOv1 benchmarks and numerical checks")
+    parser.add_argument("benchmark", choices = ["loss", "backbones", "imports", "suite", "compare", "decode", "augment"], help = "What to benchmark")
+    parser.add_argument("files", nargs = "*", help = "compare: The baseline and the current results (JSON files written by suite)")
+    parser.add_argument("--variants", nargs = "+", default = ["darknet:1:dense", "darknet:1:conv", "darknet:0.5:conv", "separable:1:conv", "separable:0.5:conv"],
+                        help = "Model variants in backbone:widthMultiplier:head format")
+    parser.add_argument("--imgSize", type = int, nargs = 2, default = (448, 448), help = "Input size of the network (width height) in pixels")
+    parser.add_argument("--batchSize", type = int, default = 64, help = "Batch size of the benchmarks")
+    parser.add_argument("--steps", type = int, default = 50, help = "Number of timed steps")
+    parser.add_argument("--dataDir", default = None, help = "suite: Directory of the synthetic dataset. A temporary one is made if not given")
+    parser.add_argument("--nImages", type = int, default = 256, help = "suite: Number of synthetic images")
+    parser.add_argument("--sourceSize", type = int, nargs = 2, default = (640, 480), help = "suite: Size of the synthetic images (width height)")
+    parser.add_argument("--variant", default = "separable:0.5:conv", help = "suite: The model of the training step, in backbone:widthMultiplier:head format")
+    parser.add_argument("--workers", type = int, default = 0, help = "suite: Number of threads of the data generator")
+    parser.add_argument("--repeats", type = int, default = 5, help = "suite: Number of timed calls of each benchmark")
+    parser.add_argument("--out", default = None, help = "suite: The JSON file to write the results to")
+    parser.add_argument("--baseline", default = None, help = "suite: Compare the results with a previous results file")
+    parser.add_argument("--threshold", type = float, default = .1, help = "suite, compare: Relative slowdown counted as a regression")
+    parser.add_argument("--filters", nargs = "+", default = ["bicubic", "bilinear"], help = "decode: The resampling filters to compare")
+    parser.add_argument("--batchSizes", type = int, nargs = "+", default = [8, 32], help = "augment: The batch sizes to time")
+    args = parser.parse_args()
+
+    if args.benchmark == "loss":
+        __results = checkLossEquivalence()
+        print(f"Loss equivalence: OK ({len(__results)} trials, max gradient difference {max(r[2] for r in __results):.2e})")
+
+        for __name, __fn in [("legacy", YOLOv1_loss_legacy), ("fused", YOLOv1_loss)]:
+            for __jit in [False, True]:
+                __ms = benchmarkLoss(__fn, args.batchSize, args.steps, __jit)
+                print(f"{__name:>7} loss, jit_compile={__jit!s:>5}: {__ms:8.3f} ms/step (forward + backward)")
+
+    if args.benchmark == "backbones":
+        __variants = [(v.split(":")[0], float(v.split(":")[1]), v.split(":")[2]) for v in args.variants]
+        __results = benchmarkBackbones(__variants, YOLOv1_Config(imgSize = args.imgSize), args.batchSize, args.steps)
+
+        print(f"{'Model':>32} {'Params':>12} {'GFLOPs':>8} {'Weights MB':>10} {'Latency ms':>10}")
+        for r in __results:
+            print(f"{r['name']:>32} {r['params']:>12,} {r['GFLOPs']:>8.2f} {r['weightsMB']:>10.1f} {r['latencyMs']:>10.2f}")
+
+    if args.benchmark == "imports":
+        # Annotation parsing and ground truth encoding should only need numpy, pandas and PIL
+        __code = ("import numpy as np, pandas as pd\n"
+                  "df = pd.DataFrame({'id': ['a'], 'objClass': [0], 'boxCenterX': [.5], 'boxCenterY': [.5], 'boxWidth': [.2], 'boxHeight': [.2]})\n"
+                  "offsets, boxes, classes = dataHandler.indexAnnotations(df)\n"
+                  "dataHandler.encodeGroundTruth_YOLOv1(boxes, classes, np.zeros(1, np.int64), 1)")
+        r = checkImports("dataHandler", __code)
+        __peak = f"{r['peakMB']:.0f} MB" if r["peakMB"] is not None else "unknown"
+        print(f"Importing {r['module']}: OK ({r['seconds'] * 1000:.0f} ms, peak memory {__peak}, without tensorflow and matplotlib)")
+
+    if args.benchmark == "suite":
+        # The numbers of different runs are only comparable for the same arguments
+        __meta = {"python": platform.python_version(), "tensorflow": tf.__version__, "numpy": np.__version__, "platform": platform.platform(),
+                  "cpus": os.cpu_count(), "nImages": args.nImages, "sourceSize": list(args.sourceSize), "imgSize": list(args.imgSize),
+                  "batchSize": args.batchSize, "variant": args.variant, "workers": args.workers}
+
+        with tempfile.TemporaryDirectory() as __tmp:
+            __dataDir = args.dataDir or __tmp
+            if not os.path.isdir(os.path.join(__dataDir, "images/train")):
+                makeSyntheticDataset(__dataDir, args.nImages, args.sourceSize)
+
+            __variant = args.variant.split(":")
+            __results = {"meta": __meta, "results": runSuite(__dataDir, YOLOv1_Config(imgSize = args.imgSize), args.batchSize, args.repeats,
+                                                             (__variant[0], float(__variant[1]), __variant[2]), args.workers)}
+
+        print(json.dumps(__results, indent = 2))
+        if args.out is not None:
+            with open(args.out, "w") as f:
+                json.dump(__results, f, indent = 2)
+
+        if args.baseline is not None:
+            with open(args.baseline) as f:
+                __rows = compareResults(json.load(f), __results, args.threshold)
+            printComparison(__rows)
+            sys.exit(1 if any(r[4] == "regression" for r in __rows) else 0)
+
+    if args.benchmark == "compare":
+        if len(args.files) != 2:
+            parser.error("compare needs the baseline and the current results files")
+
+        with open(args.files[0]) as f, open(args.files[1]) as g:
+            __rows = compareResults(json.load(f), json.load(g), args.threshold)
+        printComparison(__rows)
+        sys.exit(1 if any(r[4] == "regression" for r in __rows) else 0)
+
+    if args.benchmark == "decode":
+        __checked = checkDraftRatios(tuple(args.imgSize))
+        print(f"Draft ratios: OK ({len(__checked)} boundary sizes, tf.data and PIL decode at the same scale)")
+
+        # Large synthetic JPEGs (--sourceSize), read with and without the reduced-resolution decoding
+        with tempfile.TemporaryDirectory() as __tmp:
+            __dataDir = args.dataDir or __tmp
+            if not os.path.isdir(os.path.join(__dataDir, "images/train")):
+                makeSyntheticDataset(__dataDir, args.nImages, args.sourceSize)
+            __paths = sorted(glob.glob(os.path.join(__dataDir, "images/train/*.jpg")))[:args.nImages]
+
+            print(f"{len(__paths)} images of {args.sourceSize[0]}x{args.sourceSize[1]} resized to {args.imgSize[0]}x{args.imgSize[1]}")
+            print(f"{'Filter':>10} {'Draft':>6} {'ms/image':>9} {'Peak MB':>8} {'Mean abs diff':>14}")
+            for __filter in args.filters:
+                # The difference of the pixels to the full resolution decoding with the same filter
+                __full = [readImage(path, tuple(args.imgSize), False, None, False, __filter).astype(np.int16) for path in __paths]
+                for __draft in [False, True]:
+                    r = benchmarkDecode(__paths, args.imgSize, __draft, __filter, args.repeats)
+                    __diff = np.mean([np.abs(readImage(path, tuple(args.imgSize), False, None, __draft, __filter) - full).mean() for path, full in zip(__paths, __full)])
+                    __peak = f"{r['peakMB']:8.1f}" if r["peakMB"] is not None else f"{'-':>8}"
+                    print(f"{__filter:>10} {__draft!s:>6} {r['msPerImage']:9.2f} {__peak} {__diff:14.3f}")
+
+    if args.benchmark == "augment":
+        checkAugmentation()
+        print("Augmentation checks: OK (identity, deterministic per key)")
+
+        print(f"{'Interpolation':>13} {'Batch':>6} {'ms/batch':>9} {'ms/image':>9}")
+        for __interpolation in ["nearest", "bilinear"]:
+            for __batchSize in args.batchSizes:
+                r = benchmarkAugment(__batchSize, args.imgSize, __interpolation, args.repeats)
+                print(f"{__interpolation:>13} {__batchSize:>6} {r['ms']:9.1f} {r['msPerImage']:9.2f}")
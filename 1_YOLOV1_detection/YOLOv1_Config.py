@@ -0,0 +1,75 @@
+# YOLOv1 configuration: grid size, number of boxes and classes and the input size of the network
+
+class YOLOv1_Config():
+    """
+    Holds the hyper-parameters that define the shape of a YOLOv1 network: the number of grid cells
+    (S), the number of predicted boxes in each cell (B), the number of classes (C) and the size of the
+    input images. The same object is passed to the model, the data pipelines, the evaluation and the
+    inference, so they always agree on the shapes of the tensors.
+
+    The default values are the ones used in the YOLOv1 paper (S = 7, B = 2, 448x448 images) with one
+    class. For faster inference, a smaller input size (e.g. 224 or 320) and a coarser grid can be used.
+
+    Args:
+        gridCells: tuple: Number of grid cells in each axis of the image (Sx, Sy)
+        nBoxes: int: Number of predicted bounding boxes in each grid cell (B)
+        nClass: int: Number of classes (C)
+        imgSize: tuple: The input size of the network (width, height) in pixels
+    """
+    def __init__(self, gridCells = (7, 7), nBoxes = 2, nClass = 1, imgSize = (448, 448)):
+        """
+        Initializes the object.
+        """
+        self.gridCells = tuple(int(s) for s in gridCells)
+        self.nBoxes = int(nBoxes)
+        self.nClass = int(nClass)
+        self.imgSize = tuple(int(s) for s in imgSize)
+
+        if len(self.gridCells) != 2 or min(self.gridCells) < 1:
+            raise Exception(f"Invalid grid cells: {gridCells}. Should be (Sx, Sy) with positive values")
+        if self.nBoxes < 1 or self.nClass < 1:
+            raise Exception(f"Number of boxes and classes should be positive, got B = {nBoxes} and C = {nClass}")
+        if len(self.imgSize) != 2 or min(self.imgSize) < 1:
+            raise Exception(f"Invalid image size: {imgSize}. Should be (width, height) with positive values")
+
+    def predParams(self):
+        """
+        Returns the parameters of the outputs of the network in (Sx, Sy, B, C) format, as used by
+        decodePredictions.
+        """
+        return self.gridCells + (self.nBoxes, self.nClass)
+
+    def targetParams(self):
+        """
+        Returns the parameters of the ground truth tensors in (Sx, Sy, 1, C) format, as used by
+        encodeGroundTruth_YOLOv1 and encodeGroundTruthTF_YOLOv1. The ground truth has one box per cell.
+        """
+        return self.gridCells + (1, self.nClass)
+
+    def outputShape(self):
+        """
+        Returns the output shape of the network (For each image) in (Sx, Sy, 5*B+C) format.
+        """
+        return self.gridCells + (5 * self.nBoxes + self.nClass,)
+
+    def inputShape(self):
+        """
+        Returns the input shape of the network (For each image) in (height, width, 3) format.
+        """
+        return (self.imgSize[1], self.imgSize[0], 3)
+
+    def toDict(self):
+        """
+        Returns the parameters as a dictionary, for serialization.
+        """
+        return {"gridCells": self.gridCells, "nBoxes": self.nBoxes, "nClass": self.nClass, "imgSize": self.imgSize}
+
+    @classmethod
+    def fromDict(cls, config):
+        """
+        Makes a YOLOv1_Config from the dictionary returned by toDict.
+        """
+        return cls(**config)
+
+    def __repr__(self):
+        return f"YOLOv1_Config(gridCells = {self.gridCells}, nBoxes = {self.nBoxes}, nClass = {self.nClass}, imgSize = {self.imgSize})"
@@ -0,0 +1,344 @@
+# YOLOv1 evaluation: mean average precision of the detections
+import os
+import sys
+import glob
+
+# For importing datahandler methods from the parent directory
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+import numpy as np
+import keras
+from dataHandler import indexAnnotations
+from YOLOv1_Inference import boxIOU, predictImages
+
+class evaluator_YOLOv1():
+    """
+    Accumulates the detections and ground truth boxes of a dataset batch by batch and calculates the
+    average precision (AP) of each class and their mean (mAP) at multiple IOU thresholds, e.g.
+    mAP@0.5 and mAP@[.5:.95].
+
+    The detections of each batch are matched to the ground truth boxes at once, using the pairwise
+    IOU matrix of all boxes. Following the Pascal VOC rule, each detection is matched to the ground
+    truth box of the same class that it overlaps the most. If the IOU is above the threshold and no
+    detection with a higher score has claimed that box, the detection is a true positive, otherwise
+    it is a false positive.
+
+    To keep the memory bounded regardless of the dataset size, by default the true and false 
+    positives are not stored per detection. They are counted in nBins score bins for each class and 
+    threshold, and the precision-recall curves are built from the cumulative counts. This is an 
+    approximation: the detections of a bin are taken as one point of the curve, so the AP can 
+    differ slightly from the exact VOC computation when a bin holds both true and false positives.
+    With nBins = None the scores and the results of every detection are kept and the AP is exact,
+    at the cost of memory that grows with the number of detections.
+    """
+    def __init__(self, nClass, iouThresholds = np.arange(.5, .96, .05), nBins = 1000):
+        """
+        Initializes the evaluator.
+
+        Args:
+            nClass: int: Number of classes.
+            iouThresholds: np.ndarray: The IOU thresholds. The first one is used for the AP of each class.
+            nBins: int: Number of the score bins (Approximate AP). The scores are assumed to be in
+                [0, 1]. If None, every detection is kept and the AP is exact.
+        """
+        self.nClass = nClass
+        self.iouThresholds = np.asarray(iouThresholds, dtype = np.float32)
+        self.nBins = nBins
+        self.reset()
+
+    def reset(self):
+        """
+        Clears the accumulated counts.
+        """
+        self.nGroundTruth = np.zeros(self.nClass, dtype = np.int64)
+
+        # Exact mode: the score, class and true positive flags (At each threshold) of every detection
+        if self.nBins is None:
+            self.scores, self.classes, self.truePositiveFlags = [], [], []
+            return
+
+        __shape = (self.nClass, self.nBins, self.iouThresholds.shape[0])
+        self.truePositives = np.zeros(__shape, dtype = np.int64)
+        self.falsePositives = np.zeros(__shape, dtype = np.int64)
+
+    def update(self, detections, groundTruths):
+        """
+        Matches the detections of a batch of images to their ground truth boxes and accumulates the
+        results.
+
+        Args:
+            detections: list: A tuple of (boxes, scores, classes) for each image. boxes is an array of
+                shape (m, 4) containing [x1, y1, x2, y2] of each box, e.g. the output of nonMaxSuppression.
+            groundTruths: list: A tuple of (boxes, classes) for each image, with boxes in the same
+                format and scale as the detections.
+        """
+        predBoxes, predValid, (predScores, predClasses) = padBoxes([d[0] for d in detections], [d[1:] for d in detections])
+        gtBoxes, gtValid, (gtClasses,) = padBoxes([g[0] for g in groundTruths], [g[1:] for g in groundTruths])
+
+        self.nGroundTruth += np.bincount(gtClasses[gtValid].astype(np.int64), minlength = self.nClass)[:self.nClass]
+
+        truePositive = matchDetections(predBoxes, predScores, predClasses, predValid, gtBoxes, gtClasses, gtValid, self.iouThresholds)
+
+        if self.nBins is None:
+            self.scores.append(predScores[predValid])
+            self.classes.append(predClasses[predValid].astype(np.int64))
+            self.truePositiveFlags.append(truePositive[predValid])
+            return
+
+        # Count the true and false positives of each (class, score bin, threshold)
+        __T = self.iouThresholds.shape[0]
+        __bins = np.clip((predScores[predValid] * self.nBins).astype(np.int64), 0, self.nBins - 1)
+        __cells = (predClasses[predValid].astype(np.int64) * self.nBins + __bins)[:, None] * __T + np.arange(__T)
+        __size = self.nClass * self.nBins * __T
+        __tp = truePositive[predValid]
+        self.truePositives += np.bincount(__cells[__tp], minlength = __size).reshape(self.truePositives.shape)
+        self.falsePositives += np.bincount(__cells[~__tp], minlength = __size).reshape(self.falsePositives.shape)
+
+    def result(self):
+        """
+        Calculates the average precision of each class at each threshold from the accumulated counts
+        (Or the detections in the exact mode), using the all-points interpolation (Area under the 
+        precision envelope). Classes without any ground truth boxes are not included in the means.
+
+        Returns:
+            A dictionary containing mAP50 (mAP at the first threshold), mAP50_95 (mAP averaged over
+            all thresholds) and AP50 (a list of the AP of each class at the first threshold, None for
+            classes without ground truth boxes).
+        """
+        # Cumulative counts from the highest score bin (Or detection) to the lowest
+        __tp, __fp = self.__sortedCounts()
+        __tp = np.cumsum(__tp, axis = 1)
+        __fp = np.cumsum(__fp, axis = 1)
+
+        __nGT = np.maximum(self.nGroundTruth, 1)[:, None, None]
+        recall = __tp / __nGT
+        precision = np.divide(__tp, __tp + __fp, out = np.zeros(__tp.shape), where = 0 < __tp + __fp)
+
+        # The precision envelope and the area under it
+        precision = np.maximum.accumulate(precision[:, ::-1], axis = 1)[:, ::-1]
+        __deltaRecall = np.diff(recall, axis = 1, prepend = 0.)
+        AP = np.sum(__deltaRecall * precision, axis = 1) # (nClass, nThresholds)
+
+        __hasGT = 0 < self.nGroundTruth
+        if not np.any(__hasGT):
+            return {"mAP50": 0., "mAP50_95": 0., "AP50": [None] * self.nClass}
+
+        return {
+            "mAP50": float(np.mean(AP[__hasGT, 0])),
+            "mAP50_95": float(np.mean(AP[__hasGT])),
+            "AP50": [float(AP[c, 0]) if __hasGT[c] else None for c in range(self.nClass)],
+        }
+
+    def __sortedCounts(self):
+        """
+        Returns the true and false positive counts of shape (nClass, K, nThresholds), ordered from the
+        highest score to the lowest. In the exact mode each detection is one of the K points (Padded 
+        with zero counts, which do not change the curves), otherwise each score bin.
+        """
+        if self.nBins is not None:
+            return self.truePositives[:, ::-1], self.falsePositives[:, ::-1]
+
+        __T = self.iouThresholds.shape[0]
+        __scores = np.concatenate(self.scores + [np.zeros(0)])
+        __classes = np.concatenate(self.classes + [np.zeros(0, dtype = np.int64)])
+        __flags = np.concatenate(self.truePositiveFlags + [np.zeros((0, __T), dtype = bool)])
+
+        # Sort by class, then by descending score, and find the position of each detection in its class
+        __order = np.lexsort((-__scores, __classes))
+        __classes, __flags = __classes[__order], __flags[__order]
+        __counts = np.bincount(__classes, minlength = self.nClass)[:self.nClass]
+        __rank = np.arange(__classes.shape[0]) - np.repeat(np.cumsum(__counts) - __counts, __counts)
+
+        __shape = (self.nClass, max(int(__counts.max()) if 0 < self.nClass else 0, 1), __T)
+        tp, fp = np.zeros(__shape, dtype = np.int64), np.zeros(__shape, dtype = np.int64)
+        tp[__classes, __rank] = __flags
+        fp[__classes, __rank] = ~__flags
+
+        return tp, fp
+
+def padBoxes(boxes, others):
+    """
+    Pads the variable number of boxes of each image to arrays of the same size, so a batch can be
+    processed at once.
+
+    Args:
+        boxes: list: An array of shape (m, 4) for each image.
+        others: list: A tuple of arrays of shape (m,) for each image, e.g. (scores, classes).
+
+    Returns:
+        boxes: np.ndarray: Array of shape (N, M, 4), where M is the maximum number of boxes.
+        valid: np.ndarray: Boolean array of shape (N, M), False for the padded boxes.
+        others: tuple: Arrays of shape (N, M), zero for the padded boxes.
+    """
+    __N = len(boxes)
+    __counts = np.array([len(b) for b in boxes], dtype = np.int64)
+    __M = int(__counts.max()) if 0 < __N else 0
+
+    valid = np.arange(__M)[None, :] < __counts[:, None]
+    __boxes = np.zeros((__N, __M, 4), dtype = np.float32)
+    __boxes[valid] = np.concatenate([np.reshape(b, (-1, 4)) for b in boxes] + [np.zeros((0, 4))])
+
+    __others = []
+    for k in range(len(others[0]) if 0 < __N else 0):
+        __array = np.zeros((__N, __M), dtype = np.float32)
+        __array[valid] = np.concatenate([np.ravel(o[k]) for o in others] + [np.zeros(0)])
+        __others.append(__array)
+
+    return __boxes, valid, tuple(__others)
+
+def matchDetections(predBoxes, predScores, predClasses, predValid, gtBoxes, gtClasses, gtValid, iouThresholds):
+    """
+    Marks the true positive detections of a batch of images at multiple IOU thresholds, without
+    iterating through the boxes. See evaluator_YOLOv1 for the matching rule.
+
+    Args:
+        predBoxes, predScores, predClasses, predValid: np.ndarray: The padded detections, outputs of
+            padBoxes, of shapes (N, P, 4), (N, P), (N, P) and (N, P).
+        gtBoxes, gtClasses, gtValid: np.ndarray: The padded ground truth boxes of shapes (N, G, 4),
+            (N, G) and (N, G).
+        iouThresholds: np.ndarray: The IOU thresholds, shape (T,).
+
+    Returns:
+        A boolean array of shape (N, P, T), True for the true positive detections.
+    """
+    __N, __P = predScores.shape
+    __G = gtBoxes.shape[1]
+    __T = iouThresholds.shape[0]
+
+    truePositive = np.zeros((__N, __P, __T), dtype = bool)
+    if __P == 0 or __G == 0:
+        return truePositive
+
+    # The best ground truth box of the same class for each detection
+    __iou = boxIOU(predBoxes, gtBoxes)
+    __iou = np.where((predClasses[:, :, None] == gtClasses[:, None, :]) & gtValid[:, None, :], __iou, -1.)
+    bestGT = np.argmax(__iou, axis = -1)
+    bestIOU = np.max(__iou, axis = -1)
+
+    # Visit the detections of each image from the highest score to the lowest
+    __order = np.argsort(-np.where(predValid, predScores, -np.inf), axis = -1, kind = "stable")
+    bestGT = np.take_along_axis(bestGT, __order, axis = 1)
+    bestIOU = np.take_along_axis(bestIOU, __order, axis = 1)
+    __valid = np.take_along_axis(predValid, __order, axis = 1)
+
+    # Each detection claims its best box at every threshold that its IOU passes. The first claim of
+    # each (image, box, threshold) in the visiting order is the true positive.
+    __claims = __valid[:, :, None] & (iouThresholds[None, None, :] <= bestIOU[:, :, None])
+    __keys = ((np.arange(__N)[:, None] * __G + bestGT)[:, :, None] * __T + np.arange(__T)).ravel()
+    __claimIdx = np.flatnonzero(__claims.ravel())
+    _, __first = np.unique(__keys[__claimIdx], return_index = True)
+
+    __sortedTP = np.zeros(__N * __P * __T, dtype = bool)
+    __sortedTP[__claimIdx[__first]] = True
+
+    # Back to the original order of the detections
+    np.put_along_axis(truePositive, __order[:, :, None], __sortedTP.reshape(__N, __P, __T), axis = 1)
+
+    return truePositive
+
+def groundTruthBoxes(annotIndex, lstImageId):
+    """
+    Returns the ground truth boxes of a list of images in [x1, y1, x2, y2] format, relative to the
+    entire image.
+
+    Args:
+        annotIndex: tuple: The grouped annotations, returned from indexAnnotations method.
+        lstImageId: list: The image IDs.
+
+    Returns:
+        A list containing a tuple of (boxes, classes) for each image.
+    """
+    offsets, boxes, classes = annotIndex
+    boxes = np.concatenate([boxes[:, :2] - boxes[:, 2:] / 2, boxes[:, :2] + boxes[:, 2:] / 2], axis = -1)
+
+    results = []
+    for id in lstImageId:
+        start, stop = offsets.get(id, (0, 0))
+        results.append((boxes[start:stop], classes[start:stop]))
+
+    return results
+
+def evaluateDataset(model, imgDir, annotDf, nClass, batchSize = 8, imgSize = (448, 448), params = (7, 7, 2, 1),
+                    scoreThreshold = .01, iouThreshold = .5, maxDetections = 100, nBins = 1000):
+    """
+    Runs the model on all images of a directory and evaluates the detections against the annotations.
+    The images are streamed in batches by predictImages, so only one batch of detections is held
+    in memory at a time.
+
+    Args:
+        model: tf.keras.Model: The YOLOv1 model.
+        imgDir: str: The directory containing the jpg images.
+        annotDf: pd.DataFrame: A pandas dataFrame containing the annotations.
+        nClass: int: Number of classes.
+        batchSize: int: Number of images in each batch.
+        imgSize: tuple: The input size of the model (width,height) in pixels.
+        params: tuple: A tuple containing the output parameters of the model (Sx, Sy, B, C)
+        scoreThreshold: float: Detections with a lower class-conditional score are discarded.
+        iouThreshold: float: The IOU threshold of non-max suppression.
+        maxDetections: int: Maximum number of detections for each image.
+        nBins: int: Number of the score bins of evaluator_YOLOv1 (Approximate AP), None for the 
+            exact AP.
+
+    Returns:
+        The dictionary returned by evaluator_YOLOv1.result
+    """
+    evaluator = evaluator_YOLOv1(nClass, nBins = nBins)
+    __annotIndex = indexAnnotations(annotDf)
+    __paths = sorted(glob.glob(f"{imgDir}/*.jpg"))
+
+    __batch = []
+    __detections = predictImages(model, __paths, batchSize, imgSize, params, scoreThreshold, iouThreshold, 
+                                 maxDetections, relativeBoxes = True)
+    for k, (path, boxes, scores, classes) in enumerate(__detections):
+        __batch.append((path, boxes, scores, classes))
+
+        if len(__batch) == batchSize or k == len(__paths) - 1:
+            __ids = [os.path.basename(p)[:-len(".jpg")] for p, *_ in __batch]
+            evaluator.update([d[1:] for d in __batch], groundTruthBoxes(__annotIndex, __ids))
+            __batch = []
+
+    return evaluator.result()
+
+class evaluationCallback(keras.callbacks.Callback):
+    """
+    Evaluates the model on a validation dataset every few epochs and adds val_mAP50 and val_mAP50_95 
+    to the logs, so they are printed and can be monitored by other callbacks (e.g. ModelCheckpoint, 
+    if it is placed after this callback).
+
+    Args:
+        imgDir: str: The directory containing the jpg images of the validation dataset.
+        annotDf: pd.DataFrame: A pandas dataFrame containing the annotations of the validation dataset.
+        nClass: int: Number of classes.
+        everyNEpochs: int: The evaluation frequency.
+        kwargs: The rest of the arguments of evaluateDataset.
+    """
+    def __init__(self, imgDir, annotDf, nClass, everyNEpochs = 5, **kwargs):
+        """
+        Initialized the class
+        """
+        super(evaluationCallback, self).__init__()
+        self.imgDir = imgDir
+        self.annotDf = annotDf
+        self.nClass = nClass
+        self.everyNEpochs = everyNEpochs
+        self.kwargs = kwargs
+
+    def on_epoch_end(self, epoch, logs=None):
+        """
+        Runs on the epoch end.
+
+        Args:
+            epoch: int: The current epoch number.
+        """
+        if (epoch + 1) % self.everyNEpochs != 0:
+            return
+
+        results = evaluateDataset(self.model, self.imgDir, self.annotDf, self.nClass, **self.kwargs)
+
+        if logs is not None:
+            logs["val_mAP50"] = results["mAP50"]
+            logs["val_mAP50_95"] = results["mAP50_95"]
+
+        print(f"\nEpoch {epoch + 1}: mAP@0.5 = {results['mAP50']:.4f}, mAP@[.5:.95] = {results['mAP50_95']:.4f}")
@@ -0,0 +1,318 @@
+# Exporting a trained YOLOv1 model to inference artifacts: a serving SavedModel with the decoder and
+# non-max suppression built in, and a TFLite model with post-training int8 quantization. Example:
+#   python YOLOv1_Export.py --model ./model_data/model_100-1.23.keras --out ./export \
+#       --calibImages ../data/images/train --calibLabels ../data/labels/train
+import os
+import sys
+import json
+import time
+import argparse
+
+# For importing datahandler methods from the parent directory
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.framework.convert_to_constants import convert_variables_to_constants_v2
+from dataHandler import annotationsToDataframe
+from dataPipeline import dataGenerator_YOLOv1
+from YOLOv1_Config import YOLOv1_Config
+from YOLOv1_Reshape_Layer import YOLOv1_LastLayer_Reshape
+from YOLOv1_Inference import decodePredictions, nonMaxSuppression, decodePredictionsTF, nonMaxSuppressionTF
+import YOLOv1_Loss # Registers the loss, so the compiled checkpoints can be loaded
+
+def loadModel(path):
+    """
+    Loads a model saved by ModelCheckpoint (.keras file) for inference.
+
+    Args:
+        path: str: Path of the .keras file
+
+    Returns:
+        The tf.keras.Model
+    """
+    return tf.keras.models.load_model(path, compile = False)
+
+def configFromModel(model):
+    """
+    Reads the YOLOv1_Config of a model from its input and output shapes.
+
+    Args:
+        model: tf.keras.Model: A YOLOv1 model, ending with YOLOv1_LastLayer_Reshape
+
+    Returns:
+        A YOLOv1_Config
+    """
+    __reshape = [layer for layer in model.layers if isinstance(layer, YOLOv1_LastLayer_Reshape)]
+    if len(__reshape) == 0:
+        raise Exception(f"The model {model.name} does not have a YOLOv1_LastLayer_Reshape layer")
+
+    __Sx, __Sy, __D = model.output.shape[1:]
+    __B = __reshape[-1].nBoxes
+    __H, __W = model.input.shape[1:3]
+
+    return YOLOv1_Config((__Sx, __Sy), __B, __D - 5 * __B, (__W, __H))
+
+def pixelsToInput(model, pixels):
+    """
+    Converts raw pixels (0 to 255) to the input of the model: uint8 models normalize the images
+    themselves, the others get images normalized to [0, 1].
+    """
+    if model.input.dtype == "uint8":
+        return tf.cast(pixels, tf.uint8)
+    return tf.cast(pixels, tf.float32) / 255.
+
+class servingModule_YOLOv1(tf.Module):
+    """
+    A tf.Module for serving a YOLOv1 model. The serving function takes a batch of uint8 images
+    (Resized to the input size of the model) and returns the detections after decoding and non-max
+    suppression, so the clients do not need any of the code of this repository.
+
+    Args:
+        model: tf.keras.Model: The YOLOv1 model
+        config: YOLOv1_Config: The configuration of the model, see configFromModel
+        scoreThreshold: float: Boxes with a lower class-conditional score are discarded
+        iouThreshold: float: The IOU threshold of non-max suppression
+        maxDetections: int: Maximum number of the returned boxes for each image
+    """
+    def __init__(self, model, config, scoreThreshold = .2, iouThreshold = .5, maxDetections = 100):
+        """
+        Initializes the module.
+        """
+        super().__init__()
+        self.model = model
+        self.config = config
+        self.scoreThreshold = scoreThreshold
+        self.iouThreshold = iouThreshold
+        self.maxDetections = maxDetections
+
+        self.serve = tf.function(self.__serve, input_signature = [tf.TensorSpec((None,) + config.inputShape(), tf.uint8, name = "images")])
+
+    def __serve(self, images):
+        """
+        Returns a dictionary of the padded detections: "boxes" (N, maxDetections, 4) as [x1, y1, x2, y2]
+        relative to the image size, "scores" (N, maxDetections), "classes" (N, maxDetections), -1 for
+        the padded boxes and "nDetections" (N,).
+        """
+        yPred = self.model(pixelsToInput(self.model, images), training = False)
+        __decoded = decodePredictionsTF(yPred, self.config.predParams(), self.scoreThreshold)
+        boxes, scores, classes, nDetections = nonMaxSuppressionTF(*__decoded, self.iouThreshold, self.maxDetections)
+
+        return {"boxes": boxes, "scores": scores, "classes": classes, "nDetections": nDetections}
+
+def exportSavedModel(model, outDir, config = None, scoreThreshold = .2, iouThreshold = .5, maxDetections = 100):
+    """
+    Exports a serving SavedModel, with the decoder and non-max suppression built in. See
+    servingModule_YOLOv1 for the inputs and outputs of the "serving_default" signature.
+
+    Args:
+        model: tf.keras.Model: The YOLOv1 model
+        outDir: str: The directory of the SavedModel
+        config: YOLOv1_Config: The configuration of the model. Read from the model if None.
+        scoreThreshold, iouThreshold, maxDetections: See servingModule_YOLOv1
+
+    Returns:
+        outDir
+    """
+    config = config if config is not None else configFromModel(model)
+    module = servingModule_YOLOv1(model, config, scoreThreshold, iouThreshold, maxDetections)
+    tf.saved_model.save(module, outDir, signatures = {"serving_default": module.serve})
+
+    return outDir
+
+def calibrationSamples(imgDir, annotDf, config, nSamples = 100, seed = 0):
+    """
+    Yields a random sample of the images of a dataset for calibrating the quantization, read by
+    dataGenerator_YOLOv1 (So they are preprocessed exactly like the training data).
+
+    Args:
+        imgDir: str: The directory of the images
+        annotDf: pd.DataFrame: The annotations of the images
+        config: YOLOv1_Config: The configuration of the model
+        nSamples: int: Number of images
+        seed: int: Seed of the random sample
+
+    Yields:
+        uint8 images of shape (1, height, width, 3)
+    """
+    generator = dataGenerator_YOLOv1(imgDir, 1, config.imgSize, annotDf, config.nClass, True, config.gridCells,
+                                     seed = seed, imgDtype = np.uint8)
+    for i in range(min(nSamples, len(generator))):
+        yield generator[i][0]
+
+def exportTFLite(model, outPath, calibration = None):
+    """
+    Converts the model (Without the decoder and non-max suppression, which are cheap to run on the
+    host by decodePredictions and nonMaxSuppression) to TFLite. If calibration samples are given,
+    the weights and activations are quantized to int8 (Ops without an int8 kernel stay in float).
+    The TFLite model takes uint8 images of shape (1, height, width, 3) and returns float32 outputs.
+
+    Args:
+        model: tf.keras.Model: The YOLOv1 model
+        outPath: str: Path of the .tflite file
+        calibration: iterable: uint8 images of shape (1, height, width, 3), see calibrationSamples.
+            None for a float32 model.
+
+    Returns:
+        outPath
+    """
+    __H, __W = model.input.shape[1:3]
+
+    # The pixels are fed as float and quantized to uint8 by the converter (scale 1, zero point 0)
+    @tf.function(input_signature = [tf.TensorSpec((1, __H, __W, 3), tf.float32)])
+    def __forward(pixels):
+        return model(pixelsToInput(model, pixels), training = False)
+
+    # The variables are frozen, otherwise the converter keeps them as resource variables
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([convert_variables_to_constants_v2(__forward.get_concrete_function())])
+
+    if calibration is not None:
+        __samples = [img.astype(np.float32) for img in calibration]
+        if len(__samples) == 0:
+            raise Exception("No calibration samples")
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([img] for img in __samples)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8, tf.lite.OpsSet.TFLITE_BUILTINS]
+        converter.inference_input_type = tf.uint8
+        converter.inference_output_type = tf.float32
+
+    with open(outPath, "wb") as f:
+        f.write(converter.convert())
+
+    return outPath
+
+def runTFLite(path, images, nThreads = None):
+    """
+    Runs a TFLite model exported by exportTFLite on a batch of uint8 images, one image at a time.
+
+    Args:
+        path: str: Path of the .tflite file
+        images: np.ndarray: uint8 images of shape (N, height, width, 3)
+        nThreads: int: Number of threads of the interpreter. All the cores if None.
+
+    Returns:
+        The outputs of the model, shape (N, Sx, Sy, 5*B+C)
+    """
+    interpreter = tf.lite.Interpreter(model_path = path, num_threads = nThreads or os.cpu_count())
+    interpreter.allocate_tensors()
+    __input = interpreter.get_input_details()[0]
+    __output = interpreter.get_output_details()[0]
+
+    outputs = []
+    for img in images:
+        interpreter.set_tensor(__input["index"], img[None].astype(__input["dtype"]))
+        interpreter.invoke()
+        outputs.append(interpreter.get_tensor(__output["index"])[0])
+
+    return np.stack(outputs)
+
+def pathSize(path):
+    """
+    Returns the size of a file, or the total size of the files of a directory, in bytes.
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+def timeIt(fn, nSteps = 20):
+    """
+    Returns the average time of calling fn in milliseconds, after one warm-up call.
+    """
+    fn()
+    __start = time.perf_counter()
+    for _ in range(nSteps):
+        fn()
+    return (time.perf_counter() - __start) / nSteps * 1000
+
+def exportReport(modelPath, model, config, savedModelDir, tflitePaths, images, nSteps = 20):
+    """
+    Measures the size and the CPU latency (Batch size 1, including decoding and non-max suppression)
+    of the original model and the exported artifacts, and the mean absolute difference of the
+    outputs of the TFLite models from the original model.
+
+    Args:
+        modelPath: str: Path of the .keras file
+        model: tf.keras.Model: The original model
+        config: YOLOv1_Config: The configuration of the model
+        savedModelDir: str: Directory of the serving SavedModel
+        tflitePaths: dict: Names and paths of the TFLite models
+        images: np.ndarray: uint8 images of shape (N, height, width, 3) for measuring the output difference
+        nSteps: int: Number of timed runs
+
+    Returns:
+        A list of dictionaries with "artifact", "sizeMB", "latencyMs" and "meanAbsError" keys
+    """
+    __img = images[:1]
+    __expected = model.predict_on_batch(pixelsToInput(model, images))
+
+    # The original model, with the decoder and non-max suppression on the host
+    def __keras():
+        yPred = model.predict_on_batch(pixelsToInput(model, __img))
+        return nonMaxSuppression(*decodePredictions(yPred, config.predParams(), .2))
+
+    report = [{"artifact": "keras", "sizeMB": pathSize(modelPath) / 2**20, "latencyMs": timeIt(__keras, nSteps), "meanAbsError": 0.}]
+
+    __serving = tf.saved_model.load(savedModelDir).signatures["serving_default"]
+    report.append({"artifact": "savedmodel", "sizeMB": pathSize(savedModelDir) / 2**20,
+                   "latencyMs": timeIt(lambda: __serving(images = tf.constant(__img)), nSteps), "meanAbsError": 0.})
+
+    for name, path in tflitePaths.items():
+        interpreter = tf.lite.Interpreter(model_path = path, num_threads = os.cpu_count())
+        interpreter.allocate_tensors()
+        __input = interpreter.get_input_details()[0]
+        __output = interpreter.get_output_details()[0]
+
+        def __tflite():
+            interpreter.set_tensor(__input["index"], __img.astype(__input["dtype"]))
+            interpreter.invoke()
+            yPred = interpreter.get_tensor(__output["index"])
+            return nonMaxSuppression(*decodePredictions(yPred, config.predParams(), .2))
+
+        report.append({"artifact": name, "sizeMB": pathSize(path) / 2**20, "latencyMs": timeIt(__tflite, nSteps),
+                       "meanAbsError": float(np.abs(runTFLite(path, images) - __expected).mean())})
+
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Exports a trained YOLOv1 model to a serving SavedModel and TFLite.")
+    parser.add_argument("--model", required = True, help = "Path of the .keras model")
+    parser.add_argument("--out", required = True, help = "The output directory")
+    parser.add_argument("--calibImages", default = None, help = "Images for calibrating the int8 quantization")
+    parser.add_argument("--calibLabels", default = None, help = "Labels of the calibration images")
+    parser.add_argument("--calibSamples", type = int, default = 100, help = "Number of calibration images")
+    parser.add_argument("--scoreThreshold", type = float, default = .2, help = "Score threshold of the serving model")
+    parser.add_argument("--iouThreshold", type = float, default = .5, help = "IOU threshold of non-max suppression of the serving model")
+    parser.add_argument("--maxDetections", type = int, default = 100, help = "Maximum number of detections of the serving model")
+    parser.add_argument("--steps", type = int, default = 20, help = "Number of timed runs of the latency report")
+    args = parser.parse_args()
+
+    if (args.calibImages is None) != (args.calibLabels is None):
+        parser.error("Both --calibImages and --calibLabels are needed for the int8 quantization")
+
+    os.makedirs(args.out, exist_ok = True)
+    model = loadModel(args.model)
+    config = configFromModel(model)
+    print(f"Loaded {model.name}: {config}")
+
+    savedModelDir = exportSavedModel(model, os.path.join(args.out, "savedmodel"), config, args.scoreThreshold,
+                                     args.iouThreshold, args.maxDetections)
+    tflitePaths = {"tflite_float32": exportTFLite(model, os.path.join(args.out, "model_float32.tflite"))}
+
+    if args.calibImages is not None:
+        __df = annotationsToDataframe(args.calibLabels, "txt")
+        __samples = list(calibrationSamples(args.calibImages, __df, config, args.calibSamples))
+        tflitePaths["tflite_int8"] = exportTFLite(model, os.path.join(args.out, "model_int8.tflite"), __samples)
+        __images = np.concatenate(__samples[:8])
+    else:
+        __images = np.random.default_rng(0).integers(0, 256, (8,) + config.inputShape(), dtype = np.uint8)
+
+    report = exportReport(args.model, model, config, savedModelDir, tflitePaths, __images, args.steps)
+    with open(os.path.join(args.out, "report.json"), "w") as f:
+        json.dump({"config": config.toDict(), "artifacts": report}, f, indent = 2)
+
+    print(f"{'Artifact':>16} {'Size MB':>10} {'Latency ms':>11} {'Mean abs error':>15}")
+    for r in report:
+        print(f"{r['artifact']:>16} {r['sizeMB']:>10.2f} {r['latencyMs']:>11.2f} {r['meanAbsError']:>15.5f}")
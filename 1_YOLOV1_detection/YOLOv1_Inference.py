@@ -0,0 +1,285 @@
+# YOLOv1 inference: decoding the output tensors to boxes and non-max suppression
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# For importing datahandler methods from the parent directory
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+from dataHandler import readImage
+
+def decodePredictions(yPred, params = (7, 7, 2, 1), scoreThreshold = 0., bestBoxOnly = True):
+    """
+    Decodes the output of YOLOv1_LastLayer_Reshape to boxes. Each grid cell has the following
+    parameters: [<C class probabilities>, <B confidence scores>, <B times (relX, relY, width, height)>]
+    where relX and relY are relative to the top-left corner of the grid cell and width and height are
+    relative to the entire image. The calculations are done for all cells of all images at once.
+    Class-conditional score of each box is its confidence score multiplied by the probability of the
+    most probable class of its cell.
+
+    Args:
+        yPred: np.ndarray: The network output of shape (N, Sx, Sy, 5*B + C).
+        params: tuple: A tuple containing parameters (Sx, Sy, B, C)
+        scoreThreshold: float: Boxes with a lower class-conditional score are marked as invalid.
+        bestBoxOnly: bool: Only keep the box with the higher confidence score in each cell.
+
+    Returns:
+        boxes: np.ndarray: Array of shape (N, K, 4) containing [x1, y1, x2, y2] of each box, relative
+            to the entire image and clipped to [0, 1]. K is Sx*Sy if bestBoxOnly, else Sx*Sy*B.
+        scores: np.ndarray: Array of shape (N, K), the class-conditional scores.
+        classes: np.ndarray: Array of shape (N, K), the predicted classes.
+        valid: np.ndarray: Boolean array of shape (N, K), the boxes with a score above scoreThreshold.
+    """
+    __Sx, __Sy, __B, __C = params
+    yPred = np.asarray(yPred, dtype = np.float32)
+    __N = yPred.shape[0]
+
+    classProbs = yPred[..., :__C]
+    confScores = yPred[..., __C:__C + __B]
+    coords = yPred[..., __C + __B:].reshape(__N, __Sx, __Sy, __B, 4)
+
+    # Centers relative to the entire image. The first axis of the grid is x and the second one is y.
+    cellX = np.arange(__Sx, dtype = np.float32).reshape(1, __Sx, 1, 1)
+    cellY = np.arange(__Sy, dtype = np.float32).reshape(1, 1, __Sy, 1)
+    centerX = (coords[..., 0] + cellX) / __Sx
+    centerY = (coords[..., 1] + cellY) / __Sy
+    halfW = coords[..., 2] / 2
+    halfH = coords[..., 3] / 2
+    boxes = np.clip(np.stack([centerX - halfW, centerY - halfH, centerX + halfW, centerY + halfH], axis = -1), 0., 1.)
+
+    # Each cell predicts one class for all of its boxes
+    classes = np.broadcast_to(np.argmax(classProbs, axis = -1)[..., None], confScores.shape)
+    scores = confScores * np.max(classProbs, axis = -1, keepdims = True)
+
+    if bestBoxOnly == True:
+        __best = np.argmax(confScores, axis = -1)[..., None]
+        boxes = np.take_along_axis(boxes, __best[..., None], axis = 3)
+        scores = np.take_along_axis(scores, __best, axis = -1)
+        classes = np.take_along_axis(classes, __best, axis = -1)
+
+    boxes = boxes.reshape(__N, -1, 4)
+    scores = scores.reshape(__N, -1)
+    classes = classes.reshape(__N, -1)
+
+    return boxes, scores, classes, scoreThreshold < scores
+
+def boxIOU(boxes1, boxes2):
+    """
+    Calculates the pairwise intersection over union of two sets of boxes, for all pairs at once.
+
+    Args:
+        boxes1, boxes2: np.ndarray: Arrays of shape (..., K1, 4) and (..., K2, 4) containing
+            [x1, y1, x2, y2] of each box.
+
+    Returns:
+        An array of shape (..., K1, K2)
+    """
+    __topLeft = np.maximum(boxes1[..., :, None, :2], boxes2[..., None, :, :2])
+    __bottomRight = np.minimum(boxes1[..., :, None, 2:], boxes2[..., None, :, 2:])
+    intersectArea = np.prod(np.clip(__bottomRight - __topLeft, 0, None), axis = -1)
+
+    __area1 = np.prod(np.clip(boxes1[..., 2:] - boxes1[..., :2], 0, None), axis = -1)
+    __area2 = np.prod(np.clip(boxes2[..., 2:] - boxes2[..., :2], 0, None), axis = -1)
+    unionArea = __area1[..., :, None] + __area2[..., None, :] - intersectArea
+
+    return np.divide(intersectArea, unionArea, out = np.zeros_like(intersectArea), where = 0 < unionArea)
+
+def nonMaxSuppression(boxes, scores, classes, valid, iouThreshold = .5, maxDetections = 100):
+    """
+    Class-aware non-max suppression for a batch of images, without iterating through the boxes.
+    The boxes of each image are sorted by their scores and the IOU matrix of all pairs is calculated
+    at once. A box is kept if no kept box with a higher score and the same class overlaps it by more
+    than iouThreshold. This condition is solved by a fixed-point iteration on the whole matrix
+    (Cluster-NMS), which gives the exact same result as the greedy algorithm in a few matrix
+    operations.
+
+    Args:
+        boxes, scores, classes, valid: np.ndarray: Outputs of decodePredictions.
+        iouThreshold: float: Boxes overlapping a kept box more than this are suppressed.
+        maxDetections: int: Maximum number of the returned boxes for each image.
+
+    Returns:
+        A list containing a tuple of (boxes, scores, classes) for each image, sorted by the scores.
+    """
+    __order = np.argsort(-np.where(valid, scores, -np.inf), axis = -1, kind = "stable")
+    boxes = np.take_along_axis(boxes, __order[..., None], axis = 1)
+    scores = np.take_along_axis(scores, __order, axis = 1)
+    classes = np.take_along_axis(classes, __order, axis = 1)
+    valid = np.take_along_axis(valid, __order, axis = 1)
+
+    # suppress[n, j, i]: box j suppresses box i if it has a higher score, same class and big overlap
+    __K = boxes.shape[1]
+    suppress = (iouThreshold < boxIOU(boxes, boxes)) & (classes[:, :, None] == classes[:, None, :])
+    suppress &= np.triu(np.ones((__K, __K), dtype = bool), k = 1)
+    suppress &= valid[:, :, None]
+
+    keep = valid
+    for _ in range(__K):
+        __newKeep = valid & ~np.any(suppress & keep[:, :, None], axis = 1)
+        if np.array_equal(__newKeep, keep):
+            break
+        keep = __newKeep
+
+    results = []
+    for n in range(boxes.shape[0]):
+        __idx = np.flatnonzero(keep[n])[:maxDetections]
+        results.append((boxes[n, __idx], scores[n, __idx], classes[n, __idx]))
+
+    return results
+
+def decodePredictionsTF(yPred, params = (7, 7, 2, 1), scoreThreshold = 0., bestBoxOnly = True):
+    """
+    Same as decodePredictions, with tensorflow operations so it can be a part of the graph.
+
+    Args:
+        yPred: tf.Tensor: The network output of shape (N, Sx, Sy, 5*B + C).
+        params: tuple: A tuple containing parameters (Sx, Sy, B, C)
+        scoreThreshold: float: Boxes with a lower class-conditional score are marked as invalid.
+        bestBoxOnly: bool: Only keep the box with the higher confidence score in each cell.
+
+    Returns:
+        boxes, scores, classes, valid: tf.Tensor: See decodePredictions.
+    """
+    __Sx, __Sy, __B, __C = params
+    yPred = tf.cast(yPred, tf.float32)
+    __N = tf.shape(yPred)[0]
+
+    classProbs = yPred[..., :__C]
+    confScores = yPred[..., __C:__C + __B]
+    coords = tf.reshape(yPred[..., __C + __B:], (__N, __Sx, __Sy, __B, 4))
+
+    cellX = tf.reshape(tf.range(__Sx, dtype = tf.float32), (1, __Sx, 1, 1))
+    cellY = tf.reshape(tf.range(__Sy, dtype = tf.float32), (1, 1, __Sy, 1))
+    centerX = (coords[..., 0] + cellX) / __Sx
+    centerY = (coords[..., 1] + cellY) / __Sy
+    halfW = coords[..., 2] / 2
+    halfH = coords[..., 3] / 2
+    boxes = tf.clip_by_value(tf.stack([centerX - halfW, centerY - halfH, centerX + halfW, centerY + halfH], axis = -1), 0., 1.)
+
+    classes = tf.broadcast_to(tf.argmax(classProbs, axis = -1, output_type = tf.int32)[..., None], tf.shape(confScores))
+    scores = confScores * tf.reduce_max(classProbs, axis = -1, keepdims = True)
+
+    if bestBoxOnly == True:
+        __best = tf.argmax(confScores, axis = -1, output_type = tf.int32)[..., None]
+        boxes = tf.gather(boxes, __best, axis = 3, batch_dims = 3)
+        scores = tf.gather(scores, __best, axis = 3, batch_dims = 3)
+        classes = tf.gather(classes, __best, axis = 3, batch_dims = 3)
+
+    boxes = tf.reshape(boxes, (__N, -1, 4))
+    scores = tf.reshape(scores, (__N, -1))
+    classes = tf.reshape(classes, (__N, -1))
+
+    return boxes, scores, classes, scoreThreshold < scores
+
+def boxIOU_TF(boxes1, boxes2):
+    """
+    Same as boxIOU, with tensorflow operations.
+    """
+    __topLeft = tf.maximum(boxes1[..., :, None, :2], boxes2[..., None, :, :2])
+    __bottomRight = tf.minimum(boxes1[..., :, None, 2:], boxes2[..., None, :, 2:])
+    intersectArea = tf.reduce_prod(tf.maximum(__bottomRight - __topLeft, 0.), axis = -1)
+
+    __area1 = tf.reduce_prod(tf.maximum(boxes1[..., 2:] - boxes1[..., :2], 0.), axis = -1)
+    __area2 = tf.reduce_prod(tf.maximum(boxes2[..., 2:] - boxes2[..., :2], 0.), axis = -1)
+    unionArea = __area1[..., :, None] + __area2[..., None, :] - intersectArea
+
+    return tf.math.divide_no_nan(intersectArea, unionArea)
+
+def nonMaxSuppressionTF(boxes, scores, classes, valid, iouThreshold = .5, maxDetections = 100):
+    """
+    Same as nonMaxSuppression, with tensorflow operations so it can be a part of the graph. Because
+    the number of detections differs between the images, the outputs are padded.
+
+    Args:
+        boxes, scores, classes, valid: tf.Tensor: Outputs of decodePredictionsTF.
+        iouThreshold: float: Boxes overlapping a kept box more than this are suppressed.
+        maxDetections: int: Maximum number of the returned boxes for each image.
+
+    Returns:
+        boxes: tf.Tensor: Tensor of shape (N, maxDetections, 4), sorted by the scores.
+        scores: tf.Tensor: Tensor of shape (N, maxDetections), zero for the padded boxes.
+        classes: tf.Tensor: Tensor of shape (N, maxDetections), -1 for the padded boxes.
+        nDetections: tf.Tensor: Tensor of shape (N,), number of the detections of each image.
+    """
+    __order = tf.argsort(tf.where(valid, scores, -np.inf), axis = -1, direction = "DESCENDING", stable = True)
+    boxes = tf.gather(boxes, __order, batch_dims = 1)
+    scores = tf.gather(scores, __order, batch_dims = 1)
+    classes = tf.gather(classes, __order, batch_dims = 1)
+    valid = tf.gather(valid, __order, batch_dims = 1)
+
+    __K = tf.shape(boxes)[1]
+    suppress = (iouThreshold < boxIOU_TF(boxes, boxes)) & tf.equal(classes[:, :, None], classes[:, None, :])
+    suppress &= tf.cast(tf.linalg.band_part(tf.ones((__K, __K)), 0, -1) - tf.eye(__K), tf.bool)
+    suppress &= valid[:, :, None]
+
+    def __step(keep, _):
+        __newKeep = valid & ~tf.reduce_any(suppress & keep[:, :, None], axis = 1)
+        return __newKeep, tf.reduce_any(tf.not_equal(__newKeep, keep))
+
+    keep, _ = tf.while_loop(lambda _, changed: changed, __step, (valid, tf.constant(True)), maximum_iterations = __K)
+
+    # Move the kept boxes to the front, keeping their order
+    __rank = tf.argsort(tf.cast(~keep, tf.int32), axis = -1, stable = True)[:, :maxDetections]
+    keep = tf.gather(keep, __rank, batch_dims = 1)
+    boxes = tf.where(keep[..., None], tf.gather(boxes, __rank, batch_dims = 1), 0.)
+    scores = tf.where(keep, tf.gather(scores, __rank, batch_dims = 1), 0.)
+    classes = tf.where(keep, tf.gather(classes, __rank, batch_dims = 1), -1)
+
+    return boxes, scores, classes, tf.reduce_sum(tf.cast(keep, tf.int32), axis = -1)
+
+def predictImages(model, paths, batchSize = 8, imgSize = (448, 448), params = (7, 7, 2, 1),
+                  scoreThreshold = .2, iouThreshold = .5, maxDetections = 100, nWorkers = 4, relativeBoxes = False):
+    """
+    Runs the model on a list of images and yields the detections of each image as soon as its
+    batch is processed. The images of the next batch are read by a pool of threads while the current
+    batch is being predicted. The images are preprocessed by readImage, same as the training data.
+
+    Args:
+        model: tf.keras.Model: The YOLOv1 model.
+        paths: list: Paths of the images.
+        batchSize: int: Number of images in each batch.
+        imgSize: tuple: The input size of the model (width,height) in pixels.
+        params: tuple: A tuple containing the output parameters of the model (Sx, Sy, B, C)
+        scoreThreshold: float: Boxes with a lower class-conditional score are discarded.
+        iouThreshold: float: The IOU threshold of non-max suppression.
+        maxDetections: int: Maximum number of the returned boxes for each image.
+        nWorkers: int: Number of threads for reading the images.
+        relativeBoxes: bool: Return the boxes relative to the image size instead of pixels.
+
+    Yields:
+        A tuple of (path, boxes, scores, classes) for each image. boxes is an array of shape (m, 4)
+        containing [x1, y1, x2, y2] of each box in the pixels of the original image.
+    """
+    # Models with uint8 inputs normalize the images themselves
+    __normalize = model.inputs[0].dtype != "uint8"
+
+    def __read(path):
+        # The original size is read from the header of the file
+        with Image.open(path) as img:
+            __size = img.size
+        return readImage(path, imgSize, __normalize), __size
+
+    paths = list(paths)
+    __batches = [paths[i:i + batchSize] for i in range(0, len(paths), batchSize)]
+
+    with ThreadPoolExecutor(max_workers = nWorkers) as pool:
+        __next = [pool.submit(__read, path) for path in __batches[0]] if 0 < len(__batches) else []
+
+        for k, batch in enumerate(__batches):
+            __results = [future.result() for future in __next]
+
+            # Read the next batch while the current one is being predicted
+            __next = [pool.submit(__read, path) for path in __batches[k + 1]] if k + 1 < len(__batches) else []
+
+            yPred = model.predict_on_batch(np.stack([img for img, _ in __results]))
+            detections = nonMaxSuppression(*decodePredictions(yPred, params, scoreThreshold), iouThreshold, maxDetections)
+
+            for path, (_, (width, height)), (boxes, scores, classes) in zip(batch, __results, detections):
+                if relativeBoxes == False:
+                    boxes = boxes * np.array([width, height, width, height], dtype = np.float32)
+                yield path, boxes, scores, classes
@@ -2,9 +2,85 @@
 import tensorflow as tf
 from utils import iouUtils, calcIOU, customSQRT3
 
+@tf.keras.utils.register_keras_serializable(package = "YOLOv1")
 def YOLOv1_loss(yTrue, yPred):
     """
-    Runs in the even of loss function calculations
+    Runs in the even of loss function calculations. 
+    The loss is the sum of the classification, confidence (For the cells with and without objects)
+    and localization losses. All terms are calculated per grid cell and reduced once at the end. Only 
+    the responsible box of each cell (The predicted box with the higher IOU with the ground truth) 
+    contributes to the confidence and localization losses of the cells with objects.
+    The grid cells (Sx, Sy), number of classes (C) and number of boxes (B) are derived from the shapes 
+    of the tensors, which are defined by YOLOv1_Config.
+
+    Args:
+        yTrue, yPred: tf.Tensor: The ground truth value and the predicted value, respectively. The 
+            ground truth has 5 + C parameters in each cell and the prediction has 5*B + C.
+
+    Returns:
+        The calculated loss (float32).
+    """
+    # The loss is always calculated in float32, even if the model runs in mixed precision
+    yTrue = tf.cast(yTrue, tf.float32)
+    yPred = tf.cast(yPred, tf.float32)
+
+    lambdaNoObj = .5
+    lambdaCoord = 5.
+    epsilon = 1e-7 # Keeps the gradient of the square root finite for zero width/height
+
+    __C = yTrue.shape[-1] - 5
+    __B = (yPred.shape[-1] - __C) // 5
+    gridRatio = tf.cast(tf.shape(yTrue)[1:3], tf.float32) # (Sx, Sy)
+
+    # Split the predictions and ground truth vectors to class, confidence and coordinates matrices
+    # 1. Ground truth 
+    targetClass = yTrue[..., :__C]
+    targetConf = yTrue[..., __C:__C + 1]
+    targetCoords = yTrue[..., __C + 1:__C + 5]
+
+    # 2. Prediction (The boxes are stacked in a new axis)
+    predClass = yPred[..., :__C]
+    predConf = yPred[..., __C:__C + __B]
+    predCoords = tf.reshape(yPred[..., __C + __B:], tf.concat([tf.shape(yPred)[:-1], [__B, 4]], 0))
+
+    # Calculate IOUs of all predicted bounding boxes at once
+    p_left, p_right = iouUtils(predCoords, gridRatio)
+    t_left, t_right = iouUtils(tf.expand_dims(targetCoords, -2), gridRatio)
+    IOU = calcIOU(p_left, p_right, t_left, t_right)
+
+    # Getting the responsible bounding box for loss calculation. The last box is chosen on ties.
+    respBox = tf.one_hot(__B - 1 - tf.argmax(tf.reverse(IOU, [-1]), -1), __B, dtype = yPred.dtype)
+    respConf = tf.reduce_sum(respBox * predConf, -1, True)
+    respCoords = tf.reduce_sum(tf.expand_dims(respBox, -1) * predCoords, -2)
+
+    # Get the cells that have objects
+    maskObj = tf.cast(0 < targetConf, yPred.dtype)
+    maskNoObj = tf.cast(0 == targetConf, yPred.dtype)
+
+    # Calculating the losses of each cell
+    # 1. Classification loss
+    classificationLoss = tf.reduce_sum(tf.square(targetClass - predClass), -1, True)
+
+    # 2. Confidence loss. For the cells with no objects, the confidence scores of all boxes are 
+    # penalized, since their target confidence score is 0.
+    confidenceLossObj = tf.square(targetConf - respConf)
+    confidenceLossNoObj = tf.reduce_sum(tf.square(predConf), -1, True)
+
+    # 3. Localization loss
+    xyLoss = tf.reduce_sum(tf.square(respCoords[..., 0:2] - targetCoords[..., 0:2]), -1, True)
+    whLoss = tf.reduce_sum(tf.square(tf.sqrt(respCoords[..., 2:4] + epsilon) - tf.sqrt(targetCoords[..., 2:4] + epsilon)), -1, True)
+
+    # Sum all the tree types of the errors
+    return tf.reduce_sum(
+        maskObj * (classificationLoss + confidenceLossObj + lambdaCoord * (xyLoss + whLoss)) 
+        + lambdaNoObj * maskNoObj * confidenceLossNoObj
+    )
+
+def YOLOv1_loss_legacy(yTrue, yPred):
+    """
+    The previous implementation of YOLOv1_loss, which uses the Heron square root (customSQRT3) and
+    separate masks for each term. Only kept as the reference for the numerical equivalence check 
+    in YOLOv1_Benchmark.py.
     
     Args:
         yTrue, yPred: tf.Tensor: The ground truth value and the predicted value, respectively
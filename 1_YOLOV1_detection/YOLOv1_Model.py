@@ -2,63 +2,193 @@ import tensorflow as tf
 from YOLOv1_Reshape_Layer import YOLOv1_LastLayer_Reshape
 from keras.regularizers import l2 # type: ignore
 from YOLOv1_Loss import YOLOv1_loss
+from YOLOv1_Config import YOLOv1_Config
 
 class YOLOV1_Model():
-    def __init__(self):
-        pass
+    """
+    Builds the YOLOv1 network. Besides the original network (A Darknet-style backbone followed by a 
+    Flatten + Dense neck), lighter variants can be built for faster inference and smaller checkpoints. 
+    All variants have the same output contract: a (Sx, Sy, 5*B+C) tensor made by YOLOv1_LastLayer_Reshape.
+    Use modelReport to compare the number of parameters and FLOPs of the variants.
+    """
+    def __init__(self, config = None, backbone = "darknet", widthMultiplier = 1., head = "dense"):
+        """
+        Args:
+            config: YOLOv1_Config: The grid cells, number of boxes and classes and the input size of the 
+                network. The defaults of YOLOv1_Config if None.
+            backbone: str: "darknet" for the original convolutions or "separable" for replacing the 
+                convolutions with kernels larger than 1x1 (Except the first one) with depthwise-separable
+                convolutions.
+            widthMultiplier: float: The number of filters of all convolutions is multiplied by this value
+                (Rounded to a multiple of 8).
+            head: str: "dense" for the original Flatten + Dense(4096) + Dense neck or "conv" for a 1x1 
+                convolution that predicts the parameters of each grid cell from the feature map. The 
+                feature map is resized to the grid if the sizes do not match.
+        """
+        if backbone not in ("darknet", "separable"):
+            raise Exception(f"Invalid backbone: {backbone}. Only darknet and separable are acceptable.")
+        if head not in ("dense", "conv"):
+            raise Exception(f"Invalid head: {head}. Only dense and conv are acceptable.")
+        if widthMultiplier <= 0:
+            raise Exception(f"Width multiplier should be positive, got {widthMultiplier}")
 
-    def getModel(self):
-        # YOLOv1 structure
-        YOLOv1_inputShape = (448,448,3) # Shape of the input image 
-        classNo = 1 # Number of classes we are trying to detect
-        input = tf.keras.layers.Input(shape=YOLOv1_inputShape)
+        self.config = config if config is not None else YOLOv1_Config()
+        self.backbone = backbone
+        self.widthMultiplier = widthMultiplier
+        self.head = head
+
+    def convBlock(self, x, filters, kernelSize, strides):
+        """
+        Adds a convolution with leaky ReLU activation to the backbone, with respect to the backbone 
+        variant and the width multiplier.
+
+        Args:
+            x: tf.Tensor: The input of the block
+            filters: int: Number of filters of the original network
+            kernelSize: int: Size of the kernel
+            strides: int: The strides of the convolution
+
+        Returns:
+            The output of the block
+        """
+        filters = max(8, int(filters * self.widthMultiplier + 4) // 8 * 8)
         leakyReLu = tf.keras.layers.LeakyReLU(negative_slope = .1)
 
+        # Depthwise-separable convolutions are not used for the RGB input, they would barely save anything
+        if self.backbone == "separable" and 1 < kernelSize and 3 < x.shape[-1]:
+            return tf.keras.layers.SeparableConv2D(filters = filters, kernel_size = kernelSize, strides = strides, padding = "same", 
+                                                   activation = leakyReLu, depthwise_regularizer = l2(1e-5), pointwise_regularizer = l2(1e-5))(x)
+
+        return tf.keras.layers.Conv2D(filters = filters, kernel_size=kernelSize, strides = strides, padding = "same", activation= leakyReLu, kernel_regularizer=l2(1e-5))(x)
+
+    def getModel(self, inputDtype = "float32", jitCompile = False, lossScale = None, stepsPerExecution = 1, accumulationSteps = 1):
+        """
+        Builds and compiles the YOLOv1 model. To train in mixed precision, set the global policy
+        (tf.keras.mixed_precision.set_global_policy) before calling this method. The last layer and
+        the loss always run in float32.
+
+        Args:
+            inputDtype: str: The data type of the input images. If "uint8", the images are normalized
+                by the model (on the device), so the data pipeline can feed raw pixels.
+            jitCompile: bool: Whether to compile the training and prediction steps with XLA
+            lossScale: float: Only used with the "mixed_float16" policy. The initial scale of the 
+                dynamic loss scaling. None uses the Keras default and 0 disables the loss scaling.
+            stepsPerExecution: int: Number of batches to run in each tf.function call
+            accumulationSteps: int: Number of batches to accumulate the gradients over before each 
+                update of the weights. Effectively multiplies the batch size without using more memory.
+        """
+        # YOLOv1 structure
+        YOLOv1_inputShape = self.config.inputShape() # Shape of the input image 
+        outputShape = self.config.outputShape() # (Sx, Sy, 5*B+C)
+        input = tf.keras.layers.Input(shape=YOLOv1_inputShape, dtype = inputDtype)
+
+        # Normalize the raw pixels
+        x = input
+        if inputDtype == "uint8":
+            x = tf.keras.layers.Rescaling(1/255.)(x)
 
         # The backbone, Acts ads a feature extractor
         # L1
-        x = tf.keras.layers.Conv2D(filters = 64, kernel_size=7, strides = 2, padding = "same", activation= leakyReLu, kernel_regularizer=l2(1e-5))(input)
+        x = self.convBlock(x, 64, 7, 2)
         x = tf.keras.layers.MaxPool2D(pool_size=2, strides=2, padding = "same")(x)
 
         # L2
-        x = tf.keras.layers.Conv2D(filters = 192, kernel_size=3, strides = 1, padding = "same", activation= leakyReLu, kernel_regularizer=l2(1e-5))(x)
+        x = self.convBlock(x, 192, 3, 1)
         x = tf.keras.layers.MaxPool2D(pool_size=2, strides=2, padding = "same")(x)
 
         # L3
-        x = tf.keras.layers.Conv2D(filters = 128, kernel_size=1, strides = 1, padding = "same", activation= leakyReLu, kernel_regularizer=l2(1e-5))(x)
-        x = tf.keras.layers.Conv2D(filters = 256, kernel_size=3, strides = 1, padding = "same", activation= leakyReLu, kernel_regularizer=l2(1e-5))(x)
-        x = tf.keras.layers.Conv2D(filters = 256, kernel_size=1, strides = 1, padding = "same", activation= leakyReLu, kernel_regularizer=l2(1e-5))(x)
-        x = tf.keras.layers.Conv2D(filters = 512, kernel_size=3, strides = 1, padding = "same", activation= leakyReLu, kernel_regularizer=l2(1e-5))(x)
+        x = self.convBlock(x, 128, 1, 1)
+        x = self.convBlock(x, 256, 3, 1)
+        x = self.convBlock(x, 256, 1, 1)
+        x = self.convBlock(x, 512, 3, 1)
         x = tf.keras.layers.MaxPool2D(pool_size=2, strides=2, padding = "same")(x)
 
         # L4
         for _ in range(4):
-            x = tf.keras.layers.Conv2D(filters = 256, kernel_size=1, strides = 1, padding = "same", activation= leakyReLu, kernel_regularizer=l2(1e-5))(x)
-            x = tf.keras.layers.Conv2D(filters = 512, kernel_size=3, strides = 1, padding = "same", activation= leakyReLu, kernel_regularizer=l2(1e-5))(x)
-        x = tf.keras.layers.Conv2D(filters = 512, kernel_size=1, strides = 1, padding = "same", activation= leakyReLu, kernel_regularizer=l2(1e-5))(x)
-        x = tf.keras.layers.Conv2D(filters = 1024, kernel_size=3, strides = 1, padding = "same", activation= leakyReLu, kernel_regularizer=l2(1e-5))(x)
+            x = self.convBlock(x, 256, 1, 1)
+            x = self.convBlock(x, 512, 3, 1)
+        x = self.convBlock(x, 512, 1, 1)
+        x = self.convBlock(x, 1024, 3, 1)
         x = tf.keras.layers.MaxPool2D(pool_size=2, strides=2, padding = "same")(x)
 
         # L5
-        x = tf.keras.layers.Conv2D(filters = 512, kernel_size=1, strides = 1, padding = "same", activation= leakyReLu, kernel_regularizer=l2(1e-5))(x)
-        x = tf.keras.layers.Conv2D(filters = 1024, kernel_size=3, strides = 1, padding = "same", activation= leakyReLu, kernel_regularizer=l2(1e-5))(x)
-        x = tf.keras.layers.Conv2D(filters = 512, kernel_size=1, strides = 1, padding = "same", activation= leakyReLu, kernel_regularizer=l2(1e-5))(x)
-        x = tf.keras.layers.Conv2D(filters = 1024, kernel_size=3, strides = 1, padding = "same", activation= leakyReLu, kernel_regularizer=l2(1e-5))(x)
-        x = tf.keras.layers.Conv2D(filters = 1024, kernel_size=3, strides = 1, padding = "same", activation= leakyReLu, kernel_regularizer=l2(1e-5))(x)
-        x = tf.keras.layers.Conv2D(filters = 1024, kernel_size=3, strides = 2, padding = "same", activation= leakyReLu, kernel_regularizer=l2(1e-5))(x)
+        x = self.convBlock(x, 512, 1, 1)
+        x = self.convBlock(x, 1024, 3, 1)
+        x = self.convBlock(x, 512, 1, 1)
+        x = self.convBlock(x, 1024, 3, 1)
+        x = self.convBlock(x, 1024, 3, 1)
+        x = self.convBlock(x, 1024, 3, 2)
 
         # L6
-        x = tf.keras.layers.Conv2D(filters = 1024, kernel_size=3, strides = 1, padding = "same", activation= leakyReLu, kernel_regularizer=l2(1e-5))(x)
-        x = tf.keras.layers.Conv2D(filters = 1024, kernel_size=3, strides = 1, padding = "same", activation= leakyReLu, kernel_regularizer=l2(1e-5))(x)
+        x = self.convBlock(x, 1024, 3, 1)
+        x = self.convBlock(x, 1024, 3, 1)
 
         # Neck
-        x = tf.keras.layers.Flatten()(x)
-        x = tf.keras.layers.Dense(4096)(x)
-        x = tf.keras.layers.Dense(7*7*(5*2+classNo), activation="sigmoid")(x)
-        x = tf.keras.layers.Dropout(.5)(x) # Dropout layer for avoiding overfitting
-        x = YOLOv1_LastLayer_Reshape((7,7,5*2+classNo))(x)
-        model = tf.keras.Model(inputs = input, outputs = x, name = "YOLOv1")
-
-        model.compile(loss = YOLOv1_loss ,optimizer = 'adam')
+        if self.head == "dense":
+            x = tf.keras.layers.Flatten()(x)
+            x = tf.keras.layers.Dense(4096)(x)
+            x = tf.keras.layers.Dense(outputShape[0]*outputShape[1]*outputShape[2], activation="sigmoid")(x)
+            x = tf.keras.layers.Dropout(.5)(x) # Dropout layer for avoiding overfitting
+        else:
+            # The feature map is (height, width), the grid cells are in (Sx, Sy) order
+            if tuple(x.shape[1:3]) != (outputShape[1], outputShape[0]):
+                x = tf.keras.layers.Resizing(outputShape[1], outputShape[0], interpolation = "bilinear")(x)
+            x = tf.keras.layers.Dropout(.5)(x) # Dropout layer for avoiding overfitting
+            x = tf.keras.layers.Conv2D(filters = outputShape[2], kernel_size = 1, kernel_regularizer = l2(1e-5))(x)
+            x = tf.keras.layers.Permute((2, 1, 3))(x)
+        x = YOLOv1_LastLayer_Reshape(outputShape, self.config.nBoxes)(x)
+        model = tf.keras.Model(inputs = input, outputs = x, name = "YOLOv1" if (self.backbone, self.widthMultiplier, self.head) == ("darknet", 1., "dense") 
+                               else f"YOLOv1_{self.backbone}_{self.widthMultiplier:g}x_{self.head}")
+
+        # Loss scaling avoids the underflow of float16 gradients
+        optimizer = tf.keras.optimizers.Adam(gradient_accumulation_steps = accumulationSteps if 1 < accumulationSteps else None)
+        autoScaleLoss = lossScale != 0
+        if tf.keras.mixed_precision.global_policy().name == "mixed_float16" and lossScale:
+            optimizer = tf.keras.mixed_precision.LossScaleOptimizer(optimizer, initial_scale = lossScale)
+
+        model.compile(loss = YOLOv1_loss ,optimizer = optimizer, jit_compile = jitCompile, auto_scale_loss = autoScaleLoss,
+                      steps_per_execution = stepsPerExecution)
         
-        return model
\ No newline at end of file
+        return model
+
+def countFLOPs(model):
+    """
+    Counts the floating point operations (Multiplications and additions) of one forward pass of the
+    model for a single image. Only the convolutional and dense layers are counted, the activations, 
+    pooling and reshape layers are negligible in comparison.
+
+    Args:
+        model: tf.keras.Model: The model
+
+    Returns:
+        Number of FLOPs
+    """
+    flops = 0
+    for layer in model.layers:
+        if isinstance(layer, tf.keras.layers.SeparableConv2D):
+            __h, __w, __cOut = layer.output.shape[1:]
+            __cIn = layer.input.shape[-1]
+            __k = layer.kernel_size[0] * layer.kernel_size[1]
+            flops += 2 * __h * __w * __cIn * (__k * layer.depth_multiplier + __cOut * layer.depth_multiplier)
+        elif isinstance(layer, tf.keras.layers.Conv2D):
+            __h, __w, __cOut = layer.output.shape[1:]
+            __cIn = layer.input.shape[-1]
+            flops += 2 * __h * __w * __cOut * __cIn * layer.kernel_size[0] * layer.kernel_size[1]
+        elif isinstance(layer, tf.keras.layers.Dense):
+            flops += 2 * layer.input.shape[-1] * layer.units
+
+    return flops
+
+def modelReport(model):
+    """
+    Returns the number of parameters, the FLOPs of one forward pass (See countFLOPs) and the size of 
+    the float32 weights of a model.
+
+    Args:
+        model: tf.keras.Model: The model
+
+    Returns:
+        A dictionary with "name", "params", "GFLOPs" and "weightsMB" keys
+    """
+    __params = model.count_params()
+    return {"name": model.name, "params": __params, "GFLOPs": countFLOPs(model) / 1e9, "weightsMB": __params * 4 / 2**20}
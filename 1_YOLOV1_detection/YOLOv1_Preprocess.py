@@ -0,0 +1,40 @@
+# Preprocessing the datasets once, so the training process does not decode and resize the images
+# in every epoch. Example:
+#   python YOLOv1_Preprocess.py --images ../data/images/train --labels ../data/labels/train --out ../data/shards/train
+
+import argparse
+import sys, os
+import time
+
+here = os.path.dirname(".")
+sys.path.append(os.path.join(here, '..'))
+from dataHandler import annotationsToDataframe, buildShards_YOLOv1
+from YOLOv1_Config import YOLOv1_Config
+
+if __name__ == "__main__":
+
+    # Parse the command line arguments
+    parser = argparse.ArgumentParser(description = "Writes the resized images and ground truth tensors of a dataset as memory-mapped shards.")
+    parser.add_argument("--images", required = True, help = "The directory containing the jpg images")
+    parser.add_argument("--labels", required = True, help = "The directory containing the txt annotations")
+    parser.add_argument("--out", required = True, help = "Path of the output shards without the suffixes and extensions")
+    parser.add_argument("--imgSize", type = int, nargs = 2, default = (448, 448), help = "Image size (width height) in pixels")
+    parser.add_argument("--gridCells", type = int, nargs = 2, default = (7, 7), help = "Number of grid cells (Sx Sy)")
+    parser.add_argument("--nClass", type = int, default = 1, help = "Number of classes")
+    parser.add_argument("--workers", type = int, default = 4, help = "Number of threads for reading the images")
+    parser.add_argument("--targetDtype", choices = ["float32", "float16"], default = "float32", help = "The data type of the ground truth tensors")
+    args = parser.parse_args()
+
+    # See if the output directory exists
+    if os.path.dirname(args.out) != "" and not os.path.isdir(os.path.dirname(args.out)):
+        os.makedirs(os.path.dirname(args.out))
+
+    # The shards have to match the configuration of the network that is trained on them
+    config = YOLOv1_Config(args.gridCells, nClass = args.nClass, imgSize = args.imgSize)
+
+    __start = time.perf_counter()
+    df = annotationsToDataframe(args.labels, "txt")
+    n = buildShards_YOLOv1(args.images, df, args.out, config.imgSize, config.nClass, config.gridCells, args.workers, 
+                           targetDtype = args.targetDtype)
+
+    print(f"Wrote {n} images to {args.out}_images.npy in {time.perf_counter() - __start:.1f} seconds")
@@ -1,25 +1,52 @@
 import tensorflow as tf
 
+@tf.keras.utils.register_keras_serializable(package = "YOLOv1")
 class YOLOv1_LastLayer_Reshape(tf.keras.layers.Layer):
     """
     Defines a costume layer for reshaping the last layer to YOLOv1 compatible layer.
     Note, No build function is needed.
+    The layer runs in float32 by default, even if a mixed precision policy is set globally, so the
+    softmax and sigmoid activations (And the loss calculations afterwards) are done in float32.
+    The layer is registered as a serializable Keras object, so saved models can be loaded without
+    passing it in custom_objects.
     """
-    def __init__(self, targetShape):
+    def __init__(self, targetShape, nBoxes = 2, **kwargs):
         """
         Initializes the layer.
+
+        Args:
+            targetShape: tuple: The output shape of each image in (Sx, Sy, 5*B+C) format, see 
+                YOLOv1_Config.outputShape
+            nBoxes: int: Number of predicted bounding boxes per grid cell (B)
+            kwargs: Passed to tf.keras.layers.Layer. The data type is float32 unless "dtype" is given.
         """
-        super().__init__()
+        kwargs.setdefault("dtype", "float32")
+        super().__init__(**kwargs)
         self.targetShape = tuple(targetShape)
+        self.nBoxes = nBoxes
+
+        if self.targetShape[2] <= 5 * nBoxes:
+            raise Exception(f"Invalid target shape: {targetShape}. The last dimension should be 5*B+C with B = {nBoxes} and C > 0")
     
     def get_config(self):
         """
         Helps in serializing the layer data
         """
         config = super().get_config()
-        config.update({"target_shape": self.targetShape})
+        config.update({"targetShape": self.targetShape, "nBoxes": self.nBoxes})
         return config
 
+    @classmethod
+    def from_config(cls, config):
+        """
+        Makes the layer from the output of get_config. The older checkpoints saved the target shape
+        with "target_shape" key.
+        """
+        config = dict(config)
+        if "target_shape" in config:
+            config["targetShape"] = config.pop("target_shape")
+        return cls(**config)
+
     def call(self, layerInput):
         """
         Forward computations. We take the first Sx * Sy * C indexes of each the input 
@@ -28,27 +55,37 @@ class YOLOv1_LastLayer_Reshape(tf.keras.layers.Layer):
         rest resemble the bounding box parameters <boxCenterX, boxCenterY, width, height>  
 
         Args:
-            layerInput: tensor: The output from a dense (fully connected) layer.
+            layerInput: tensor: The output from a dense (fully connected) layer, or a (Sx, Sy, 5*B+C) grid
+                from a convolutional head (With the same order of parameters in each cell).
         """
+        # Under mixed precision, the input may be float16/bfloat16
+        layerInput = tf.cast(layerInput, self.compute_dtype)
         
         Sx, Sy = self.targetShape[0], self.targetShape[1] # Number of parts that each axis is divided to
-        C = 1 # Number of classes
-        B = 2 # Number of predicted bounding boxes per grid cell
+        B = self.nBoxes # Number of predicted bounding boxes per grid cell
+        C = self.targetShape[2] - 5 * B # Number of classes
+
 
+        if len(layerInput.shape) == 4:
+            # The output of a convolutional head is already a grid of (Sx, Sy, 5*B+C) vectors
+            classProbs = layerInput[..., :C]
+            confScores = layerInput[..., C:C+B]
+            bBox = layerInput[..., C+B:]
+        else:
+            # Get the batch size
+            batchSize = tf.keras.backend.shape(layerInput)[0]
 
-        # Get the batch size
-        batchSize = tf.keras.backend.shape(layerInput)[0]
+            classProbs = tf.keras.backend.reshape(layerInput[:,:Sx*Sy*C], (batchSize,) + (Sx,Sy,C))
+            confScores = tf.keras.backend.reshape(layerInput[:,Sx*Sy*C:Sx*Sy*(C+B)], (batchSize,) + (Sx,Sy,B))
+            bBox = tf.keras.backend.reshape(layerInput[:,Sx*Sy*(C+B):], (batchSize,) + (Sx,Sy,B*4))
 
         # Class probabilities
-        classProbs = tf.keras.backend.reshape(layerInput[:,:Sx*Sy*C], (batchSize,) + (Sx,Sy,C))
         classProbs = tf.keras.backend.softmax(classProbs) # Run a softmax to choose the right class with highest prob
 
         # Confidence scores
-        confScores = tf.keras.backend.reshape(layerInput[:,Sx*Sy*C:Sx*Sy*(C+B)], (batchSize,) + (Sx,Sy,B))
         confScores = tf.keras.backend.sigmoid(confScores) # Confidence scores should be between 0 and 1
 
         # Bounding boxes
-        bBox = tf.keras.backend.reshape(layerInput[:,Sx*Sy*(C+B):], (batchSize,) + (Sx,Sy,B*4))
         bBox = tf.keras.backend.sigmoid(bBox) # All of the bounding box parameters are relative (Between 0 and 1)
 
 
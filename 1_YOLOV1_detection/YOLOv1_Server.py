@@ -0,0 +1,357 @@
+# A local HTTP server for the YOLOv1 detector with dynamic micro-batching, and a client for testing it.
+# Examples:
+#   python YOLOv1_Server.py serve --model ./export/savedmodel --port 8080 --maxBatchSize 8 --maxWaitMs 5
+#   python YOLOv1_Server.py client --url http://localhost:8080 --images ../data/images/test --concurrency 8
+#
+# Endpoints:
+#   POST /detect   The body is an encoded image (e.g. jpg). Returns the detections as JSON, the boxes are
+#                  [x1, y1, x2, y2] in the pixels of the original image.
+#   GET  /stats    Latency percentiles, queue depth and batching statistics as JSON.
+#   GET  /health   Returns {"status": "ok"}.
+import io
+import os
+import sys
+import json
+import time
+import glob
+import queue
+import argparse
+import threading
+import urllib.request
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# For importing datahandler methods from the parent directory
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+import numpy as np
+from PIL import Image
+from dataHandler import readImage
+
+def loadPredictor(modelPath, scoreThreshold = .2, iouThreshold = .5, maxDetections = 100):
+    """
+    Loads an exported model (The serving SavedModel of YOLOv1_Export.py, with the decoder and non-max
+    suppression built in) or a .keras checkpoint (Decoded and suppressed on the host).
+
+    Args:
+        modelPath: str: Directory of the SavedModel or path of the .keras file
+        scoreThreshold, iouThreshold, maxDetections: Only used for .keras checkpoints, the SavedModel
+            has its own values (See YOLOv1_Export.py).
+
+    Returns:
+        A tuple of (predict, imgSize). predict takes a batch of uint8 images and returns a list of
+        (boxes, scores, classes) for each image, boxes are relative to the image size. imgSize is the
+        input size of the model (width, height).
+    """
+    import tensorflow as tf
+
+    if os.path.isdir(modelPath):
+        __serving = tf.saved_model.load(modelPath).signatures["serving_default"]
+        __H, __W = __serving.structured_input_signature[1]["images"].shape[1:3]
+
+        def predict(images):
+            out = __serving(images = tf.constant(images))
+            return [(out["boxes"][i, :n].numpy(), out["scores"][i, :n].numpy(), out["classes"][i, :n].numpy())
+                    for i, n in enumerate(out["nDetections"].numpy())]
+
+        return predict, (__W, __H)
+
+    from YOLOv1_Export import loadModel, configFromModel, pixelsToInput
+    from YOLOv1_Inference import decodePredictions, nonMaxSuppression
+
+    model = loadModel(modelPath)
+    config = configFromModel(model)
+
+    def predict(images):
+        yPred = model.predict_on_batch(pixelsToInput(model, images))
+        return nonMaxSuppression(*decodePredictions(yPred, config.predParams(), scoreThreshold), iouThreshold, maxDetections)
+
+    return predict, config.imgSize
+
+def preprocessImage(data, imgSize):
+    """
+    Decodes and resizes an encoded image with readImage, the same function the training data is
+    read with (dataGenerator_YOLOv1._readPixels), so the served images match the training images.
+
+    Args:
+        data: bytes: The encoded image
+        imgSize: tuple: The input size of the model (width, height)
+
+    Returns:
+        A tuple of (uint8 image, (width, height) of the original image)
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        __size = img.size
+
+    return readImage(io.BytesIO(data), imgSize, False), __size
+
+class microBatcher():
+    """
+    Queues the incoming images and runs them through the model in batches. A batch is run as soon as
+    it has maxBatchSize images, or maxWait seconds after its first image arrived, whichever comes
+    first. So under low load the requests wait at most maxWait, and under high load the model runs
+    on full batches.
+
+    The latencies (From submitting an image to its result) of the last requests are kept for the
+    percentiles of stats().
+
+    Args:
+        predict: function: Takes a batch of uint8 images, returns a list of results (See loadPredictor)
+        maxBatchSize: int: Maximum number of images in each batch
+        maxWait: float: Maximum time (seconds) the first image of a batch waits for other images
+        maxQueue: int: Maximum number of queued images. submit raises queue.Full when it is reached.
+        historySize: int: Number of the latest requests kept for the latency percentiles
+    """
+    def __init__(self, predict, maxBatchSize = 8, maxWait = .005, maxQueue = 256, historySize = 10000):
+        """
+        Initializes the object and starts the worker thread.
+        """
+        self.predict = predict
+        self.maxBatchSize = maxBatchSize
+        self.maxWait = maxWait
+        self.queue = queue.Queue(maxQueue)
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen = historySize)
+        self.nRequests = 0
+        self.nBatches = 0
+        self.nErrors = 0
+
+        self.worker = threading.Thread(target = self.__run, daemon = True)
+        self.worker.start()
+
+    def submit(self, img):
+        """
+        Queues an image.
+
+        Args:
+            img: np.ndarray: A uint8 image, resized to the input size of the model
+
+        Returns:
+            A concurrent.futures.Future of the result of the image
+        """
+        future = Future()
+        self.queue.put_nowait((img, future, time.perf_counter()))
+        return future
+
+    def close(self):
+        """
+        Stops the worker thread after the queued images are processed.
+        """
+        self.queue.put(None)
+        self.worker.join()
+
+    def __nextBatch(self):
+        """
+        Waits for the first image, then collects the images arriving in maxWait seconds (Up to
+        maxBatchSize). Returns None if the batcher is closed.
+        """
+        __first = self.queue.get()
+        if __first is None:
+            return None
+
+        batch = [__first]
+        __deadline = time.perf_counter() + self.maxWait
+        while len(batch) < self.maxBatchSize:
+            __timeout = __deadline - time.perf_counter()
+            try:
+                __item = self.queue.get(timeout = __timeout) if 0 < __timeout else self.queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if __item is None:
+                # Process the current batch and stop afterwards
+                self.queue.put(None)
+                break
+            batch.append(__item)
+
+        return batch
+
+    def __run(self):
+        """
+        The loop of the worker thread.
+        """
+        while True:
+            batch = self.__nextBatch()
+            if batch is None:
+                return
+
+            try:
+                __results = self.predict(np.stack([img for img, _, _ in batch]))
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                with self.lock:
+                    self.nErrors += len(batch)
+                continue
+
+            __now = time.perf_counter()
+            with self.lock:
+                self.nRequests += len(batch)
+                self.nBatches += 1
+                self.latencies.extend(__now - start for _, _, start in batch)
+
+            for (_, future, _), result in zip(batch, __results):
+                future.set_result(result)
+
+    def stats(self):
+        """
+        Returns the statistics of the batcher: queue depth, number of requests, batches and errors,
+        the mean batch size and the latency percentiles (ms) of the latest requests.
+        """
+        with self.lock:
+            __latencies = np.array(self.latencies) * 1000
+            __stats = {"queueDepth": self.queue.qsize(), "requests": self.nRequests, "batches": self.nBatches,
+                       "errors": self.nErrors, "meanBatchSize": self.nRequests / max(self.nBatches, 1)}
+
+        __stats["latencyMs"] = {f"p{q}": float(np.percentile(__latencies, q)) if 0 < len(__latencies) else None for q in (50, 90, 95, 99)}
+        return __stats
+
+def makeHandler(batcher, imgSize, timeout = 30.):
+    """
+    Makes the request handler class of the HTTP server.
+
+    Args:
+        batcher: microBatcher: The batcher that runs the model
+        imgSize: tuple: The input size of the model (width, height)
+        timeout: float: Maximum time (seconds) to wait for the result of a request
+
+    Returns:
+        A subclass of BaseHTTPRequestHandler
+    """
+    class handler(BaseHTTPRequestHandler):
+        def __reply(self, code, body):
+            __data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(__data)))
+            self.end_headers()
+            self.wfile.write(__data)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self.__reply(200, batcher.stats())
+            elif self.path == "/health":
+                self.__reply(200, {"status": "ok"})
+            else:
+                self.__reply(404, {"error": f"Unknown path: {self.path}"})
+
+        def do_POST(self):
+            if self.path != "/detect":
+                self.__reply(404, {"error": f"Unknown path: {self.path}"})
+                return
+
+            __start = time.perf_counter()
+            try:
+                img, (width, height) = preprocessImage(self.rfile.read(int(self.headers.get("Content-Length", 0))), imgSize)
+            except Exception as e:
+                self.__reply(400, {"error": f"Could not read the image: {e}"})
+                return
+
+            try:
+                boxes, scores, classes = batcher.submit(img).result(timeout)
+            except queue.Full:
+                self.__reply(503, {"error": "The queue is full"})
+                return
+            except Exception as e:
+                self.__reply(500, {"error": str(e)})
+                return
+
+            boxes = boxes * np.array([width, height, width, height], dtype = np.float32)
+            self.__reply(200, {"boxes": boxes.tolist(), "scores": scores.tolist(), "classes": classes.tolist(),
+                               "latencyMs": (time.perf_counter() - __start) * 1000})
+
+        def log_message(self, format, *args):
+            # Do not print a line for every request
+            pass
+
+    return handler
+
+def serve(modelPath, host = "127.0.0.1", port = 8080, maxBatchSize = 8, maxWait = .005, maxQueue = 256):
+    """
+    Loads the model and serves it until interrupted.
+
+    Args:
+        modelPath: str: See loadPredictor
+        host, port: The address of the server
+        maxBatchSize, maxWait, maxQueue: See microBatcher
+    """
+    predict, imgSize = loadPredictor(modelPath)
+
+    # Warm-up, so the first request does not pay for tracing the model
+    predict(np.zeros((1, imgSize[1], imgSize[0], 3), np.uint8))
+
+    batcher = microBatcher(predict, maxBatchSize, maxWait, maxQueue)
+    server = ThreadingHTTPServer((host, port), makeHandler(batcher, imgSize))
+    print(f"Serving {modelPath} on http://{host}:{port} (Input size {imgSize}, batches of up to {maxBatchSize} images, max wait {maxWait * 1000:g} ms)")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+
+def runClient(url, paths, concurrency = 8, nRequests = 100):
+    """
+    Sends images to the server from concurrent threads and measures the latencies from the client
+    side.
+
+    Args:
+        url: str: The address of the server, e.g. http://127.0.0.1:8080
+        paths: list: Paths of the images, sent in a round robin order
+        concurrency: int: Number of concurrent requests
+        nRequests: int: Total number of requests
+
+    Returns:
+        A dictionary of the client-side throughput and latency percentiles and the server statistics
+    """
+    __data = [open(path, "rb").read() for path in paths]
+
+    def __send(i):
+        __start = time.perf_counter()
+        __request = urllib.request.Request(f"{url}/detect", data = __data[i % len(__data)], headers = {"Content-Type": "image/jpeg"})
+        with urllib.request.urlopen(__request) as response:
+            json.loads(response.read())
+        return time.perf_counter() - __start
+
+    __start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers = concurrency) as pool:
+        __latencies = np.array(list(pool.map(__send, range(nRequests)))) * 1000
+    __elapsed = time.perf_counter() - __start
+
+    with urllib.request.urlopen(f"{url}/stats") as response:
+        __serverStats = json.loads(response.read())
+
+    return {"requests": nRequests, "concurrency": concurrency, "imagesPerSecond": nRequests / __elapsed,
+            "latencyMs": {f"p{q}": float(np.percentile(__latencies, q)) for q in (50, 90, 95, 99)}, "server": __serverStats}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Serves the YOLOv1 detector over HTTP, or sends test requests to a server.")
+    parser.add_argument("mode", choices = ["serve", "client"], help = "Run the server or the test client")
+    parser.add_argument("--model", default = None, help = "The serving SavedModel directory or a .keras checkpoint (serve)")
+    parser.add_argument("--host", default = "127.0.0.1", help = "The address of the server (serve)")
+    parser.add_argument("--port", type = int, default = 8080, help = "The port of the server (serve)")
+    parser.add_argument("--maxBatchSize", type = int, default = 8, help = "Maximum number of images in each batch (serve)")
+    parser.add_argument("--maxWaitMs", type = float, default = 5., help = "Maximum time the first image of a batch waits for other images (serve)")
+    parser.add_argument("--maxQueue", type = int, default = 256, help = "Maximum number of queued images (serve)")
+    parser.add_argument("--url", default = "http://127.0.0.1:8080", help = "The address of the server (client)")
+    parser.add_argument("--images", default = None, help = "Directory of the jpg images to send (client)")
+    parser.add_argument("--concurrency", type = int, default = 8, help = "Number of concurrent requests (client)")
+    parser.add_argument("--requests", type = int, default = 100, help = "Total number of requests (client)")
+    args = parser.parse_args()
+
+    if args.mode == "serve":
+        if args.model is None:
+            parser.error("--model is needed for serving")
+        serve(args.model, args.host, args.port, args.maxBatchSize, args.maxWaitMs / 1000, args.maxQueue)
+    else:
+        if args.images is None:
+            parser.error("--images is needed for the client")
+        __paths = sorted(glob.glob(f"{args.images}/*.jpg"))
+        if len(__paths) == 0:
+            parser.error(f"No jpg images in {args.images}")
+        print(json.dumps(runClient(args.url, __paths, args.concurrency, args.requests), indent = 2))
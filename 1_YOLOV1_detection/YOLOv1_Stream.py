@@ -0,0 +1,294 @@
+# Streaming detection on a video file or a (watched) directory of images. The detections of each frame
+# are written as a JSON line, with the time spent in each stage of the pipeline.
+# Examples:
+#   python YOLOv1_Stream.py --model ./export/savedmodel --video ./camera.mp4 --out detections.jsonl
+#   python YOLOv1_Stream.py --model ./model_data/model.keras --watch ./incoming --idleTimeout 60
+#
+# The frames flow through three stages connected by a bounded queue:
+#   reader thread:  Reads the frames from the source and submits them to the worker threads
+#   worker threads: Decode and resize the frames (Image files the same as the training data, see readImage)
+#   main thread:    Runs the model on batches of frames and writes the detections
+# When the model falls behind, the queue fills up. For the live sources (--video and --watch) the reader
+# then skips the new frames (Unless --noSkip is given), so the memory use stays bounded and the detections
+# stay close to real time. With --images every image is processed and the reader waits for the model.
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# For importing datahandler methods from the parent directory
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+import numpy as np
+from PIL import Image
+from dataHandler import readImage, resizeImage
+from YOLOv1_Server import loadPredictor
+
+def videoFrames(videoPath):
+    """
+    Reads the frames of a video file with OpenCV (Only needed for videos, install opencv-python).
+    The frames are grabbed one by one, and only decoded when the returned function is called, so the
+    skipped frames are not decoded.
+
+    Args:
+        videoPath: str: Path of the video file
+
+    Yields:
+        A tuple of (frame info, read) for each frame. frame info is a dictionary with the index and
+        the timestamp (ms) of the frame, read returns the frame as an RGB numpy array.
+    """
+    try:
+        import cv2
+    except ImportError:
+        raise Exception("Reading videos needs OpenCV: pip install opencv-python")
+
+    __capture = cv2.VideoCapture(videoPath)
+    if not __capture.isOpened():
+        raise Exception(f"Could not open the video: {videoPath}")
+
+    try:
+        i = 0
+        while __capture.grab():
+            __info = {"frame": i, "timestampMs": __capture.get(cv2.CAP_PROP_POS_MSEC)}
+            yield __info, lambda: np.ascontiguousarray(__capture.retrieve()[1][..., ::-1])
+            i += 1
+    finally:
+        __capture.release()
+
+def directoryFrames(dirPath, extensions = (".jpg", ".jpeg", ".png"), watch = False, pollInterval = .1,
+                    settleTime = .2, idleTimeout = None, stopEvent = None):
+    """
+    Yields the images of a directory in the order of their modification time. In watch mode the
+    directory is polled for new images until no new image arrives for idleTimeout seconds.
+
+    Args:
+        dirPath: str: The directory of the images
+        extensions: tuple: Extensions of the image files
+        watch: bool: Whether to keep watching the directory for new images
+        pollInterval: float: Time (seconds) between polls of the directory
+        settleTime: float: Files modified in the last settleTime seconds are still being written,
+            and are read in the next polls
+        idleTimeout: float: Stop watching after this many seconds without new images. Watch forever
+            if None.
+        stopEvent: threading.Event: Stops watching when set
+
+    Yields:
+        A tuple of (frame info, read) for each image. frame info is a dictionary with the index and
+        the path of the image, read returns the path (The image is decoded by the worker threads).
+    """
+    __seen = set()
+    __lastNew = time.time()
+    i = 0
+
+    while True:
+        __now = time.time()
+        __new = []
+        with os.scandir(dirPath) as entries:
+            for entry in entries:
+                if entry.name.lower().endswith(extensions) and entry.path not in __seen:
+                    __mtime = entry.stat().st_mtime
+                    if not watch or __mtime < __now - settleTime:
+                        __new.append((__mtime, entry.path))
+
+        for _, path in sorted(__new):
+            __seen.add(path)
+            yield {"frame": i, "path": path}, lambda path = path: path
+            i += 1
+
+        if 0 < len(__new):
+            __lastNew = __now
+
+        if not watch or (stopEvent is not None and stopEvent.is_set()):
+            return
+        if idleTimeout is not None and idleTimeout < time.time() - __lastNew:
+            return
+        time.sleep(pollInterval)
+
+def prepareFrame(src, imgSize):
+    """
+    Decodes (If src is a path) and resizes a frame to the input size of the model. Runs in the
+    worker threads. Image files are read by readImage, same as the training data and the server
+    (Reduced resolution JPEG decoding, same resampling filter), video frames are resized by
+    resizeImage.
+
+    Args:
+        src: str or np.ndarray: Path of an image file or an RGB frame
+        imgSize: tuple: The input size of the model (width, height)
+
+    Returns:
+        A tuple of (uint8 image, (width, height) of the original frame, time the frame was ready)
+    """
+    if isinstance(src, np.ndarray):
+        __img = Image.fromarray(src)
+        return resizeImage(__img, imgSize, False), __img.size, time.perf_counter()
+
+    # Only the header is read for the size of the original image
+    with Image.open(src) as __img:
+        __size = __img.size
+
+    return readImage(src, imgSize, False), __size, time.perf_counter()
+
+def runStream(frames, predict, imgSize, out, batchSize = 8, maxWait = .01, queueSize = 16, nWorkers = 4, skipFrames = False):
+    """
+    Runs the detector on a stream of frames and writes the detections of each frame as a JSON line.
+    The line contains the frame info, the boxes ([x1, y1, x2, y2] in the pixels of the original
+    frame), the scores and classes, the size of the batch the frame was predicted in and the time (ms)
+    spent in each stage:
+        read:       Reading the frame from the source (Decoding for videos)
+        preprocess: Waiting for a worker and decoding/resizing
+        wait:       Waiting in the queue for the model
+        inference:  Running the batch through the model
+        total:      From reading the frame to writing its detections
+    A frame that can not be read or decoded (e.g. a truncated file) gets a line with its frame info
+    and the error instead of the detections, and the stream goes on.
+
+    Args:
+        frames: iterable: The frames, see videoFrames and directoryFrames
+        predict: function: Takes a batch of uint8 images, returns a list of (boxes, scores, classes)
+            with boxes relative to the image size (See loadPredictor)
+        imgSize: tuple: The input size of the model (width, height)
+        out: file: The file the JSON lines are written to
+        batchSize: int: Maximum number of frames in each batch
+        maxWait: float: Maximum time (seconds) to wait for the frames of an incomplete batch
+        queueSize: int: Maximum number of frames waiting for the model
+        nWorkers: int: Number of threads decoding and resizing the frames
+        skipFrames: bool: Skip the frames arriving while the queue is full. Only meant for live 
+            sources (Videos and watched directories). If False, the reader waits for the model 
+            instead and every frame is processed.
+
+    Returns:
+        A dictionary with the number of processed, skipped and failed frames, and the frames per second
+    """
+    __queue = queue.Queue(queueSize)
+    __skipped = [0]
+    __failed = 0
+    __errors = []
+
+    def __reader(pool):
+        try:
+            for info, read in frames:
+                if skipFrames and __queue.full():
+                    __skipped[0] += 1
+                    continue
+
+                __start = time.perf_counter()
+                try:
+                    __future = pool.submit(prepareFrame, read(), imgSize)
+                except Exception as e:
+                    # The error is written for this frame by the main thread
+                    __future = Future()
+                    __future.set_exception(e)
+                __queue.put((info, __start, time.perf_counter(), __future))
+        except Exception as e:
+            __errors.append(e)
+        finally:
+            __queue.put(None)
+
+    __nFrames = 0
+    __startTime = time.perf_counter()
+    with ThreadPoolExecutor(max_workers = nWorkers) as pool:
+        __thread = threading.Thread(target = __reader, args = (pool,), daemon = True)
+        __thread.start()
+
+        __done = False
+        while not __done:
+            # Wait for the first frame, then collect the frames arriving in maxWait seconds
+            __item = __queue.get()
+            if __item is None:
+                break
+
+            batch = [__item]
+            __deadline = time.perf_counter() + maxWait
+            while len(batch) < batchSize:
+                try:
+                    __item = __queue.get(timeout = max(__deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                if __item is None:
+                    __done = True
+                    break
+                batch.append(__item)
+
+            # The frames that failed to be read or decoded get an error line and leave the batch
+            __prepared = []
+            for info, start, readEnd, future in batch:
+                try:
+                    __prepared.append(future.result())
+                except Exception as e:
+                    __line = dict(info, error = f"{type(e).__name__}: {e}", timingMs = {"total": (time.perf_counter() - start) * 1000})
+                    out.write(json.dumps(__line) + "\n")
+                    __prepared.append(None)
+                    __failed += 1
+
+            batch = [item for item, prepared in zip(batch, __prepared) if prepared is not None]
+            __prepared = [prepared for prepared in __prepared if prepared is not None]
+            if len(batch) == 0:
+                out.flush()
+                continue
+
+            __inferStart = time.perf_counter()
+            __results = predict(np.stack([img for img, _, _ in __prepared]))
+            __inferEnd = time.perf_counter()
+
+            for (info, start, readEnd, _), (_, (width, height), ready), (boxes, scores, classes) in zip(batch, __prepared, __results):
+                boxes = boxes * np.array([width, height, width, height], dtype = np.float32)
+                __timing = {"read": readEnd - start, "preprocess": ready - readEnd, "wait": max(__inferStart - ready, 0.),
+                            "inference": __inferEnd - __inferStart, "total": time.perf_counter() - start}
+                __line = dict(info, boxes = boxes.tolist(), scores = scores.tolist(), classes = classes.tolist(),
+                              batchSize = len(batch), timingMs = {k: v * 1000 for k, v in __timing.items()})
+                out.write(json.dumps(__line) + "\n")
+            out.flush()
+            __nFrames += len(batch)
+
+        __thread.join()
+
+    if 0 < len(__errors):
+        raise __errors[0]
+
+    __elapsed = time.perf_counter() - __startTime
+    return {"frames": __nFrames, "skipped": __skipped[0], "failed": __failed, "framesPerSecond": __nFrames / max(__elapsed, 1e-9)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Runs the YOLOv1 detector on a video or a directory of images and writes the detections as JSON lines.")
+    parser.add_argument("--model", required = True, help = "The serving SavedModel directory or a .keras checkpoint")
+    __source = parser.add_mutually_exclusive_group(required = True)
+    __source.add_argument("--video", default = None, help = "Path of a video file (Needs opencv-python)")
+    __source.add_argument("--images", default = None, help = "A directory of images, processed once")
+    __source.add_argument("--watch", default = None, help = "A directory watched for new images")
+    parser.add_argument("--idleTimeout", type = float, default = None, help = "Stop watching after this many seconds without new images")
+    parser.add_argument("--out", default = None, help = "The output JSON lines file (stdout if not given)")
+    parser.add_argument("--batchSize", type = int, default = 8, help = "Maximum number of frames in each batch")
+    parser.add_argument("--maxWaitMs", type = float, default = 10., help = "Maximum time to wait for the frames of an incomplete batch")
+    parser.add_argument("--queueSize", type = int, default = 16, help = "Maximum number of frames waiting for the model")
+    parser.add_argument("--workers", type = int, default = 4, help = "Number of threads decoding and resizing the frames")
+    parser.add_argument("--noSkip", action = "store_true", help = "Process every frame of a video or watched directory, even if the model falls behind the source (--images always processes every image)")
+    parser.add_argument("--scoreThreshold", type = float, default = .2, help = "Score threshold (.keras checkpoints only)")
+    parser.add_argument("--iouThreshold", type = float, default = .5, help = "IOU threshold of non-max suppression (.keras checkpoints only)")
+    args = parser.parse_args()
+
+    predict, imgSize = loadPredictor(args.model, args.scoreThreshold, args.iouThreshold)
+
+    __stop = threading.Event()
+    if args.video is not None:
+        frames = videoFrames(args.video)
+    else:
+        frames = directoryFrames(args.images or args.watch, watch = args.watch is not None, idleTimeout = args.idleTimeout, stopEvent = __stop)
+
+    # Only the live sources skip frames, a fixed directory of images is processed entirely
+    __skipFrames = args.images is None and not args.noSkip
+
+    out = open(args.out, "w") if args.out is not None else sys.stdout
+    try:
+        __summary = runStream(frames, predict, imgSize, out, args.batchSize, args.maxWaitMs / 1000, args.queueSize, args.workers, __skipFrames)
+        print(json.dumps(__summary), file = sys.stderr)
+    except KeyboardInterrupt:
+        __stop.set()
+    finally:
+        if out is not sys.stdout:
+            out.close()
@@ -5,58 +5,269 @@ import tensorflow as tf
 from tensorflow.keras.callbacks import ModelCheckpoint # type: ignore
 from utils import lrScheduler
 import sys, os
+import argparse
 
 # Import YOLOv1-specific methods and classes
 from YOLOv1_Model import YOLOV1_Model
-from YOLOv1_learning_Rate import customLearningRate
+from YOLOv1_Config import YOLOv1_Config
+from YOLOv1_learning_Rate import customLearningRate, throughputCallback
 from YOLOv1_Reshape_Layer import YOLOv1_LastLayer_Reshape
 from YOLOv1_Loss import YOLOv1_loss
+from YOLOv1_Evaluation import evaluationCallback
 
 here = os.path.dirname(".")
 sys.path.append(os.path.join(here, '..'))
 from dataHandler import *
+from dataPipeline import dataGenerator_YOLOv1, buildDataset_YOLOv1, sequenceToDataset_YOLOv1
+from dataAugmentation import batchAugmenter
+
+def getStrategy(name, cpuReplicas = 1):
+    """
+    Returns the tf.distribute strategy of the training. 
+
+    Args:
+        name: str: "default" (No distribution), "mirrored" (All the GPUs of this machine, or 
+            cpuReplicas logical CPU devices if there are no GPUs) or "multiworker" (Synchronous 
+            training on the workers defined by the TF_CONFIG environment variable)
+        cpuReplicas: int: Number of logical devices the CPU is split to. Only used by the mirrored
+            strategy when there are no GPUs.
+
+    Returns:
+        A tf.distribute.Strategy
+    """
+    if name == "mirrored":
+        if len(tf.config.list_physical_devices("GPU")) == 0 and 1 < cpuReplicas:
+            __cpu = tf.config.list_physical_devices("CPU")[0]
+            tf.config.set_logical_device_configuration(__cpu, [tf.config.LogicalDeviceConfiguration() for _ in range(cpuReplicas)])
+
+        __devices = tf.config.list_logical_devices("GPU") or tf.config.list_logical_devices("CPU")
+        return tf.distribute.MirroredStrategy([device.name for device in __devices])
+
+    if name == "multiworker":
+        # Ring all-reduce works on CPU workers as well
+        __options = tf.distribute.experimental.CommunicationOptions(implementation = tf.distribute.experimental.CommunicationImplementation.RING)
+        return tf.distribute.MultiWorkerMirroredStrategy(communication_options = __options)
+
+    return tf.distribute.get_strategy()
+
+def isChief(strategy):
+    """
+    Returns True if this worker is the chief of the cluster (Or if there is no cluster). Only the
+    chief keeps the checkpoints.
+
+    Args:
+        strategy: tf.distribute.Strategy: The strategy of the training
+    """
+    __resolver = getattr(strategy, "cluster_resolver", None)
+    if __resolver is None or __resolver.task_type is None:
+        return True
+
+    if __resolver.task_type == "chief":
+        return True
+
+    return __resolver.task_type == "worker" and __resolver.task_id == 0 and "chief" not in __resolver.cluster_spec().as_dict()
+
+def makeDataset(args, config, imgDir, annotDf, shuffle, shardPrefix, inputContext, generators = None, augment = False, contexts = None):
+    """
+    Builds the input pipeline of one worker. Each worker reads its own shard of the data (See 
+    shardIndexes) in batches of the per-replica batch size, tf.distribute sends the batches to the 
+    replicas of the worker.
+
+    Args:
+        args: argparse.Namespace: The command line arguments
+        config: YOLOv1_Config: The input size, grid cells and number of classes of the network
+        imgDir: str: The directory which contains the images
+        annotDf: pd.DataFrame: The annotations of the images
+        shuffle: bool: Weather to shuffle the data in each epoch
+        shardPrefix: str: Prefix of the shards written by YOLOv1_Preprocess.py, or None
+        inputContext: tf.distribute.InputContext: Passed by strategy.distribute_datasets_from_function
+        generators: list: If passed, the dataGenerator_YOLOv1 of the sequence pipeline is appended 
+            to it (For the throughput callback)
+        augment: bool: Whether to augment the batches (If --augment is given)
+        contexts: list: If passed, inputContext is appended to it (For stepsPerEpoch)
+
+    Returns:
+        An endless tf.data.Dataset of (images, ground truth tensors) batches
+    """
+    __batchSize = inputContext.get_per_replica_batch_size(args.batchSize)
+    __shard = (inputContext.num_input_pipelines, inputContext.input_pipeline_id)
+    if contexts is not None:
+        contexts.append(inputContext)
+    __augmenter = batchAugmenter(interpolation = args.augmentInterpolation, seed = args.augmentSeed) if augment and args.augment else None
+
+    if args.pipeline == "tfdata":
+        # The decoded images are cached in memory, in a file (One per split and shard) or not at all
+        __cache = {"none": None, "memory": ""}.get(args.cache, f"{args.cache}.{os.path.basename(os.path.normpath(imgDir))}.{__shard[1]}")
+        return buildDataset_YOLOv1(imgDir, __batchSize, config.imgSize, annotDf, config.nClass, shuffle, config.gridCells, 
+                                   cache = __cache, imgDtype = args.imgDtype, shard = __shard, draftDecode = not args.fullDecode, resample = args.resample, 
+                                   augmenter = __augmenter).repeat()
+
+    generator = dataGenerator_YOLOv1(imgDir, __batchSize, config.imgSize, annotDf, config.nClass, shuffle, config.gridCells, 
+                                     nWorkers = args.workers, shardPrefix = shardPrefix, imgDtype = args.imgDtype, shard = __shard, 
+                                     timeStages = args.timeStages, draftDecode = not args.fullDecode, resample = args.resample, 
+                                     augmenter = __augmenter)
+    if generators is not None:
+        generators.append(generator)
+
+    return sequenceToDataset_YOLOv1(generator)
+
+def countImages(imgDir, shardPrefix = None):
+    """
+    Returns the number of images of a dataset, read from the shards if shardPrefix is given.
+    """
+    if shardPrefix is not None:
+        return len(loadGroundTruth_YOLOv1(shardPrefix)[1])
+
+    return len([item for item in os.listdir(imgDir) if item.endswith(".jpg")])
+
+def stepsPerEpoch(nImages, batchSize, inputContext):
+    """
+    Returns the number of steps of an epoch from the shard of this worker. Each step takes one 
+    per-replica batch of the shard for every replica of the worker, so it is the number of batches 
+    of the shard (len(generator)) divided by the number of replicas of the worker.
+
+    Args:
+        nImages: int: Number of images of the whole dataset
+        batchSize: int: The global batch size
+        inputContext: tf.distribute.InputContext: The input context of this worker's pipeline
+    """
+    __shard = (inputContext.num_input_pipelines, inputContext.input_pipeline_id)
+    __nShard = len(shardIndexes(nImages, __shard))
+    __replicasPerWorker = inputContext.num_replicas_in_sync // inputContext.num_input_pipelines
+
+    return __nShard // inputContext.get_per_replica_batch_size(batchSize) // __replicasPerWorker
 
 # Start the training process
 if __name__ == "__main__":
 
+    # Parse the command line arguments
+    parser = argparse.ArgumentParser(description = "Trains the YOLOv1 network.")
+    parser.add_argument("--dataDir", default = "../data", help = "The directory of the data, containing images/{train,test} and labels/{train,test}")
+    parser.add_argument("--modelDir", default = "./model_data", help = "The directory to save the checkpoints in")
+    parser.add_argument("--imgSize", type = int, nargs = 2, default = (448, 448), help = "Input size of the network (width height) in pixels")
+    parser.add_argument("--gridCells", type = int, nargs = 2, default = (7, 7), help = "Number of grid cells (Sx Sy)")
+    parser.add_argument("--nBoxes", type = int, default = 2, help = "Number of predicted boxes in each grid cell")
+    parser.add_argument("--nClass", type = int, default = 1, help = "Number of classes")
+    parser.add_argument("--backbone", choices = ["darknet", "separable"], default = "darknet", help = "The convolutions of the backbone")
+    parser.add_argument("--widthMultiplier", type = float, default = 1., help = "Multiplier of the number of filters of the backbone")
+    parser.add_argument("--head", choices = ["dense", "conv"], default = "dense", help = "The neck of the network: Flatten + Dense (dense) or a 1x1 convolution (conv)")
+    parser.add_argument("--epochs", type = int, default = 135, help = "Number of epochs")
+    parser.add_argument("--batchSize", type = int, default = 1, help = "The global batch size (Divided between all the replicas)")
+    parser.add_argument("--stepsPerExecution", type = int, default = 1, help = "Number of batches to run in each tf.function call")
+    parser.add_argument("--accumulationSteps", type = int, default = 1, help = "Number of batches to accumulate the gradients over before each update")
+    parser.add_argument("--strategy", choices = ["default", "mirrored", "multiworker"], default = "default",
+                        help = "The tf.distribute strategy. multiworker reads the cluster from the TF_CONFIG environment variable")
+    parser.add_argument("--cpuReplicas", type = int, default = 1, help = "Number of replicas on the CPU for the mirrored strategy (If there are no GPUs)")
+    parser.add_argument("--workers", type = int, default = 0, help = "Number of threads reading the images in the sequence pipeline")
+    parser.add_argument("--pipeline", choices = ["sequence", "tfdata"], default = "sequence",
+                        help = "The input pipeline: dataGenerator_YOLOv1 (sequence) or buildDataset_YOLOv1 (tfdata)")
+    parser.add_argument("--cache", default = "none",
+                        help = "tfdata: Where to cache the decoded images: none, memory (The whole dataset in the host RAM) or a file path prefix")
+    parser.add_argument("--trainShards", default = None, help = "Prefix of the training shards written by YOLOv1_Preprocess.py")
+    parser.add_argument("--testShards", default = None, help = "Prefix of the test shards written by YOLOv1_Preprocess.py")
+    parser.add_argument("--imgDtype", choices = ["float32", "uint8"], default = "float32",
+                        help = "The data type of the input images. uint8 images are normalized by the model")
+    parser.add_argument("--fullDecode", action = "store_true", help = "Decode the JPEGs at full resolution, instead of the smallest libjpeg scale that is still larger than the input")
+    parser.add_argument("--resample", choices = ["nearest", "bilinear", "bicubic", "lanczos", "box"], default = "bicubic", help = "The filter of resizing the images")
+    parser.add_argument("--augment", action = "store_true", help = "Augment the training batches (Scale, translation, flip, exposure, saturation and hue)")
+    parser.add_argument("--augmentSeed", type = int, default = 0, help = "The seed of the augmentation")
+    parser.add_argument("--augmentInterpolation", choices = ["bilinear", "nearest"], default = "bilinear", help = "The interpolation of the augmented images")
+    parser.add_argument("--jitCompile", action = "store_true", help = "Compile the training step with XLA")
+    parser.add_argument("--mixedPrecision", choices = ["none", "mixed_float16", "mixed_bfloat16"], default = "none",
+                        help = "The mixed precision policy. The last layer and the loss always run in float32")
+    parser.add_argument("--lossScale", type = float, default = None,
+                        help = "Initial dynamic loss scale for mixed_float16 (Keras default if not given, 0 to disable)")
+    parser.add_argument("--evalEvery", type = int, default = 0, help = "Calculate the mAP of the test data every N epochs (0 to disable)")
+    parser.add_argument("--throughputLog", default = None, help = "A .csv or .jsonl file to log the images/sec, step time, data wait (sequence pipeline only) and host memory to")
+    parser.add_argument("--logEvery", type = int, default = 50, help = "Number of batches between the rows of the throughput log")
+    parser.add_argument("--timeStages", action = "store_true", help = "Time the stages of the sequence pipeline (Logged to the .jsonl throughput log)")
+    parser.add_argument("--profileSteps", type = int, nargs = 2, default = None, help = "Record a tf.profiler trace from the first to the last step (Counted from 0)")
+    parser.add_argument("--profileDir", default = "./profile", help = "The directory of the profiler traces")
+    args = parser.parse_args()
+
+    if args.pipeline == "tfdata" and (args.trainShards is not None or args.testShards is not None):
+        parser.error("The shards are read by the sequence pipeline")
+
+    if args.lossScale is not None and args.mixedPrecision != "mixed_float16":
+        parser.error("Loss scaling is only used with the mixed_float16 policy")
+
+    if args.batchSize < 1 or args.stepsPerExecution < 1 or args.accumulationSteps < 1:
+        parser.error("The batch size, steps per execution and accumulation steps should be positive")
+
+    config = YOLOv1_Config(args.gridCells, args.nBoxes, args.nClass, args.imgSize)
+
+    # The strategy has to be created before any other tensorflow operation
+    strategy = getStrategy(args.strategy, args.cpuReplicas)
+    if args.batchSize % strategy.num_replicas_in_sync != 0:
+        parser.error(f"The batch size should be divisible by the number of replicas ({strategy.num_replicas_in_sync})")
+
+    # Keras runs several steps per call and accumulates the gradients inside tf.function control flow,
+    # which can not contain the cross-replica gradient aggregation
+    if 1 < strategy.num_replicas_in_sync and (1 < args.stepsPerExecution or 1 < args.accumulationSteps):
+        parser.error("Steps per execution and gradient accumulation are only supported on a single replica, increase the batch size instead")
+
+    # The policy has to be set before building the model
+    if args.mixedPrecision != "none":
+        tf.keras.mixed_precision.set_global_policy(args.mixedPrecision)
+
     # See if there are any GPUs
     print("Num GPUs Available: ", len(tf.config.list_physical_devices('GPU')))
+    print("Number of replicas: ", strategy.num_replicas_in_sync)
+
+    # Only the chief keeps the checkpoints, the other workers write to a temporary directory
+    modelDir = args.modelDir if isChief(strategy) else os.path.join(args.modelDir, f"worker_{strategy.cluster_resolver.task_id}")
 
     # See if the directory to save the checkpoints exists
-    if not os.path.isdir(f"{os.getcwd()}/model_data"):
-        os.mkdir(f"{os.getcwd()}/model_data")
+    os.makedirs(modelDir, exist_ok = True)
 
     # Instantiate the checkpoint object
-    chkPoint = ModelCheckpoint(filepath='./model_data/model_{epoch:02d}-{val_loss:.2f}.keras',
+    chkPoint = ModelCheckpoint(filepath=os.path.join(modelDir, 'model_{epoch:02d}-{val_loss:.2f}.keras'),
                                         save_best_only=True,
                                         monitor='val_loss',
                                         mode='min',
                                         verbose=1
                                 )
 
-    batch_size = 1
     LR_schedule = [
         (0, 0.01),
         (75, 0.001),
         (105, 0.0001),
     ]
 
-    dfTrain = annotationsToDataframe(f"../data/labels/train", "txt")
-    trainingBatchGenerator = dataGenerator_YOLOv1(f"../data/images/train", batch_size, (448,448), dfTrain, 1, True)
+    trainImgDir, testImgDir = os.path.join(args.dataDir, "images/train"), os.path.join(args.dataDir, "images/test")
+    dfTrain = annotationsToDataframe(os.path.join(args.dataDir, "labels/train"), "txt", cache = True)
+    dfTest = annotationsToDataframe(os.path.join(args.dataDir, "labels/test"), "txt", cache = True)
+
+    # Each worker builds its own input pipelines (See --cache for the decoded images cache of the tf.data pipeline)
+    trainGenerators, trainContexts, testContexts = [], [], []
+    trainingBatchGenerator = strategy.distribute_datasets_from_function(
+        lambda inputContext: makeDataset(args, config, trainImgDir, dfTrain, True, args.trainShards, inputContext, trainGenerators, True, trainContexts))
+    testingBatchGenerator = strategy.distribute_datasets_from_function(
+        lambda inputContext: makeDataset(args, config, testImgDir, dfTest, False, args.testShards, inputContext, contexts = testContexts))
+
+    # The steps are counted from the shard of this worker. The shards of all workers have the same 
+    # size, so all of them run the same number of steps.
+    trainingSteps = stepsPerEpoch(countImages(trainImgDir, args.trainShards), args.batchSize, trainContexts[0])
+    testingSteps = stepsPerEpoch(countImages(testImgDir, args.testShards), args.batchSize, testContexts[0])
 
-    dfTest = annotationsToDataframe(f"../data/labels/test", "txt")
-    testingBatchGenerator = dataGenerator_YOLOv1(f"../data/images/test", batch_size, (448,448), dfTrain, 1, True)
+    # The variables are created in the scope of the strategy, so they are mirrored on all replicas
+    with strategy.scope():
+        model = YOLOV1_Model(config, args.backbone, args.widthMultiplier, args.head).getModel(args.imgDtype, args.jitCompile, args.lossScale, args.stepsPerExecution, args.accumulationSteps)
 
-    model = YOLOV1_Model().getModel()
+    # The mAP is added to the logs before the checkpoint callback runs
+    callbacks = [customLearningRate(lrScheduler, LR_schedule)]
+    if 0 < args.evalEvery:
+        callbacks.append(evaluationCallback(testImgDir, dfTest, config.nClass, args.evalEvery, imgSize = config.imgSize, params = config.predParams()))
+    if args.throughputLog is not None or args.profileSteps is not None:
+        __logPath = args.throughputLog if isChief(strategy) or args.throughputLog is None else os.path.join(modelDir, os.path.basename(args.throughputLog))
+        callbacks.append(throughputCallback(args.batchSize, __logPath, args.logEvery, trainGenerators, args.profileSteps, args.profileDir))
+    callbacks.append(chkPoint)
 
     model.fit(x=trainingBatchGenerator,
-            steps_per_epoch = int(trainingBatchGenerator.indexes.shape[0] // batch_size),
-            epochs = 135,
+            steps_per_epoch = trainingSteps,
+            epochs = args.epochs,
             verbose = 1,
             validation_data = testingBatchGenerator,
-            validation_steps = int(testingBatchGenerator.indexes.shape[0] // batch_size),
-            callbacks = [
-                customLearningRate(lrScheduler, LR_schedule),
-                chkPoint,
-            ]
-    )
\ No newline at end of file
+            validation_steps = testingSteps,
+            callbacks = callbacks
+    )
@@ -1,3 +1,8 @@
+import os
+import sys
+import csv
+import json
+import time
 import keras
 import tensorflow as tf
 
@@ -50,3 +55,205 @@ class customLearningRate(keras.callbacks.Callback):
         # Notify the user
         if learningRate != newLearningRate:
             tf.print(f"Updated the learning rate at epoch NO. {epoch}. New learning rate: {newLearningRate}")
+
+
+def hostMemoryMB():
+    """
+    Returns the resident memory of this process in MB. Read from /proc on Linux, elsewhere the peak
+    resident memory is returned instead.
+    """
+    if sys.platform == "linux":
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS"):
+                    return int(line.split()[1]) / 1024
+
+    import resource
+    __peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return __peak / 1024 ** 2 if sys.platform == "darwin" else __peak / 1024
+
+class throughputCallback(keras.callbacks.Callback):
+    """
+    Logs the throughput of the training every logEvery batches: images per second, the mean time of
+    the training steps, the time spent producing the batches of the data generators (See
+    dataGenerator_YOLOv1.stallTime), and the host memory. The rows are written to a CSV or a JSON
+    lines file (Chosen by the extension of logPath) and printed if verbose.
+
+    The data wait (dataWaitMs) is only measured for dataGenerator_YOLOv1. Without generators (e.g.
+    the tf.data pipeline) it is not measured and written as missing: null in the JSON lines and an
+    empty cell in the CSV. Use profileSteps to find the input stalls of the tf.data pipeline.
+
+    If the generators time their stages (timeStages = True), the JSON lines also contain the
+    statistics of each stage since the previous row (See stageTimer.stats).
+
+    Optionally, a tf.profiler trace is recorded over a range of steps, to be opened in TensorBoard.
+
+    Args:
+        batchSize: int: The global batch size
+        logPath: str: A .csv or .jsonl file to write the rows to. Nothing is written if None.
+        logEvery: int: Number of batches between the rows
+        generators: list: The dataGenerator_YOLOv1 objects of the training data. The list can be
+            filled after creating the callback (e.g. by strategy.distribute_datasets_from_function).
+        profileSteps: tuple: (first, last) global step numbers (Counted from 0) to trace, or None
+        profileDir: str: The directory of the profiler traces
+        verbose: bool: Whether to print the rows
+    """
+    csvColumns = ["epoch", "step", "imagesPerSecond", "stepMs", "dataWaitMs", "hostMemoryMB"]
+
+    def __init__(self, batchSize, logPath = None, logEvery = 50, generators = None, profileSteps = None, profileDir = "./profile", verbose = False):
+        """
+        Initialized the class
+        """
+        super(throughputCallback, self).__init__()
+        self.batchSize = batchSize
+        self.logPath = logPath
+        self.logEvery = logEvery
+        self.generators = generators if generators is not None else []
+        self.profileSteps = profileSteps
+        self.profileDir = profileDir
+        self.verbose = verbose
+        self.step = 0
+        self.epoch = 0
+        self.profiling = False
+        self.rows = []
+
+    def on_train_begin(self, logs = None):
+        """
+        Opens the log file.
+        """
+        self.file = None
+        if self.logPath is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.logPath)), exist_ok = True)
+            self.file = open(self.logPath, "w", newline = "")
+            self.isCSV = self.logPath.endswith(".csv")
+            if self.isCSV:
+                self.writer = csv.DictWriter(self.file, self.csvColumns, extrasaction = "ignore")
+                self.writer.writeheader()
+
+        self.__resetInterval()
+
+    def on_epoch_begin(self, epoch, logs = None):
+        """
+        Runs on the epoch start.
+        """
+        self.epoch = epoch
+        self.__resetInterval()
+
+    def on_train_batch_begin(self, batch, logs = None):
+        """
+        Starts the profiler at the first profiled step and the timer of the step.
+        """
+        if self.profileSteps is not None and self.step == self.profileSteps[0]:
+            tf.profiler.experimental.start(self.profileDir)
+            self.profiling = True
+
+        self.batchStart = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs = None):
+        """
+        Stops the profiler after the last profiled step and writes a row every logEvery batches.
+        """
+        self.stepTime += time.perf_counter() - self.batchStart
+        self.nBatches += 1
+
+        if self.profiling and self.profileSteps[1] <= self.step:
+            self.__stopProfiler()
+
+        self.step += 1
+        if self.logEvery <= self.nBatches:
+            self.__log()
+
+    def on_test_begin(self, logs = None):
+        """
+        Writes the row of the last batches of the epoch before the validation starts, so the time
+        of the validation is not counted.
+        """
+        if 0 < self.nBatches:
+            self.__log()
+
+    def on_epoch_end(self, epoch, logs = None):
+        """
+        Writes the row of the last batches of the epoch (If there is no validation).
+        """
+        if 0 < self.nBatches:
+            self.__log()
+
+    def on_train_end(self, logs = None):
+        """
+        Stops the profiler and closes the log file.
+        """
+        if self.profiling:
+            self.__stopProfiler()
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __stopProfiler(self):
+        tf.profiler.experimental.stop()
+        self.profiling = False
+
+    def __stallTime(self):
+        # None if the data wait is not measured (No generators)
+        if len(self.generators) == 0:
+            return None
+        return sum(generator.stallTime for generator in self.generators)
+
+    def __resetInterval(self):
+        """
+        Starts a new logging interval.
+        """
+        self.intervalStart = time.perf_counter()
+        self.stallStart = self.__stallTime()
+        self.stepTime = 0.
+        self.nBatches = 0
+
+    def __log(self):
+        """
+        Writes a row for the batches since the previous row.
+        """
+        __elapsed = time.perf_counter() - self.intervalStart
+        __stall = self.__stallTime()
+        __dataWait = (__stall - self.stallStart) / self.nBatches * 1000 if __stall is not None and self.stallStart is not None else None
+        row = {
+            "epoch": self.epoch, "step": self.step, "imagesPerSecond": self.nBatches * self.batchSize / __elapsed,
+            "stepMs": self.stepTime / self.nBatches * 1000, "dataWaitMs": __dataWait,
+            "hostMemoryMB": hostMemoryMB(),
+        }
+
+        # Merge the stages of all the generators
+        __stages = {}
+        for generator in self.generators:
+            if generator.timer is not None:
+                for stage, stats in generator.timer.stats(reset = True).items():
+                    __stages.setdefault(stage, []).append(stats)
+        if 0 < len(__stages):
+            row["stages"] = {stage: self.__mergeStages(stats) for stage, stats in __stages.items()}
+
+        self.rows.append(row)
+        if self.file is not None:
+            if self.isCSV:
+                self.writer.writerow(row)
+            else:
+                self.file.write(json.dumps(row) + "\n")
+            self.file.flush()
+
+        if self.verbose:
+            __data = f"{row['dataWaitMs']:.1f} ms" if row["dataWaitMs"] is not None else "not measured"
+            tf.print(f"\nstep {row['step']}: {row['imagesPerSecond']:.1f} images/s, step {row['stepMs']:.1f} ms, data {__data}, host memory {row['hostMemoryMB']:.0f} MB")
+
+        self.__resetInterval()
+
+    def __mergeStages(self, lstStats):
+        """
+        Merges the stage statistics of several generators. The counts, totals and histograms are
+        summed, the percentiles are the maximum of the generators (An upper bound).
+        """
+        __count = sum(s["count"] for s in lstStats)
+        __total = sum(s["totalSeconds"] for s in lstStats)
+        merged = {"count": __count, "totalSeconds": __total, "meanMs": __total / __count * 1000}
+        for k in ("p50Ms", "p90Ms", "p99Ms", "maxMs"):
+            merged[k] = max(s[k] for s in lstStats)
+        merged["histogram"] = [sum(h) for h in zip(*(s["histogram"] for s in lstStats))]
+
+        return merged
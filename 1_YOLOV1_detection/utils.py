@@ -9,7 +9,6 @@ import numpy as np
 from  PIL import Image
 import pandas as pd
 import tensorflow as tf
-import dataHandler as handler
 
 def customSQRT(tensor):
     """
@@ -58,7 +57,7 @@ def customSQRT3(tensor:tf.Tensor, initGuess:tf.float32, iterations:int) -> tf.Te
         
     return __result
 
-def iouUtils(boxParams, gridRatio = tf.constant(7, tf.float32)):
+def iouUtils(boxParams, gridRatio = 7.):
     """
     Given bounding box centers and its width and height, calculates top-left and bottom-right coordinates of the box.
     Note that calculations in this function are done with teh assumption of w and h being a float number, between 0 and 1
@@ -68,7 +67,8 @@ def iouUtils(boxParams, gridRatio = tf.constant(7, tf.float32)):
     Args:
         boxParams: tf.Tensor: A tensor with following information (Box center X, Box center Y, Box width, Box height) for all
             boxes in a tensor.
-        gridRatio: int: The number of evenly distributed grid cells in each image axis. Use 7 for YOLOv1.
+        gridRatio: float or tf.Tensor: The number of evenly distributed grid cells in each image axis. Either one
+            number for both axes or (Sx, Sy). Use 7 for YOLOv1.
     
     Returns:
         Two tensors, one indicating top-left pint of the bBox and, the other one denoting bottom-right edge.
@@ -0,0 +1,239 @@
+"""
+Contains the data augmentation of the training batches. The images and the bounding boxes of a whole
+batch are transformed at once with numpy operations, before the ground truth tensors are encoded.
+Only numpy is needed, so the same augmentation runs in dataGenerator_YOLOv1 and (through
+tf.numpy_function) in buildDataset_YOLOv1.
+"""
+import threading
+import numpy as np # type: ignore
+
+# Luma weights of the RGB channels, used for the saturation jitter
+lumaWeights = np.array([.299, .587, .114], dtype = np.float32)
+
+# Conversion from RGB to YIQ. The hue jitter is a rotation of the I and Q (Chrominance) channels.
+rgbToYIQ = np.array([[.299, .587, .114], [.596, -.274, -.322], [.211, -.523, .312]], dtype = np.float32)
+yiqToRGB = np.linalg.inv(rgbToYIQ).astype(np.float32)
+
+class batchAugmenter():
+    """
+    Augments batches of images and their bounding boxes with the augmentations of the YOLOv1 paper:
+    random scaling and translation of up to 20% of the image size and random exposure and
+    saturation of up to a factor of 1.5, plus horizontal flips and a small hue shift.
+
+    The geometric transform of each image is a scale about the center of the image, a translation
+    and an optional horizontal flip. It is separable in x and y, so the images are warped by
+    gathering the source rows and columns of the whole batch at once. The pixels outside of the
+    source image get fillValue. The boxes get the same transform, are clipped to the image and
+    dropped if less than minVisible of their area is left in the image.
+
+    The color jitter is a 3x3 matrix for each image (exposure * hue rotation * saturation), applied
+    to the batch with one matrix multiplication. Scaling the saturation towards the luma and rotating
+    the chrominance in the YIQ space is a linear approximation of the HSV jitter.
+
+    The random parameters of a batch only depend on the seed and the key of the batch (e.g.
+    (epoch, batch index)), so the augmentation is reproducible for a given seed, differs in every
+    epoch, and does not depend on the order the batches are made in (e.g. by parallel workers).
+
+    Args:
+        scale: float: Maximum relative change of the size of the images
+        translate: float: Maximum translation relative to the image size
+        flip: float: Probability of flipping an image horizontally
+        exposure: float: Maximum factor of the brightness change (>= 1)
+        saturation: float: Maximum factor of the saturation change (>= 1)
+        hue: float: Maximum hue shift, as a fraction of the hue circle
+        interpolation: str: "bilinear" or "nearest"
+        fillValue: int: The value of the pixels outside of the source images
+        minVisible: float: Boxes with a smaller part of their area left in the image are dropped
+        seed: int: The seed of the augmentation. If None, a random seed is chosen.
+    """
+    def __init__(self, scale = .2, translate = .2, flip = .5, exposure = 1.5, saturation = 1.5, hue = .015,
+                 interpolation = "bilinear", fillValue = 127, minVisible = .25, seed = None):
+        """
+        Initializes the object.
+        """
+        if interpolation not in ("bilinear", "nearest"):
+            raise Exception(f"Invalid interpolation: {interpolation}. Only bilinear and nearest are acceptable.")
+        if exposure < 1 or saturation < 1:
+            raise Exception(f"The exposure and saturation factors should be at least 1, got {exposure} and {saturation}")
+
+        self.scale = scale
+        self.translate = translate
+        self.flip = flip
+        self.exposure = exposure
+        self.saturation = saturation
+        self.hue = hue
+        self.interpolation = interpolation
+        self.fillValue = fillValue
+        self.minVisible = minVisible
+        self.seed = seed if seed is not None else int(np.random.SeedSequence().entropy % 2 ** 63)
+        self.calls = 0
+        self.__lock = threading.Lock()
+
+    def __call__(self, images, boxes, classes, imgIdx, key = None):
+        """
+        Augments a batch.
+
+        Args:
+            images: np.ndarray: A uint8 array of shape (n, height, width, 3)
+            boxes: np.ndarray: An array of shape (m, 4) with [boxCenterX, boxCenterY, boxWidth, boxHeight]
+                of each box, relative to the image
+            classes: np.ndarray: The class of each box, shape (m,)
+            imgIdx: np.ndarray: The index of the image (In the batch) of each box, shape (m,)
+            key: tuple: Integers identifying the batch, e.g. (epoch, batch index). If None, the number
+                of the previous calls is used, which is only reproducible if the batches are
+                augmented in order.
+
+        Returns:
+            A tuple of (images, boxes, classes, imgIdx) after the augmentation. The images are uint8,
+            the boxes that left the image are removed.
+        """
+        if key is None:
+            with self.__lock:
+                key = (self.calls,)
+                self.calls += 1
+
+        __rng = np.random.default_rng([self.seed, *key])
+        params = self.sampleParams(__rng, images.shape[0])
+
+        return self.warpImages(images, params), *self.transformBoxes(boxes, classes, imgIdx, params)
+
+    def sampleParams(self, rng, n):
+        """
+        Draws the random parameters of n images.
+
+        Args:
+            rng: np.random.Generator: The random generator
+            n: int: Number of images
+
+        Returns:
+            A dictionary of arrays of shape (n,): scale, translateX, translateY, flip, and the color
+            matrices of shape (n, 3, 3)
+        """
+        params = {
+            "scale": rng.uniform(1 - self.scale, 1 + self.scale, n),
+            "translateX": rng.uniform(-self.translate, self.translate, n),
+            "translateY": rng.uniform(-self.translate, self.translate, n),
+            "flip": rng.random(n) < self.flip,
+        }
+
+        # Exposure and saturation factors are log-uniform, so e.g. 1.5 and 1/1.5 are equally likely
+        __exposure = np.exp(rng.uniform(-np.log(self.exposure), np.log(self.exposure), n)).astype(np.float32)
+        __saturation = np.exp(rng.uniform(-np.log(self.saturation), np.log(self.saturation), n)).astype(np.float32)
+        __angle = rng.uniform(-self.hue, self.hue, n).astype(np.float32) * 2 * np.pi
+
+        # Saturation: Blend each pixel with its luma
+        __sat = __saturation[:, None, None] * np.eye(3, dtype = np.float32) + (1 - __saturation)[:, None, None] * lumaWeights[None, None, :]
+
+        # Hue: Rotate the chrominance (I, Q) in the YIQ space
+        __rot = np.zeros((n, 3, 3), dtype = np.float32)
+        __rot[:, 0, 0] = 1
+        __rot[:, 1, 1], __rot[:, 1, 2] = np.cos(__angle), -np.sin(__angle)
+        __rot[:, 2, 1], __rot[:, 2, 2] = np.sin(__angle), np.cos(__angle)
+        __hue = yiqToRGB @ __rot @ rgbToYIQ
+
+        params["color"] = __exposure[:, None, None] * (__hue @ __sat)
+        return params
+
+    def __sourceCoords(self, n, size, scale, translate, flip = None):
+        """
+        Returns the (float) source pixel coordinates of the output pixels along one axis of the
+        images, shape (n, size).
+        """
+        __p = (np.arange(size, dtype = np.float32) + .5) / size
+        __p = np.broadcast_to(__p, (n, size))
+        if flip is not None:
+            __p = np.where(flip[:, None], 1 - __p, __p)
+
+        # Inverse of p' = (p - .5) * scale + .5 + translate
+        __src = (__p - .5 - translate[:, None]) / scale[:, None] + .5
+        return (__src * size - .5).astype(np.float32)
+
+    def warpImages(self, images, params):
+        """
+        Scales, translates, flips and color jitters a batch of images.
+
+        Gathering whole rows is much faster than gathering single pixels, so the rows are gathered
+        (And interpolated) first, then the batch is transposed and the columns are gathered as rows.
+        The batch is only transposed as uint8 (The interpolated rows are rounded), the color jitter 
+        is done in the transposed layout and the uint8 output is transposed back.
+
+        Args:
+            images: np.ndarray: A uint8 array of shape (n, height, width, 3)
+            params: dict: See sampleParams
+
+        Returns:
+            The augmented uint8 images
+        """
+        __n, __H, __W = images.shape[:3]
+        __batch = np.arange(__n)[:, None]
+        __srcX = self.__sourceCoords(__n, __W, params["scale"], params["translateX"], params["flip"])
+        __srcY = self.__sourceCoords(__n, __H, params["scale"], params["translateY"])
+
+        # The output columns and rows that come from outside of the source image
+        __outsideX = (__srcX < -.5) | (__W - .5 < __srcX)
+        __outsideY = (__srcY < -.5) | (__H - .5 < __srcY)
+
+        out = self.__gatherRows(images, __batch, __srcY, __H)
+        if out.dtype != np.uint8:
+            out += .5
+            out = out.astype(np.uint8)
+        out = np.ascontiguousarray(out.transpose(0, 2, 1, 3))
+        out = self.__gatherRows(out, __batch, __srcX, __W).astype(np.float32, copy = False)
+
+        # Color jitter, one matrix multiplication for the whole batch
+        out = out.reshape(__n, -1, 3) @ params["color"].transpose(0, 2, 1)
+        out = out.reshape(__n, __W, __H, 3)
+        out[__outsideX] = self.fillValue
+        out.transpose(0, 2, 1, 3)[__outsideY] = self.fillValue
+
+        # Round and convert to uint8 (Truncation of the non-negative values after adding .5)
+        np.clip(out, 0, 255, out = out)
+        out += .5
+        return np.ascontiguousarray(out.astype(np.uint8).transpose(0, 2, 1, 3))
+
+    def __gatherRows(self, images, batch, src, size):
+        """
+        Gathers the rows (Axis 1) of a batch of images at the source coordinates src (shape (n, rows)),
+        with nearest (uint8 output) or linear (float32 output) interpolation.
+        """
+        if self.interpolation == "nearest":
+            return images[batch, np.clip(np.rint(src), 0, size - 1).astype(np.intp)]
+
+        __i0 = np.clip(np.floor(src), 0, size - 1).astype(np.intp)
+        __i1 = np.minimum(__i0 + 1, size - 1)
+        __w = np.clip(src - __i0, 0, 1)[:, :, None, None]
+
+        # out = a + (b - a) * w
+        out = images[batch, __i0].astype(np.float32)
+        __b = images[batch, __i1].astype(np.float32)
+        __b -= out
+        __b *= __w
+        out += __b
+        return out
+
+    def transformBoxes(self, boxes, classes, imgIdx, params):
+        """
+        Applies the geometric transform of each image to its boxes and clips them to the image.
+
+        Args:
+            boxes: np.ndarray: Shape (m, 4), [boxCenterX, boxCenterY, boxWidth, boxHeight] relative to the image
+            classes: np.ndarray: Shape (m,)
+            imgIdx: np.ndarray: Shape (m,), the image of each box
+            params: dict: See sampleParams
+
+        Returns:
+            A tuple of (boxes, classes, imgIdx) of the boxes that are still visible
+        """
+        __scale = params["scale"][imgIdx]
+        __cx = (boxes[:, 0] - .5) * __scale + .5 + params["translateX"][imgIdx]
+        __cy = (boxes[:, 1] - .5) * __scale + .5 + params["translateY"][imgIdx]
+        __cx = np.where(params["flip"][imgIdx], 1 - __cx, __cx)
+        __w, __h = boxes[:, 2] * __scale, boxes[:, 3] * __scale
+
+        __x1, __x2 = np.clip(__cx - __w / 2, 0, 1), np.clip(__cx + __w / 2, 0, 1)
+        __y1, __y2 = np.clip(__cy - __h / 2, 0, 1), np.clip(__cy + __h / 2, 0, 1)
+        __visible = (__x2 - __x1) * (__y2 - __y1)
+        __keep = (0 < __visible) & (self.minVisible * __w * __h <= __visible)
+
+        __boxes = np.stack([(__x1 + __x2) / 2, (__y1 + __y2) / 2, __x2 - __x1, __y2 - __y1], axis = -1).astype(boxes.dtype)
+        return __boxes[__keep], classes[__keep], imgIdx[__keep]
@@ -1,13 +1,16 @@
 """
 Contains the necessary function for handling the train, test and cross-validation datasets.
 """ 
-import matplotlib.pyplot as plt  # type: ignore
-import matplotlib.image as mpimg # Necessary for readig an image  # type: ignore
-import matplotlib.patches as patches # Necessary for drawing bounding boxes  # type: ignore
+import io
 import glob
 import os
-import tensorflow as tf # type: ignore
-import keras # type: ignore
+import time
+import importlib.util
+import threading
+import tempfile
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path # type: ignore
 import pandas as pd # type: ignore
 import numpy as np # type: ignore
@@ -37,6 +40,10 @@ def dispBBox(picDir, picName, annotation, labelsNames, newSize = None, gridCells
         None
     """
 
+    # matplotlib is only imported when something is displayed
+    import matplotlib.pyplot as plt  # type: ignore
+    import matplotlib.patches as patches # Necessary for drawing bounding boxes  # type: ignore
+
     # Show the image
     fig, ax = plt.subplots()
     img = Image.open(f"{picDir}/{picName}.jpg")
@@ -118,7 +125,74 @@ def dispBBox(picDir, picName, annotation, labelsNames, newSize = None, gridCells
     plt.show()
     return None
 
-def generateGroundTruth_YOLOv1(annotDir, annotExt, params = (7, 7, 1, 1)):
+def encodeGroundTruth_YOLOv1(boxes, classes, imgIdx, nImg, params = (7, 7, 1, 1), dtype = np.float32):
+    """
+    Generates the YOLOv1 ground truth tensors of a batch of images at once. Instead of iterating 
+    through the boxes, the grid cell of every box is calculated with array operations and the 
+    boxes are scattered into the output tensor with fancy indexing.
+    Each grid cell of the output has the following parameters (order is important): 
+    [<classes one-hot vector>, <B confidence scores>, <B times (relX, relY, width, height)>]. relX 
+    and relY define the center of the bounding box relative to the top-left corner of its grid cell 
+    and width and height are relative to the entire image. Because the coordinates are relative, 
+    the tensor does not depend on the image size in pixels. For B > 1 (The prediction layout of the 
+    network), the box is repeated for all B boxes of the cell. Cells without objects are all zeros.
+
+    Note: Each grid cell is responsible for one object. If the centers of multiple boxes of an 
+        image fall in the same grid cell, only one of them is kept.
+
+    Args:
+        boxes: np.ndarray: An array of shape (n, 4) containing [boxCenterX, boxCenterY, boxWidth, boxHeight]
+            of the boxes, relative to the entire image.
+        classes: np.ndarray: An integer array of shape (n,) containing the class of each box.
+        imgIdx: np.ndarray: An integer array of shape (n,) containing the index of the image (In the batch)
+            that each box belongs to.
+        nImg: int: Number of images in the batch.
+        params: tuple: A tuple containing parameters (Sx, Sy, B, C)
+        dtype: np.dtype: The data type of the output.
+
+    Returns:
+        A numpy array of shape (nImg, Sx, Sy, 5*B + C)
+    """
+    __Sx, __Sy, __B, __C = params
+    outTensor = np.zeros((nImg, __Sx, __Sy, 5*__B + __C), dtype = dtype)
+
+    boxes = np.asarray(boxes, dtype = np.float32).reshape(-1, 4)
+    classes = np.asarray(classes, dtype = np.int64)
+    imgIdx = np.asarray(imgIdx, dtype = np.int64)
+
+    if boxes.shape[0] == 0:
+        return outTensor
+    
+    if classes.min() < 0 or __C <= classes.max():
+        raise Exception(f"Class ids should be in [0, {__C}), got [{classes.min()}, {classes.max()}]")
+
+    # Get the x and y indexes of the grid cells. Boxes centered exactly on the right/bottom edge of 
+    # the image belong to the last grid cell.
+    __x = boxes[:, 0] * __Sx
+    __y = boxes[:, 1] * __Sy
+    cellIdxI = np.clip(np.floor(__x).astype(np.int64), 0, __Sx - 1)
+    cellIdxJ = np.clip(np.floor(__y).astype(np.int64), 0, __Sy - 1)
+
+    # The relative coordinates of the bounding box to the grid cell's top-left corner except w and 
+    # h which are relative to the entire image.
+    __coords = np.stack([__x - cellIdxI, __y - cellIdxJ, boxes[:, 2], boxes[:, 3]], axis = -1)
+
+    # Keep only the last box of every grid cell, so the scattered one-hot vectors, scores and
+    # coordinates always belong to the same box
+    __cellKey = (imgIdx * __Sx + cellIdxI) * __Sy + cellIdxJ
+    _, __lastIdx = np.unique(__cellKey[::-1], return_index = True)
+    __keep = boxes.shape[0] - 1 - __lastIdx
+    imgIdx, cellIdxI, cellIdxJ = imgIdx[__keep], cellIdxI[__keep], cellIdxJ[__keep]
+    classes, __coords = classes[__keep], __coords[__keep]
+
+    # Scatter the one-hot classes, confidence scores and coordinates
+    outTensor[imgIdx, cellIdxI, cellIdxJ, classes] = 1
+    outTensor[imgIdx, cellIdxI, cellIdxJ, __C:__C + __B] = 1
+    outTensor[imgIdx, cellIdxI, cellIdxJ, __C + __B:] = np.tile(__coords, (1, __B))
+
+    return outTensor
+
+def generateGroundTruth_YOLOv1(annotDir, annotExt, params = (7, 7, 1, 1), dtype = np.float32):
     """
     Processes the train data to generate ground truth matrices for YOLOv1 Network.
     Generates a dataFrame that contains two columns, namely, id and vector. "id" refers to the 
@@ -128,8 +202,9 @@ def generateGroundTruth_YOLOv1(annotDir, annotExt, params = (7, 7, 1, 1)):
     and the number of categories that we are trying to identify.
     The output vector architecture is as follows: When there is no object in the grid, all the 
     vector parameters are zero. When there is an object in the grid cell in (i,j) grid location,
-    the matrix located at is as follows: Tensor[i,j, :] = np.array([class number, confidence_score, 
-        relX, relY, width, height])
+    the matrix located at is as follows: Tensor[i,j, :] = np.array([<classes one-hot vector>, 
+        confidence_score, relX, relY, width, height]). The tensors are generated by 
+        encodeGroundTruth_YOLOv1.
 
     Note: We added "B" to the parameters to generalize this function. Because we are generating 
         ground truth matrices, B is always equal to 1
@@ -138,68 +213,108 @@ def generateGroundTruth_YOLOv1(annotDir, annotExt, params = (7, 7, 1, 1)):
         annotDir: str: The directory containing annotations.
         annotExt: str: The extensions of the annotations.
         params: tuple: A tuple containing parameters (Sx, Sy, B, C)
+        dtype: np.dtype: The data type of the ground truth tensors.
+
+    Note: For large annotation directories, prefer generateGroundTruthArray_YOLOv1 which returns 
+        the tensors stacked in a single array.
 
     Returns: 
         A pandas dataFrame with one column: [vector]. ID of each image is noted as the row index. 
             Each item in the vector column is a numpy array
     """
-    __Sx = params[0]
-    __Sy = params[1]
-    __B  = params[2]
-    __C  = params[3]
+    outTensor, index = generateGroundTruthArray_YOLOv1(annotDir, annotExt, params, dtype)
 
+    # Each vector is a view of the stacked array, the ground truth tensors are not copied
+    __ids = sorted(index, key = index.get)
+    __df = pd.DataFrame({"id": __ids, "vector": list(outTensor)})
+    __df = __df.set_index("id")
+    return __df
 
-    __df = pd.DataFrame(columns = ["id","vector"])
+def generateGroundTruthArray_YOLOv1(annotDir, annotExt, params = (7, 7, 1, 1), dtype = np.float32):
+    """
+    Processes the train data to generate ground truth matrices for YOLOv1 Network, same as 
+    generateGroundTruth_YOLOv1. Instead of a dataFrame of arrays, the ground truth tensors of all 
+    images are stacked in a single contiguous array which is much cheaper to build, store and 
+    slice for large annotation directories. Use saveGroundTruth_YOLOv1 and loadGroundTruth_YOLOv1
+    to persist the results.
 
-    if annotExt.lower() == "txt":
-        i = 0
-        # Read the files in the directory
-        files = glob.glob(f"{os.getcwd()}/{annotDir}/*.txt")
-        for file in files:
-            with open(file) as f:
-                id = Path(file).stem
-                # Generate the ground truth tensor
-                outTensor = np.zeros((__Sx,__Sy,__B*(4+1) + __C))
-
-                for annot in f.readlines():
-                    annot = annot.replace("\n","") # Replace newline character
-                    annot = annot.split(" ")
-
-                    x = np.float64(annot[1])* 448
-                    y = np.float64(annot[2])* 448
-                    w = np.float64(annot[3])* 448
-                    h = np.float64(annot[4])* 448
-
-                    # Get the x and y indexes of the grid cell
-                    cell_idx_i = int(x / 64) + 1
-                    cell_idx_j = int(y / 64) + 1
-
-                    # The top-left corner of the gridCell
-                    x_a = (cell_idx_i-1) * 64
-                    y_a = (cell_idx_j-1) * 64
-
-                    # The relative coordinates of the bounding box to the grid cell's top-left
-                    # corner except w and h which are relative to the entire image.
-                    xRel = (x-x_a) / 64
-                    yRel = (y-y_a) / 64
-                    wRel = w / 448
-                    hRel = h / 448
-
-                    # Change the output matrix accordingly. The target tensor/matrix should have 
-                    # the following properties for each grid cell: (classNo|confidenceScore|xRel|yRel|w|h)
-                    # where the classNo is a one-hot encoded vector.
-                    outTensor[cell_idx_i-1,cell_idx_j-1,:] = np.array([1, 1, xRel, yRel, wRel, hRel])
-                
-                # Add the ground truth value to the dataFrame
-                __df.loc[i,["id", "vector"]] = [id, outTensor]
-
-                # Increase the index
-                i += 1
+    Args:
+        annotDir: str: The directory containing annotations.
+        annotExt: str: The extensions of the annotations.
+        params: tuple: A tuple containing parameters (Sx, Sy, B, C)
+        dtype: np.dtype: The data type of the ground truth tensors, float32 by default.
+
+    Returns: 
+        outTensor: np.ndarray: An array of shape (N, Sx, Sy, 5*B + C) containing the ground truth
+            tensors of N images.
+        index: dict: Maps the id of each image to its row in outTensor.
+    """
+    if annotExt.lower() != "txt":
+        raise Exception(f"Invalid extension type: {annotExt}. Only text files are acceptable.")
+
+    # Read the files in the directory, same as annotationsToDataframe
+    files = glob.glob(f"{annotDir}/*.txt")
+    if len(files) == 0:
+        raise Exception(f"No annotations found in {annotDir}")
+
+    # Images without any boxes still get a (zero) ground truth tensor, so the ids are taken from the
+    # files and not from the annotations
+    __lstID = sorted(Path(file).stem for file in files)
+    offsets, boxes, classes = indexAnnotations(parseAnnotationFiles(files))
+
+    # Gather the boxes of all files, the ground truth tensors are generated at once
+    __ranges = [offsets.get(id, (0, 0)) for id in __lstID]
+    __rows = np.concatenate([np.arange(start, stop) for start, stop in __ranges] + [np.zeros(0, dtype = np.int64)])
+    __imgIdx = np.repeat(np.arange(len(__lstID)), [stop - start for start, stop in __ranges])
+
+    outTensor = encodeGroundTruth_YOLOv1(boxes[__rows], classes[__rows], __imgIdx, len(__lstID), params, dtype)
+
+    index = {id: i for i, id in enumerate(__lstID)}
+    return outTensor, index
+
+def saveGroundTruth_YOLOv1(filePrefix, outTensor, index):
+    """
+    Saves the stacked ground truth tensors and their ids as two .npy files: {filePrefix}_vectors.npy
+    and {filePrefix}_ids.npy. 
+
+    Args:
+        filePrefix: str: Path of the files without the suffixes and extensions.
+        outTensor: np.ndarray: The stacked ground truth tensors, returned from generateGroundTruthArray_YOLOv1.
+        index: dict: Maps the id of each image to its row in outTensor.
     
-    __df = __df.set_index("id")
-    return __df
+    Returns:
+        None
+    """
+    __ids = np.empty(len(index), dtype = object)
+    for id, row in index.items():
+        __ids[row] = id
+
+    np.save(f"{filePrefix}_vectors.npy", np.ascontiguousarray(outTensor))
+    np.save(f"{filePrefix}_ids.npy", __ids.astype(str))
+
+    return None
+
+def loadGroundTruth_YOLOv1(filePrefix, mmap = True):
+    """
+    Loads the ground truth tensors saved by saveGroundTruth_YOLOv1. By default the tensors are 
+    memory-mapped, so loading is instant and slicing the rows of a batch does not read or copy 
+    the entire array.
+
+    Args:
+        filePrefix: str: Path of the files without the suffixes and extensions.
+        mmap: bool: Weather to memory-map the tensors (read-only) instead of reading them into memory.
+
+    Returns:
+        outTensor: np.ndarray: An array of shape (N, Sx, Sy, 5*B + C). A np.memmap if mmap is True.
+        index: dict: Maps the id of each image to its row in outTensor.
+    """
+    outTensor = np.load(f"{filePrefix}_vectors.npy", mmap_mode = "r" if mmap else None)
+    __ids = np.load(f"{filePrefix}_ids.npy")
+    index = {str(id): i for i, id in enumerate(__ids)}
+
+    return outTensor, index
 
-def annotationsToDataframe(annotDir, annotExt, annotId = None):
+def annotationsToDataframe(annotDir, annotExt, annotId = None, nWorkers = 8, chunkSize = 512, cache = False):
     """
     Reads the annotations from a directory and returns a dataFrame. Annotations can be saved
     in two formats: TXT or XLS. 
@@ -211,55 +326,41 @@ def annotationsToDataframe(annotDir, annotExt, annotId = None):
     Note that it is assumed that the ID of each annotation is the file's name and there should 
     be and image file with the same exact name (And different extension) in the data directory.  
 
+    The text files are read by a pool of threads in chunks of files. The numbers of each chunk are
+    parsed at once by numpy, straight into typed columns. See parseAnnotationFiles.
+
     Args:
         annotDir: str: The directory containing annotations.
         annotExt: str: The extensions of the annotations.
         annotId: str: The id of the specific image. If you want the returned dataFrame to contain only 
             the annotations for a specific image. If None, the entire annotation directory will 
-            be read and returned as a dataFrame.
+            be read and returned as a dataFrame. If passed, only the file of that image is read.
+        nWorkers: int: Number of threads for reading the files.
+        chunkSize: int: Number of files that each thread reads and parses at once.
+        cache: bool: Weather to use the persistent annotations cache stored next to annotDir. Only 
+            the files that were added, changed or removed since the last call are parsed. See
+            updateAnnotationCache. Not used if annotId is passed.
 
     Returns: 
         A pandas dataFrame with columns: [id, boxCenterX, boxCenterY, boxWidth, boxHeight, objClass]       
     """
-    # For performance purposes, we wont use append/concat row methods for each new entry. We append 
-    # new data to lists as we iterate through the annotations. At the end we make a dataFrame with 
-    # the lists in hand.Temporary lists for appending the new data.
-    __lstID = []
-    __lstBoxCenterX = []
-    __lstBoxCenterY = []
-    __lstBoxWidth = []
-    __lstBoxHeight = []
-    __lstClass = []
+    files = []
 
     if annotExt.lower() == "txt":
-        # Read the files in the directory
-        files = glob.glob(f"{annotDir}/*.txt")
-        if len(files) == 0:
-            raise Exception("No annotations found in the passed directory")
+        if annotId != None:
+            # Only get a specific annotation, no need for searching the directory
+            files = [f"{annotDir}/{annotId}.txt"] if os.path.isfile(f"{annotDir}/{annotId}.txt") else []
+            if len(files) == 0 and len(glob.glob(f"{annotDir}/*.txt")) == 0:
+                raise Exception("No annotations found in the passed directory")
         else:
-            for file in files:
-
-                # GEt the annotation ID which is the file name
-                __fName = Path(file).stem
-                
-                # Only get a specific annotation. IF else, get all the annotations.
-                if annotId != None:
-                    if __fName != annotId:
-                        continue
-
-                with open(file) as f:
-                    
-                    for annot in f.readlines():
-                        annot = annot.replace("\n","") # Replace newline character
-                        annot = annot.split(" ")
-
-                        # Append the new data
-                        __lstID.append(__fName)
-                        __lstBoxCenterX.append(float(annot[1]))
-                        __lstBoxCenterY.append(float(annot[2]))
-                        __lstBoxWidth.append(float(annot[3]))
-                        __lstBoxHeight.append(float(annot[4]))
-                        __lstClass.append(int(annot[0]))
+            # Read the files in the directory. Sorted by id, so the rows are in the same order with 
+            # and without the cache.
+            files = sorted(glob.glob(f"{annotDir}/*.txt"), key = lambda file: Path(file).stem)
+            if len(files) == 0:
+                raise Exception("No annotations found in the passed directory")
+
+            if cache == True:
+                return updateAnnotationCache(annotDir, files, nWorkers, chunkSize)
         
     elif annotExt.lower() == "xml":
         # ----TODO----
@@ -267,178 +368,596 @@ def annotationsToDataframe(annotDir, annotExt, annotId = None):
     else:
         print("Invalid extension type. Only text and XML files are acceptable.")
 
+    return parseAnnotationFiles(files, nWorkers, chunkSize)
+
+def parseAnnotationFiles(files, nWorkers = 8, chunkSize = 512):
+    """
+    Reads a list of TXT annotation files (See annotationsToDataframe) and returns a dataFrame. The 
+    files are read by a pool of threads in chunks and the numbers of each chunk are parsed at once
+    by numpy.
+
+    Args:
+        files: list: Paths of the annotation files. The name of each file is the ID of its image.
+        nWorkers: int: Number of threads for reading the files.
+        chunkSize: int: Number of files that each thread reads and parses at once.
+
+    Returns: 
+        A pandas dataFrame with columns: [id, boxCenterX, boxCenterY, boxWidth, boxHeight, objClass]       
+    """
+    # For performance purposes, we wont use append/concat row methods for each new entry. Each 
+    # chunk of files is parsed to numpy arrays and at the end we make a dataFrame with the 
+    # concatenated arrays in hand.
+    __lstID = [np.zeros(0, dtype = object)]
+    __lstValues = [np.zeros((0, 5))]
+
+    def __parseChunk(files):
+        """
+        Reads a chunk of annotation files and parses all of their numbers at once. The files are 
+        separated by -inf, so the number of rows of each file is found from the parsed array.
+        """
+        __texts = []
+        for file in files:
+            with open(file) as f:
+                __texts.append(f.read())
+
+        # An invalid number raises a ValueError (Older versions of numpy stop parsing with a warning,
+        # which is found by the separator check below)
+        try:
+            values = np.fromstring(" -inf ".join(__texts) + " -inf", sep = " ")
+        except ValueError:
+            # Only on errors, find the invalid file
+            for file, text in zip(files, __texts):
+                try:
+                    np.fromstring(text, sep = " ")
+                except ValueError:
+                    raise Exception(f"Invalid annotation file: {file}. Every line should contain 5 numbers.")
+            raise
+        __ends = np.flatnonzero(np.isneginf(values))
+
+        # Parsing stops at the first invalid number, so the files after it have no separator
+        if __ends.shape[0] != len(files):
+            raise Exception(f"Invalid annotation file: {files[__ends.shape[0]]}. Every line should contain 5 numbers.")
+
+        # Each annotation has 5 numbers
+        __nNumbers = np.diff(__ends, prepend = -1) - 1
+        if np.any(__nNumbers % 5 != 0):
+            raise Exception(f"Invalid annotation file: {files[np.flatnonzero(__nNumbers % 5)[0]]}. Every line should contain 5 numbers.")
+
+        values = np.delete(values, __ends).reshape(-1, 5)
+        ids = np.repeat(np.array([Path(file).stem for file in files], dtype = object), __nNumbers // 5)
+
+        return ids, values
+
+    __chunks = [files[i:i + chunkSize] for i in range(0, len(files), chunkSize)]
+    if len(__chunks) <= 1:
+        __results = [__parseChunk(chunk) for chunk in __chunks]
+    else:
+        with ThreadPoolExecutor(max_workers = nWorkers) as pool:
+            __results = list(pool.map(__parseChunk, __chunks))
+
+    for ids, values in __results:
+        __lstID.append(ids)
+        __lstValues.append(values)
     
-    # Merge the lists to make a dataframe
-    df = pd.DataFrame(
-        list(zip(__lstID, __lstClass, __lstBoxCenterX, __lstBoxCenterY, __lstBoxWidth, __lstBoxHeight)),
-        columns = ["id", "objClass", "boxCenterX", "boxCenterY", "boxWidth", "boxHeight"]   
-    )
+    # Merge the arrays to make a dataframe
+    __values = np.concatenate(__lstValues)
+    df = pd.DataFrame({
+        "id": np.concatenate(__lstID),
+        "objClass": __values[:, 0].astype(np.int64),
+        "boxCenterX": __values[:, 1],
+        "boxCenterY": __values[:, 2],
+        "boxWidth": __values[:, 3],
+        "boxHeight": __values[:, 4],
+    })
 
     return df
 
-class dataGenerator_YOLOv1(keras.utils.Sequence):
+def updateAnnotationCache(annotDir, files = None, nWorkers = 8, chunkSize = 512):
+    """
+    Returns the annotations of a directory using a persistent cache. The cache is stored next to the 
+    annotation directory as two files: {annotDir}.annotations.feather containing the annotations 
+    dataFrame and {annotDir}.files.feather containing the modification time and size of each source 
+    file. On every call, only the files that were added, changed (Different modification time or 
+    size) or removed are (re-)parsed and merged into the cached dataFrame, then the cache is updated.
+    If pyarrow is not installed, the cache is stored as pickle files (.pkl) instead of feather.
+
+    Args:
+        annotDir: str: The directory containing the TXT annotations.
+        files: list: Paths of the annotation files. If None, the directory is searched.
+        nWorkers: int: Number of threads for reading the files.
+        chunkSize: int: Number of files that each thread reads and parses at once.
+
+    Returns: 
+        A pandas dataFrame with columns: [id, boxCenterX, boxCenterY, boxWidth, boxHeight, objClass], 
+            sorted by id.
+    """
+    if files is None:
+        files = glob.glob(f"{annotDir}/*.txt")
+
+    # Feather needs pyarrow
+    __ext = "feather" if importlib.util.find_spec("pyarrow") is not None else "pkl"
+    __annotPath = f"{os.path.normpath(annotDir)}.annotations.{__ext}"
+    __filesPath = f"{os.path.normpath(annotDir)}.files.{__ext}"
+
+    def __read(path):
+        return pd.read_feather(path) if __ext == "feather" else pd.read_pickle(path)
+
+    def __write(df, path):
+        # Write to a temporary file first, so an interrupted write does not corrupt the cache. Each 
+        # writer has its own temporary file, as several workers may update the same cache at once.
+        with tempfile.NamedTemporaryFile(dir = os.path.dirname(os.path.abspath(path)), prefix = f"{os.path.basename(path)}.", 
+                                         suffix = ".tmp", delete = False) as f:
+            __tmpPath = f.name
+        try:
+            if __ext == "feather":
+                df.reset_index(drop = True).to_feather(__tmpPath)
+            else:
+                df.to_pickle(__tmpPath)
+            os.replace(__tmpPath, path)
+        except BaseException:
+            os.remove(__tmpPath)
+            raise
+
+    # The current state of the source files
+    __stats = [os.stat(file) for file in files]
+    stats = pd.DataFrame({
+        "id": [Path(file).stem for file in files],
+        "file": files,
+        "mtimeNs": np.array([stat.st_mtime_ns for stat in __stats], dtype = np.int64),
+        "fileSize": np.array([stat.st_size for stat in __stats], dtype = np.int64),
+    })
+
+    if os.path.isfile(__annotPath) and os.path.isfile(__filesPath):
+        df = __read(__annotPath)
+        oldStats = __read(__filesPath)
+
+        # Find the added, changed and removed files. The inner merge keeps the int64 mtimes and sizes 
+        # of the files that are in both (A left merge would turn them to float64 for the added files
+        # and lose the nanoseconds).
+        __merged = stats.merge(oldStats[["id", "mtimeNs", "fileSize"]].astype({"mtimeNs": np.int64, "fileSize": np.int64}), on = "id", suffixes = ("", "Old"))
+        __modified = set(__merged.loc[(__merged["mtimeNs"] != __merged["mtimeNsOld"]) | (__merged["fileSize"] != __merged["fileSizeOld"]), "id"])
+        __added = set(stats["id"]) - set(oldStats["id"])
+        __removed = set(oldStats["id"]) - set(stats["id"])
+        __changed = stats[stats["id"].isin(__modified | __added)]
+        __stale = __modified | __added | __removed
+
+        if len(__stale) == 0:
+            return df
+
+        df = df[~df["id"].isin(__stale)]
+        df = pd.concat([df, parseAnnotationFiles(__changed["file"].tolist(), nWorkers, chunkSize)], ignore_index = True)
+    else:
+        df = parseAnnotationFiles(files, nWorkers, chunkSize)
+
+    # The (re-)parsed rows are merged back in the order of the ids, same as a fresh parse of the sorted
+    # files (See annotationsToDataframe)
+    df = df.sort_values("id", kind = "stable", ignore_index = True)
+
+    __write(df, __annotPath)
+    __write(stats[["id", "mtimeNs", "fileSize"]], __filesPath)
+
+    return df
+
+def indexAnnotations(annotDf):
+    """
+    Groups the annotations by image id in a CSR-like layout. The boxes of all images are stored in 
+    one contiguous array sorted by id, and each id is mapped to the (start, stop) rows of its boxes.
+    Building the index is done once, afterwards getting the annotations of an image costs 
+    O(boxes in that image) instead of a scan of the entire dataFrame.
+
+    Args:
+        annotDf: pd.DataFrame: A pandas dataFrame containing the annotations. Preferably it should be 
+            returned from annotationsToDataframe method.
+
+    Returns:
+        offsets: dict: Maps each image id to a (start, stop) tuple of row indexes in boxes and classes.
+        boxes: np.ndarray: A float32 array of shape (n, 4) with [boxCenterX, boxCenterY, boxWidth, boxHeight]
+            in each row.
+        classes: np.ndarray: An int32 array of shape (n,) containing the class of each box.
+    """
+    __ids = annotDf["id"].to_numpy()
+    __order = np.argsort(__ids, kind = "stable")
+
+    boxes = annotDf[["boxCenterX", "boxCenterY", "boxWidth", "boxHeight"]].to_numpy(np.float32)[__order]
+    classes = annotDf["objClass"].to_numpy(np.int32)[__order]
+
+    # Boxes of the same image are contiguous after sorting, so the first occurrence and the count of
+    # each id give us its slice
+    __uniqueIds, __starts, __counts = np.unique(__ids[__order], return_index = True, return_counts = True)
+    offsets = {id: (int(start), int(start + count)) for id, start, count in zip(__uniqueIds, __starts, __counts)}
+
+    return offsets, boxes, classes
+
+def shardIndexes(n, shard = (1, 0)):
+    """
+    Returns the indexes of the samples that belong to one shard of the data, used for reading a 
+    disjoint part of the data on each worker of a distributed training. Every numShards-th sample 
+    goes to the same shard. The last n % numShards samples are dropped, so all shards have the same
+    size and all workers run the same number of steps.
+
+    Args:
+        n: int: Number of samples
+        shard: tuple: (numShards, shardIndex). (1, 0) returns all the samples.
+
+    Returns:
+        A numpy array of the indexes of the samples of the shard
+    """
+    __nShards, __shardIdx = shard
+    if __nShards < 1 or not 0 <= __shardIdx < __nShards:
+        raise Exception(f"Invalid shard: {shard}. Should be (numShards, shardIndex) with 0 <= shardIndex < numShards")
+
+    return np.arange(__shardIdx, n // __nShards * __nShards, __nShards)
+
+def normalizeImage(img, dtype = np.float32, out = None):
+    """
+    Converts uint8 pixels to the input of the network. Floating point types are normalized to [0, 1]
+    and uint8 is kept as it is, so the normalization can be done by the model (on the device).
+
+    Args:
+        img: np.ndarray: The uint8 pixels of one or more images.
+        dtype: np.dtype: The data type of the output, e.g. np.float32 or np.uint8.
+        out: np.ndarray: A preallocated array to write the output into. If None, a new array is 
+            allocated.
+
+    Returns:
+        A numpy array of the given data type.
+    """
+    if out is None:
+        out = np.empty(img.shape, dtype = dtype)
+
+    if np.dtype(dtype) == np.uint8:
+        np.copyto(out, img)
+    else:
+        np.divide(img, 255., out = out, dtype = out.dtype)
+
+    return out
+
+# The resampling filters of the resize, by name
+resampleFilters = {
+    "nearest": Image.Resampling.NEAREST, "bilinear": Image.Resampling.BILINEAR, "bicubic": Image.Resampling.BICUBIC, 
+    "lanczos": Image.Resampling.LANCZOS, "box": Image.Resampling.BOX, "hamming": Image.Resampling.HAMMING,
+}
+
+def readImage(imgDir, imgSize, normalize = True, timer = None, draft = True, resample = "bicubic"):
+    """
+    Reads, resizes and normalizes an image. It is a module-level function so it can be sent to the
+    worker processes of dataGenerator_YOLOv1.
+
+    Large JPEGs are decoded at a reduced resolution (See PIL's Image.draft): libjpeg can scale the 
+    image by 1/2, 1/4 or 1/8 while decoding, and the largest scale that keeps the image at least as 
+    large as imgSize is used. The result is then resized to imgSize as usual. This skips most of the
+    decoding work and memory of images that are much larger than the input of the network.
+
+    Args: 
+        imgDir: str: Path of the image file.
+        imgSize: tuple: A tuple containing the new image size (width,height) in pixels.
+        normalize: bool: Weather to normalize the image to [0, 1] (float32). If False, the uint8 
+            pixels are returned.
+        timer: stageTimer: If passed, the time of reading the file ("read"), decoding ("decode"), 
+            resizing ("resize") and normalizing ("normalize") are added to it. The file is then read
+            to memory before decoding, so the disk and the decoder are timed separately.
+        draft: bool: Whether to decode JPEGs at a reduced resolution. Other formats are always 
+            decoded at full resolution.
+        resample: str: The filter of the resize, one of the keys of resampleFilters.
+
+    Returns: 
+        A numpy array, the (normalized) image.
+    """
+    if timer is None:
+        with Image.open(imgDir) as img:
+            if draft == True:
+                img.draft("RGB", imgSize)
+            return resizeImage(img, imgSize, normalize, resample)
+
+    with timer.time("read"):
+        with open(imgDir, "rb") as f:
+            __data = f.read()
+
+    with timer.time("decode"):
+        img = Image.open(io.BytesIO(__data))
+        if draft == True:
+            img.draft("RGB", imgSize)
+        img.load()
+
+    with timer.time("resize"):
+        img = resizeImage(img, imgSize, False, resample)
+
+    if normalize == True:
+        with timer.time("normalize"):
+            img = normalizeImage(img, np.float32)
+
+    return img
+
+def resizeImage(img, imgSize, normalize = True, resample = "bicubic"):
+    """
+    Converts an image to RGB, resizes and normalizes it. Used by readImage, and for the images that 
+    are not read from files (e.g. the frames of a video).
+
+    Args: 
+        img: PIL.Image: The image.
+        imgSize: tuple: A tuple containing the new image size (width,height) in pixels.
+        normalize: bool: Weather to normalize the image to [0, 1] (float32). If False, the uint8 
+            pixels are returned.
+        resample: str: The filter of the resize, one of the keys of resampleFilters.
+
+    Returns: 
+        A numpy array, the (normalized) image.
+    """
+    if resample not in resampleFilters:
+        raise Exception(f"Invalid resampling filter: {resample}. Only {', '.join(resampleFilters)} are acceptable.")
+
+    img = img.convert("RGB")
+    img = img.resize(imgSize, resampleFilters[resample])
+    img = np.array(img)
+
+    if normalize == True:
+        img = normalizeImage(img, np.float32)
+
+    return img
+
+def jpegDraftRatio(imgDir, imgSize):
+    """
+    Returns the scale denominator (1, 2, 4 or 8) that readImage decodes a JPEG with. Same as PIL's
+    draft, it is the largest ratio r with width // r >= imgSize[0] and height // r >= imgSize[1]. 
+    Only the header of the file is read. Used by buildDataset_YOLOv1 for tf.io.decode_jpeg(ratio = ...),
+    so both pipelines decode an image at the same scale.
+
+    Args: 
+        imgDir: str: Path of the image file.
+        imgSize: tuple: A tuple containing the new image size (width,height) in pixels.
+    """
+    with Image.open(imgDir) as img:
+        __width, __height = img.size
+
+    for ratio in (8, 4, 2):
+        if __width // ratio >= imgSize[0] and __height // ratio >= imgSize[1]:
+            return ratio
+
+    return 1
+
+def buildShards_YOLOv1(imgDir, annotDf, outPrefix, imgSize, nClass, gridCells = (7, 7), nWorkers = 4, chunkSize = 256, 
+                       targetDtype = np.float32):
+    """
+    Preprocesses a dataset once, so the images do not have to be decoded and resized in every epoch.
+    The resized images are written as uint8 to a single memory-mapped block, {outPrefix}_images.npy, 
+    of shape (N, height, width, 3). The ground truth tensors and the image ids are saved next to it 
+    by saveGroundTruth_YOLOv1. The rows of all three files are in the same order. The images are 
+    read by a pool of threads and written in chunks, so the entire dataset is never held in memory.
+    Use loadShards_YOLOv1 or the shardPrefix argument of dataGenerator_YOLOv1 to read the shards.
+
+    Args:
+        imgDir: str: The directory which contains the images. Each file should be saved with jpg 
+            extension and its name should be the ID of the image.
+        annotDf: pd.DataFrame: A pandas dataFrame containing all of the annotations.
+        outPrefix: str: Path of the output files without the suffixes and extensions.
+        imgSize: tuple: A tuple containing training image size (width,height) in pixels.
+        nClass: int: Number of classes that are to be detected.
+        gridCells: tuple: Number of grid cells in each axis of the image (Sx, Sy). (7,7) for YOLOv1.
+        nWorkers: int: Number of threads for reading the images.
+        chunkSize: int: Number of images that are read before being written to the block.
+        targetDtype: np.dtype: The data type of the ground truth tensors.
+
+    Returns:
+        Number of the written images.
     """
-    The dataGenerator class is used to help with the loading of training data to tensorflow model. 
-    Loading the entire dataset can be memory intensive. To solve this issue, only at the beginning of
-    each epoch the training data is loaded in predefined batches. As stated in tensorflow documentation, 
-    using this method guarantees that the network will only train once on each sample per epoch.
+    __lst = sorted(item.replace(".jpg", "") for item in os.listdir(imgDir) if item.endswith(".jpg"))
+
+    images = np.lib.format.open_memmap(
+        f"{outPrefix}_images.npy", mode = "w+", dtype = np.uint8, shape = (len(__lst), imgSize[1], imgSize[0], 3)
+    )
+
+    with ThreadPoolExecutor(max_workers = nWorkers) as pool:
+        for i in range(0, len(__lst), chunkSize):
+            __chunk = __lst[i:i + chunkSize]
+            __paths = [f"{imgDir}/{id}.jpg" for id in __chunk]
+            for j, img in enumerate(pool.map(readImage, __paths, [imgSize] * len(__chunk), [False] * len(__chunk))):
+                images[i + j] = img
+
+    images.flush()
+    del images
 
-    Also note that: Every Sequence must implement the __getitem__ and the __len__ methods. If you want 
-    to modify your dataset between epochs you may implement on_epoch_end. The method __getitem__ should
-    return a complete batch.
+    # Generate the ground truth tensors of all images at once
+    offsets, boxes, classes = indexAnnotations(annotDf)
+    __rows = [offsets.get(id, (0, 0)) for id in __lst]
+    __boxIdx = np.concatenate([np.arange(start, stop) for start, stop in __rows] + [np.zeros(0, np.int64)])
+    __imgIdx = np.concatenate([np.full(stop - start, i) for i, (start, stop) in enumerate(__rows)] + [np.zeros(0, np.int64)])
 
-    Ref: https://www.tensorflow.org/api_docs/python/tf/keras/utils/Sequence
+    outTensor = encodeGroundTruth_YOLOv1(
+        boxes[__boxIdx], classes[__boxIdx], __imgIdx, len(__lst), tuple(gridCells) + (1, nClass), targetDtype
+    )
+    saveGroundTruth_YOLOv1(outPrefix, outTensor, {id: i for i, id in enumerate(__lst)})
+
+    return len(__lst)
+
+def loadShards_YOLOv1(outPrefix):
     """
+    Memory-maps the shards written by buildShards_YOLOv1. Nothing is read until the arrays are 
+    sliced, and slicing contiguous rows does not copy the data.
 
-    def __init__(self, trainImgDir, batchSize, imgSize, annotDf, nClass, shuffle):
+    Args:
+        outPrefix: str: Path of the shard files without the suffixes and extensions.
+
+    Returns:
+        images: np.memmap: A uint8 array of shape (N, height, width, 3).
+        outTensor: np.memmap: The ground truth tensors of shape (N, Sx, Sy, 5 + C).
+        index: dict: Maps the id of each image to its row in images and outTensor.
+    """
+    images = np.load(f"{outPrefix}_images.npy", mmap_mode = "r")
+    outTensor, index = loadGroundTruth_YOLOv1(outPrefix, mmap = True)
+
+    if images.shape[0] != outTensor.shape[0]:
+        raise Exception(f"The shards of {outPrefix} do not match: {images.shape[0]} images and {outTensor.shape[0]} ground truth tensors")
+
+    return images, outTensor, index
+
+class stageTimer():
+    """
+    A thread-safe collector of the durations of named stages (e.g. "read", "decode", "resize"), for
+    finding where the time of a pipeline goes. The latest durations of each stage are kept, so the 
+    memory is bounded, and summarized by stats() as percentiles and a histogram over the fixed bins
+    of binEdgesMs.
+
+    Args:
+        maxSamples: int: Number of the latest durations kept for each stage
+    """
+    # Bin edges of the histograms in milliseconds (1, 2, 5 steps from 10 us to 10 s)
+    binEdgesMs = [m * 10. ** e for e in range(-2, 4) for m in (1, 2, 5)] + [1e4]
+
+    def __init__(self, maxSamples = 10000):
         """
         Initializes the object.
+        """
+        self.maxSamples = maxSamples
+        self.__samples = {}
+        self.__totals = {}
+        self.__lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        """
+        Adds a duration to a stage.
 
         Args:
-            trainImgDir: str: The directory which contains the training data. Each file should be saved with
-            jpg extension. Also the imageId of each training sample should be the same as its file name. 
-                e.g. {imageId}.gpg
-            batchSize: int: The size of training samples in each batch. Preferably powers of two.
-            annotDf: pd.DataFrame: A pandas dataFrame containing all of the annotations.
-            imgSize: tuple: A tuple containing training image size (width,height) in pixels. (448,448) for
-                YOLOv1.
-            nClass = int: Number of classes that are to be detected.
-            shuffle: bool: Weather to shuffle the data at the end of each epoch. 
+            stage: str: Name of the stage
+            seconds: float: The duration
         """
-        super().__init__()
-        
-        self.trainDir = trainImgDir
-        self.imgSize = imgSize
-        self.batchSize = batchSize
-        self.annots = annotDf
-        self.nClass = nClass
-        self.shuffle = shuffle
-        self.indexes = np.array([])
-        self.lstImageId = [] # A list of entire training image ids
-
-        # Search the trainDir to acquire all the image IDs
-        __lst = os.listdir(trainImgDir)
-        __lst = [item for item in __lst if item.endswith(".jpg")]
-        __lst = [tmp.replace(".jpg", "") for tmp in __lst]
-        self.lstImageId = __lst
-
-        # Run once when object is created.
-        self.on_epoch_end()
-
-    def on_epoch_end(self):
+        with self.__lock:
+            if stage not in self.__samples:
+                self.__samples[stage] = deque(maxlen = self.maxSamples)
+                self.__totals[stage] = [0, 0.]
+            self.__samples[stage].append(seconds)
+            self.__totals[stage][0] += 1
+            self.__totals[stage][1] += seconds
+
+    @contextmanager
+    def time(self, stage):
         """
-        Updates the indexes after each epoch. If self.shuffle == True, the training indexes will be shuffled.
+        A context manager that adds the duration of its block to a stage.
         """
-        self.indexes = np.arange(len(self.lstImageId))
-        if self.shuffle == True:
-            np.random.shuffle(self.indexes)
+        __start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - __start)
 
-    def __len__(self):
+    def stats(self, reset = False):
         """
-        As stated in tensorflow documentation, should return the number of batches per epoch
+        Returns the statistics of each stage: the number of samples, the total time (seconds), the 
+        mean, percentiles and maximum (ms) and the histogram of the latest samples over binEdgesMs.
+
+        Args:
+            reset: bool: Whether to clear the samples afterwards, so the next call only reports the
+                new ones.
+
+        Returns:
+            A dictionary of the statistics of each stage
         """
-        return int(len(self.lstImageId) / self.batchSize)
-        
-    def __getitem__(self, idx):
+        with self.__lock:
+            __samples = {k: np.array(v) * 1000 for k, v in self.__samples.items()}
+            __totals = {k: list(v) for k, v in self.__totals.items()}
+            if reset == True:
+                self.__samples, self.__totals = {}, {}
+
+        stats = {}
+        for stage, ms in __samples.items():
+            __count, __total = __totals[stage]
+            stats[stage] = {
+                "count": __count, "totalSeconds": __total, "meanMs": __total / __count * 1000,
+                "p50Ms": float(np.percentile(ms, 50)), "p90Ms": float(np.percentile(ms, 90)), 
+                "p99Ms": float(np.percentile(ms, 99)), "maxMs": float(ms.max()),
+                "histogram": np.histogram(np.clip(ms, self.binEdgesMs[0], self.binEdgesMs[-1]), self.binEdgesMs)[0].tolist(),
+            }
+
+        return stats
+
+class imageCache():
+    """
+    A thread-safe in-memory cache of decoded images, bounded by a budget in bytes. When adding an 
+    image exceeds the budget, the least recently used images are evicted. The number of hits, misses
+    and evictions are counted, so the budget can be tuned.
+    """
+    def __init__(self, maxBytes):
         """
-        This method generates batches. The right batch should be chosen by using the index argument.
-        The logic: self.indexes contains indexes from 0 to len(self.lstImageId) at the end of each 
-        epoch the index list may be shuffled. Using the index argument, tensorflow iterates through 
-        batches. We select the proper chunk of self.indexes using the index argument then we fill 
-        lstIDs with self.lstImageId items using the indexes we acquired.   
+        Initializes the cache.
+
+        Args:
+            maxBytes: int: The maximum total size of the cached images in bytes.
         """
-        __indexes = self.indexes[self.batchSize * idx : self.batchSize * (idx+1)]
-        lstIDs = [self.lstImageId[i] for i in __indexes]
+        self.maxBytes = maxBytes
+        self.nBytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__items = OrderedDict()
+        self.__lock = threading.Lock()
 
-        # Generate the batch
-        x,y = self.__generateBatch(lstIDs)
-        return x,y
+    def __len__(self):
+        return len(self.__items)
 
-    def __generateBatch(self, lstImg):
+    def get(self, key):
         """
-        Generates a batch by iterating through a list of image IDs.
+        Returns the cached image and marks it as the most recently used one.
 
         Args:
-            lstImg: list: A list of strings, containing image IDs.
-        
+            key: str: The key of the image, e.g. its ID.
+
         Returns:
-            A batch of training and ground truth data.
+            The cached numpy array or None if the image is not cached.
         """
-        x = []
-        y = []
+        with self.__lock:
+            if key in self.__items:
+                self.__items.move_to_end(key)
+                self.hits += 1
+                return self.__items[key]
 
-        for id in lstImg:
-            img, tensor = self._read(id)
+            self.misses += 1
+            return None
 
-            x.append(img)
-            y.append(tensor)
+    def put(self, key, img):
+        """
+        Adds an image to the cache and evicts the least recently used images if the budget is 
+        exceeded. Images bigger than the entire budget are not cached.
 
-        return np.array(x), np.array(y)
+        Args:
+            key: str: The key of the image, e.g. its ID.
+            img: np.ndarray: The image. It should not be modified after being cached.
+        """
+        if self.maxBytes < img.nbytes:
+            return
 
+        with self.__lock:
+            if key in self.__items:
+                self.nBytes -= self.__items.pop(key).nbytes
 
-    def _read(self, ID):
+            self.__items[key] = img
+            self.nBytes += img.nbytes
+
+            while self.maxBytes < self.nBytes:
+                _, __evicted = self.__items.popitem(last = False)
+                self.nBytes -= __evicted.nbytes
+                self.evictions += 1
+
+    def stats(self):
         """
-        Read the images and generate the ground truth tensor from annotations.
-        First the image is read, resized and normalized, Then the annotations from the previously 
-        acquired dataFrame is used to generate the ground truth tensor.
-        For YOLOv1 each image is divided to 7*7 grids and each grid cell has the following parameter
-        in (order is important): [<classes one-hot vector>, confScore, relX, relY, width, height].
-        where relX and relY define the center of the bounding box relative to the grid cell. width 
-        and height parameters define the width and height of the bounding box relative to the 
-        entire image (They are NOT relative to the bounding box to avoid acquiring numbers bigger 
-        than 1). 
-
-        #TODO Generalize it for multiple classes.
-
-        Args: 
-            ID: str: ID of the image to read
-
-        Returns: 
-            Two numpy arrays, The normalized image and it's ground truth tensor compatible with YOLOv1 
-            architecture. 
+        Returns the counters of the cache as a dictionary.
         """
-        imgDir =  f"{self.trainDir}/{ID}.jpg"
+        with self.__lock:
+            return {
+                "items": len(self.__items), "bytes": self.nBytes, "maxBytes": self.maxBytes,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+            }
 
-        # Read, resize and normalize the image
-        img = Image.open(imgDir)
-        img = img.resize(self.imgSize)
-        img = np.array(img)/255.
+# The input pipelines need tensorflow and are defined in dataPipeline.py, so importing this module 
+# only imports numpy, pandas and PIL. They can still be imported from here (e.g. from dataHandler 
+# import dataGenerator_YOLOv1), in which case tensorflow is imported on first access.
+_pipelineNames = ("dataGenerator_YOLOv1", "encodeGroundTruthTF_YOLOv1", "buildDataset_YOLOv1", "sequenceToDataset_YOLOv1")
 
-        # Generate the ground truth tensor
-        outTensor = np.zeros((7,7,1*5 + self.nClass))
+def __getattr__(name):
+    if name in _pipelineNames:
+        import dataPipeline
+        return getattr(dataPipeline, name)
 
-        # Get the relevant annotations
-        df = self.annots[self.annots.id == ID]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-        for _, row in df.iterrows():
-            # Get the absolute values for x,y,w and h
-            x = row.boxCenterX * 448
-            y = row.boxCenterY * 448
-            w = row.boxWidth * 448
-            h = row.boxHeight * 448
-
-            # Get the x and y indexes of the grid cell
-            cell_idx_i = int(x / 64) + 1
-            cell_idx_j = int(y / 64) + 1
-
-            # The top-left corner of the gridCell
-            x_a = (cell_idx_i-1) * 64
-            y_a = (cell_idx_j-1) * 64
-
-            # The relative coordinates of the bounding box to the grid cell's top-left
-            # corner except w and h which are relative to the entire image.
-            xRel = (x-x_a) / 64
-            yRel = (y-y_a) / 64
-            wRel = w / 448
-            hRel = h / 448
-
-            # Change the output matrix accordingly. The target tensor/matrix should have 
-            # the following properties for each grid cell: (classNo|confidenceScore|xRel|yRel|w|h)
-            # where the classNo is a one-hot encoded vector.
-            outTensor[cell_idx_i-1,cell_idx_j-1,:] = np.array([1, 1, xRel, yRel, wRel, hRel])
-        
-        return img, outTensor
-        
 """
 # For testing the methods written here
 df = annotationsToDataframe(f"{os.getcwd()}/data/labels/train", "txt")
@@ -0,0 +1,738 @@
+"""
+Contains the input pipelines that feed the training data to the network: dataGenerator_YOLOv1 (A
+keras Sequence) and buildDataset_YOLOv1 (tf.data). They are kept apart from dataHandler.py, so
+parsing the annotations and encoding the ground truth does not import tensorflow.
+"""
+import os
+import time
+import threading
+from contextlib import nullcontext
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+import tensorflow as tf # type: ignore
+import keras # type: ignore
+import numpy as np # type: ignore
+from dataHandler import (imageCache, stageTimer, readImage, normalizeImage, encodeGroundTruth_YOLOv1, indexAnnotations, 
+                         shardIndexes, loadShards_YOLOv1, resampleFilters, jpegDraftRatio)
+
+class dataGenerator_YOLOv1(keras.utils.Sequence):
+    """
+    The dataGenerator class is used to help with the loading of training data to tensorflow model. 
+    Loading the entire dataset can be memory intensive. To solve this issue, only at the beginning of
+    each epoch the training data is loaded in predefined batches. As stated in tensorflow documentation, 
+    using this method guarantees that the network will only train once on each sample per epoch.
+
+    Also note that: Every Sequence must implement the __getitem__ and the __len__ methods. If you want 
+    to modify your dataset between epochs you may implement on_epoch_end. The method __getitem__ should
+    return a complete batch.
+
+    The images can be read in parallel by a pool of threads or processes. In this mode, the images
+    of the next batches are read in the background while the current batch is being trained on. 
+    The batches are still returned in the order of self.indexes, so for a given seed the order of 
+    the training data is deterministic. stallTime holds the total time spent in __getitem__, i.e. 
+    the time the training loop waited for the data.
+
+    The generator can also read the preprocessed shards of buildShards_YOLOv1 instead of the image 
+    files. In this case, the batches are sliced from the memory-mapped arrays and only normalized
+    per batch.
+
+    The batches are written into preallocated arrays of imgDtype and targetDtype. float32 images are
+    normalized to [0, 1], uint8 images are returned as they are so the normalization can be done by
+    the model (See YOLOV1_Model.getModel) and the batches are 4 times smaller.
+
+    Optionally, the decoded and resized images can be kept in an imageCache (as uint8), so small 
+    datasets, e.g. the validation set, are not read from the disk in every epoch.
+
+    For finding the bottlenecks of the pipeline, the time of each stage (read, decode, resize, 
+    normalize, encode, and wait for the workers) can be collected in self.timer, see stageTimer. With 
+    a pool of processes, the stages that run in the worker processes are not timed.
+
+    The batches can be augmented by a batchAugmenter (See dataAugmentation.py). The images of a batch
+    are read as uint8, augmented together with their boxes and normalized afterwards, then the 
+    ground truth tensors are encoded from the transformed boxes. Each batch is augmented with the
+    key (epoch, batch index), so the augmentation is reproducible and differs in every epoch. Its
+    time is collected in the "augment" stage of self.timer.
+
+    Ref: https://www.tensorflow.org/api_docs/python/tf/keras/utils/Sequence
+    """
+
+    def __init__(self, trainImgDir, batchSize, imgSize, annotDf, nClass, shuffle, gridCells = (7, 7), 
+                 seed = None, nWorkers = 0, prefetch = 2, poolType = "thread", shardPrefix = None, 
+                 cacheBytes = 0, imgDtype = np.float32, targetDtype = np.float32, shard = (1, 0), timeStages = False, 
+                 draftDecode = True, resample = "bicubic", augmenter = None):
+        """
+        Initializes the object.
+
+        Args:
+            trainImgDir: str: The directory which contains the training data. Each file should be saved with
+            jpg extension. Also the imageId of each training sample should be the same as its file name. 
+                e.g. {imageId}.gpg
+            batchSize: int: The size of training samples in each batch. Preferably powers of two.
+            annotDf: pd.DataFrame: A pandas dataFrame containing all of the annotations.
+            imgSize: tuple: A tuple containing training image size (width,height) in pixels. (448,448) for
+                YOLOv1.
+            nClass = int: Number of classes that are to be detected.
+            shuffle: bool: Weather to shuffle the data at the end of each epoch. 
+            gridCells: tuple: Number of grid cells in each axis of the image (Sx, Sy). (7,7) for YOLOv1.
+            seed: int: The seed used for shuffling the data. If None, the order is not reproducible.
+            nWorkers: int: Number of workers for reading the images. If 0, the images are read 
+                sequentially on the calling thread and nothing is prefetched.
+            prefetch: int: Number of batches after the current one to read in the background. Only 
+                used when nWorkers > 0.
+            poolType: str: "thread" or "process". The type of the pool used for reading the images.
+            shardPrefix: str: Path of the shards written by buildShards_YOLOv1 (without suffixes and 
+                extensions). If passed, the images and ground truth tensors are read from the shards 
+                and trainImgDir and annotDf are not used.
+            cacheBytes: int: The budget of the decoded images cache in bytes. If 0, the images are 
+                not cached. See self.cache.stats() for the hit/miss/eviction counters.
+            imgDtype: np.dtype: The data type of the images, np.float32 (normalized) or np.uint8.
+            targetDtype: np.dtype: The data type of the ground truth tensors.
+            shard: tuple: (numShards, shardIndex). Only the samples of this shard (See shardIndexes)
+                are returned. Used for giving each worker of a distributed training its own part 
+                of the data.
+            timeStages: bool: Whether to collect the time of each stage of the pipeline in 
+                self.timer (A stageTimer). Off by default, as it adds a small overhead.
+            draftDecode: bool: Whether to decode large JPEGs at a reduced resolution, see readImage.
+            resample: str: The filter of the resize, one of the keys of resampleFilters.
+            augmenter: batchAugmenter: Augments each batch before its ground truth tensors are 
+                encoded. If None, the batches are not augmented. Can not be used with shardPrefix, as
+                the ground truth tensors of the shards are already encoded.
+        """
+        super().__init__()
+
+        if poolType not in ("thread", "process"):
+            raise Exception(f"Invalid pool type: {poolType}. Only thread and process are acceptable.")
+        if resample not in resampleFilters:
+            raise Exception(f"Invalid resampling filter: {resample}. Only {', '.join(resampleFilters)} are acceptable.")
+        if augmenter is not None and shardPrefix is not None:
+            raise Exception("The shards can not be augmented, their ground truth tensors are already encoded")
+        
+        self.trainDir = trainImgDir
+        self.imgSize = imgSize
+        self.batchSize = batchSize
+        self.annots = annotDf
+        self.nClass = nClass
+        self.shuffle = shuffle
+        self.gridCells = tuple(gridCells)
+        self.imgDtype = imgDtype
+        self.targetDtype = targetDtype
+        self.rng = np.random.default_rng(seed)
+        self.nWorkers = nWorkers
+        self.prefetch = prefetch
+        self.poolType = poolType
+        self.stallTime = 0. # Total seconds spent waiting for batches
+        self.cache = imageCache(cacheBytes) if 0 < cacheBytes else None
+        self.timer = stageTimer() if timeStages == True else None
+        self.draftDecode = draftDecode
+        self.resample = resample
+        self.augmenter = augmenter
+        self.epoch = -1 # Incremented by on_epoch_end, which also runs once in __init__
+        self.indexes = np.array([])
+        self.lstImageId = [] # A list of entire training image ids
+        self.shardImages = None
+        self.shardVectors = None
+
+        if shardPrefix is not None:
+            # The rows of the shards are in the order of the image ids
+            self.shardImages, self.shardVectors, __index = loadShards_YOLOv1(shardPrefix)
+            self.lstImageId = sorted(__index, key = __index.get)
+
+            if self.shardImages.shape[1:3] != (imgSize[1], imgSize[0]) or self.shardVectors.shape[1:] != self.gridCells + (5 + nClass,):
+                raise Exception(f"The shards of {shardPrefix} do not match the image size, grid cells or number of classes")
+        else:
+            # Search the trainDir to acquire all the image IDs
+            __lst = os.listdir(trainImgDir)
+            __lst = [item for item in __lst if item.endswith(".jpg")]
+            __lst = [tmp.replace(".jpg", "") for tmp in __lst]
+            self.lstImageId = sorted(__lst) # Sorted, so the order does not depend on the file system
+
+        # Positions (In self.lstImageId) of the samples of this shard
+        self.rows = shardIndexes(len(self.lstImageId), shard)
+
+        # The pool of workers and the batches that are being read in the background. The pool is 
+        # created on the first request, so unused generators do not spawn any workers.
+        self.pool = None
+        self.pending = {}
+        self.lock = threading.Lock()
+
+        # Build a grouped index of the annotations once, so looking up the boxes of an image does
+        # not need a full scan of the annotations dataFrame for every sample.
+        if shardPrefix is None:
+            self.annotOffsets, self.annotBoxes, self.annotClasses = indexAnnotations(annotDf)
+
+        # Run once when object is created.
+        self.on_epoch_end()
+
+    def on_epoch_end(self):
+        """
+        Updates the indexes after each epoch. If self.shuffle == True, the training indexes will be shuffled.
+        """
+        # The prefetched batches belong to the previous order of the data
+        with self.lock:
+            self.__dropPending(lambda _: True)
+
+        self.epoch += 1
+        self.indexes = self.rows.copy()
+        if self.shuffle == True:
+            self.rng.shuffle(self.indexes)
+
+    def __len__(self):
+        """
+        As stated in tensorflow documentation, should return the number of batches per epoch
+        """
+        return int(len(self.rows) / self.batchSize)
+        
+    def __getitem__(self, idx):
+        """
+        This method generates batches. The right batch should be chosen by using the index argument.
+        The logic: self.indexes contains the indexes of self.lstImageId in this shard, at the end of each 
+        epoch the index list may be shuffled. Using the index argument, tensorflow iterates through 
+        batches. We select the proper chunk of self.indexes using the index argument then we fill 
+        lstIDs with self.lstImageId items using the indexes we acquired.   
+        """
+        __start = time.perf_counter()
+
+        # Generate the batch
+        if self.shardImages is not None:
+            x,y = self.__getShardBatch(idx)
+        elif 0 < self.nWorkers:
+            x,y = self.__getPrefetchedBatch(idx)
+        else:
+            x,y = self.__generateBatch(self.__batchIds(idx), idx)
+
+        __elapsed = time.perf_counter() - __start
+        self.stallTime += __elapsed
+        if self.timer is not None:
+            self.timer.add("batch", __elapsed)
+
+        return x,y
+
+    def close(self):
+        """
+        Cancels the prefetched batches and shuts down the pool of workers. The pool is created again 
+        if more batches are requested.
+        """
+        with self.lock:
+            self.__dropPending(lambda _: True)
+            if self.pool is not None:
+                self.pool.shutdown(wait = True)
+                self.pool = None
+
+    def __getShardBatch(self, idx):
+        """
+        Slices a batch from the shards. Consecutive rows (When the data is not shuffled) are sliced 
+        without copying, otherwise only the rows of the batch are gathered. The images are normalized
+        afterwards.
+
+        Args:
+            idx: int: The index of the batch.
+
+        Returns:
+            A batch of training and ground truth data.
+        """
+        __rows = self.indexes[self.batchSize * idx : self.batchSize * (idx+1)]
+        if 0 < __rows.shape[0] and np.all(np.diff(__rows) == 1):
+            __rows = slice(__rows[0], __rows[-1] + 1)
+
+        with self.__time("normalize"):
+            if isinstance(__rows, slice):
+                x = normalizeImage(self.shardImages[__rows], self.imgDtype)
+            else:
+                # Normalize row by row, so the gathered uint8 rows are not copied to a temporary array
+                x = self.__allocateImages(__rows.shape[0])
+                for i, row in enumerate(__rows):
+                    normalizeImage(self.shardImages[row], self.imgDtype, x[i])
+
+        with self.__time("encode"):
+            y = np.array(self.shardVectors[__rows], dtype = self.targetDtype)
+
+        return x, y
+
+    def __time(self, stage):
+        """
+        Returns a context manager that adds the time of its block to a stage of self.timer, or does 
+        nothing if the stages are not timed.
+
+        Args:
+            stage: str: Name of the stage.
+        """
+        return self.timer.time(stage) if self.timer is not None else nullcontext()
+
+    def __allocateImages(self, n, dtype = None):
+        """
+        Allocates the array of a batch of images.
+
+        Args:
+            n: int: Number of the images in the batch.
+            dtype: np.dtype: The data type of the array. If None, self.imgDtype is used.
+        """
+        return np.empty((n, self.imgSize[1], self.imgSize[0], 3), dtype = self.imgDtype if dtype is None else dtype)
+
+    def __readDtype(self):
+        """
+        Returns the data type the images are read into. The augmented batches are read as uint8 and 
+        normalized after the augmentation.
+        """
+        return np.uint8 if self.augmenter is not None else self.imgDtype
+
+    def __batchIds(self, idx):
+        """
+        Returns the image IDs of a batch.
+
+        Args:
+            idx: int: The index of the batch.
+        """
+        __indexes = self.indexes[self.batchSize * idx : self.batchSize * (idx+1)]
+        return [self.lstImageId[i] for i in __indexes]
+
+    def __dropPending(self, condition):
+        """
+        Cancels and removes the prefetched batches which their index satisfies the condition. Should 
+        be called while holding self.lock.
+
+        Args:
+            condition: method: Gets the batch index and returns True if it should be removed.
+        """
+        for k in [k for k in self.pending if condition(k)]:
+            for future in self.pending.pop(k)[1]:
+                if isinstance(future, Future):
+                    future.cancel()
+
+    def __submitBatch(self, idx):
+        """
+        Submits reading the images of a batch to the pool of workers. The cached images are not
+        submitted.
+
+        Args:
+            idx: int: The index of the batch.
+
+        Returns:
+            A tuple of the image IDs and a list of the futures of their (uint8) images, or the images
+            themselves if they were cached.
+        """
+        lstIDs = self.__batchIds(idx)
+        futures = []
+        for id in lstIDs:
+            img = self.cache.get(id) if self.cache is not None else None
+            if img is None:
+                # The timer can not be shared with worker processes
+                __timer = self.timer if self.poolType == "thread" else None
+                img = self.pool.submit(readImage, f"{self.trainDir}/{id}.jpg", self.imgSize, False, __timer, self.draftDecode, self.resample)
+            futures.append(img)
+
+        return lstIDs, futures
+
+    def __getPrefetchedBatch(self, idx):
+        """
+        Returns a batch using the pool of workers. If the batch has not been prefetched, it is 
+        submitted now. Afterwards, the next self.prefetch batches are submitted so they are read 
+        while the current batch is being used. The prefetched batches are bounded to this window.
+
+        Args:
+            idx: int: The index of the batch.
+
+        Returns:
+            A batch of training and ground truth data.
+        """
+        with self.lock:
+            if self.pool is None:
+                __executor = ThreadPoolExecutor if self.poolType == "thread" else ProcessPoolExecutor
+                self.pool = __executor(max_workers = self.nWorkers)
+
+            lstIDs, futures = self.pending.pop(idx, None) or self.__submitBatch(idx)
+
+            # Keep the window of prefetched batches bounded and fill it
+            __last = min(idx + self.prefetch, len(self) - 1)
+            self.__dropPending(lambda k: not idx < k <= __last)
+            for k in range(idx + 1, __last + 1):
+                if k not in self.pending:
+                    self.pending[k] = self.__submitBatch(k)
+
+        x = self.__allocateImages(len(lstIDs), self.__readDtype())
+        for i, (id, future) in enumerate(zip(lstIDs, futures)):
+            if isinstance(future, Future):
+                with self.__time("wait"):
+                    future = future.result()
+                if self.cache is not None:
+                    self.cache.put(id, future)
+            with self.__time("normalize"):
+                normalizeImage(future, self.__readDtype(), x[i])
+
+        return self.__finishBatch(x, lstIDs, idx)
+
+    def __generateBatch(self, lstImg, idx):
+        """
+        Generates a batch by iterating through a list of image IDs. The images are read one by one, 
+        but the ground truth tensors of the entire batch are generated at once.
+
+        Args:
+            lstImg: list: A list of strings, containing image IDs.
+            idx: int: The index of the batch.
+        
+        Returns:
+            A batch of training and ground truth data.
+        """
+        x = self.__allocateImages(len(lstImg), self.__readDtype())
+        for i, id in enumerate(lstImg):
+            __img = self._readPixels(id)
+            with self.__time("normalize"):
+                normalizeImage(__img, self.__readDtype(), x[i])
+
+        return self.__finishBatch(x, lstImg, idx)
+
+    def __finishBatch(self, x, lstImg, idx):
+        """
+        Generates the ground truth tensors of a batch. If self.augmenter is set, the uint8 images and
+        the boxes of the batch are augmented first and the images are normalized afterwards.
+
+        Args:
+            x: np.ndarray: The images of the batch (uint8 if self.augmenter is set)
+            lstImg: list: A list of strings, containing image IDs.
+            idx: int: The index of the batch.
+
+        Returns:
+            A batch of training and ground truth data.
+        """
+        if self.augmenter is None:
+            with self.__time("encode"):
+                y = self.__encodeBatch(*self.__gatherAnnotations(lstImg), len(lstImg))
+            return x, y
+
+        with self.__time("augment"):
+            x, boxes, classes, imgIdx = self.augmenter(x, *self.__gatherAnnotations(lstImg), (self.epoch, idx))
+
+        with self.__time("normalize"):
+            x = normalizeImage(x, self.imgDtype)
+
+        with self.__time("encode"):
+            y = self.__encodeBatch(boxes, classes, imgIdx, len(lstImg))
+
+        return x, y
+
+    def __gatherAnnotations(self, lstImg):
+        """
+        Gathers the annotations of a batch.
+
+        Args:
+            lstImg: list: A list of strings, containing image IDs.
+
+        Returns:
+            A tuple of the boxes (m, 4), their classes (m,) and the index of their image in the 
+            batch (m,)
+        """
+        lstBoxes = []
+        lstClasses = []
+        lstImgIdx = []
+
+        for i, id in enumerate(lstImg):
+            boxes, classes = self._getAnnotations(id)
+            lstBoxes.append(boxes)
+            lstClasses.append(classes)
+            lstImgIdx.append(np.full(boxes.shape[0], i))
+
+        return np.concatenate(lstBoxes), np.concatenate(lstClasses), np.concatenate(lstImgIdx)
+
+    def __encodeBatch(self, boxes, classes, imgIdx, nImg):
+        """
+        Generates the ground truth tensors of a batch at once.
+
+        Args:
+            boxes: np.ndarray: The boxes of the batch (m, 4)
+            classes: np.ndarray: The classes of the boxes (m,)
+            imgIdx: np.ndarray: The index of the image of each box (m,)
+            nImg: int: Number of images in the batch.
+        
+        Returns:
+            A numpy array of shape (nImg, Sx, Sy, 5 + nClass)
+        """
+        return encodeGroundTruth_YOLOv1(
+            boxes, classes, imgIdx, nImg, self.gridCells + (1, self.nClass), self.targetDtype
+        )
+
+    def _getAnnotations(self, ID):
+        """
+        Returns the annotations of a single image using the grouped index built in __init__. The 
+        lookup only touches the boxes of the requested image.
+
+        Args:
+            ID: str: ID of the image
+
+        Returns:
+            Two numpy arrays, the boxes of shape (n, 4) in [boxCenterX, boxCenterY, boxWidth, boxHeight]
+            order and their classes of shape (n,). Both are empty if the image has no annotations.
+        """
+        start, stop = self.annotOffsets.get(ID, (0, 0))
+        return self.annotBoxes[start:stop], self.annotClasses[start:stop]
+
+    def _readImage(self, ID):
+        """
+        Reads, resizes and normalizes an image.
+
+        Args: 
+            ID: str: ID of the image to read
+
+        Returns: 
+            A numpy array of self.imgDtype, the normalized image.
+        """
+        return normalizeImage(self._readPixels(ID), self.imgDtype)
+
+    def _readPixels(self, ID):
+        """
+        Reads and resizes an image without normalizing it. If the cache is enabled, the image is 
+        read from the cache when possible and added to it otherwise.
+
+        Args: 
+            ID: str: ID of the image to read
+
+        Returns: 
+            A uint8 numpy array.
+        """
+        img = self.cache.get(ID) if self.cache is not None else None
+        if img is None:
+            img = readImage(f"{self.trainDir}/{ID}.jpg", self.imgSize, False, self.timer, self.draftDecode, self.resample)
+            if self.cache is not None:
+                self.cache.put(ID, img)
+
+        return img
+
+    def _read(self, ID):
+        """
+        Read the images and generate the ground truth tensor from annotations.
+        First the image is read, resized and normalized, Then the annotations from the previously 
+        acquired dataFrame is used to generate the ground truth tensor.
+        For YOLOv1 each image is divided to Sx*Sy grids and each grid cell has the following parameter
+        in (order is important): [<classes one-hot vector>, confScore, relX, relY, width, height].
+        where relX and relY define the center of the bounding box relative to the grid cell. width 
+        and height parameters define the width and height of the bounding box relative to the 
+        entire image (They are NOT relative to the bounding box to avoid acquiring numbers bigger 
+        than 1). See encodeGroundTruth_YOLOv1.
+
+        Args: 
+            ID: str: ID of the image to read
+
+        Returns: 
+            Two numpy arrays, The normalized image and it's ground truth tensor compatible with YOLOv1 
+            architecture. 
+        """
+        img = self._readImage(ID)
+
+        # Generate the ground truth tensor
+        boxes, classes = self._getAnnotations(ID)
+        outTensor = encodeGroundTruth_YOLOv1(
+            boxes, classes, np.zeros(boxes.shape[0], dtype = np.int64), 1, self.gridCells + (1, self.nClass), 
+            self.targetDtype
+        )
+        
+        return img, outTensor[0]
+        
+def encodeGroundTruthTF_YOLOv1(boxes, classes, params = (7, 7, 1, 1)):
+    """
+    Generates the YOLOv1 ground truth tensor of a single image with tensorflow operations, so it 
+    can run inside a tf.data pipeline. The output is the same as encodeGroundTruth_YOLOv1: each grid 
+    cell has [<classes one-hot vector>, <B confidence scores>, <B times (relX, relY, width, height)>]
+    and if the centers of multiple boxes fall in the same grid cell, only the last one is kept.
+
+    Args:
+        boxes: tf.Tensor: A tensor of shape (n, 4) containing [boxCenterX, boxCenterY, boxWidth, boxHeight]
+            of the boxes, relative to the entire image.
+        classes: tf.Tensor: An integer tensor of shape (n,) containing the class of each box.
+        params: tuple: A tuple containing parameters (Sx, Sy, B, C)
+
+    Returns:
+        A float32 tensor of shape (Sx, Sy, 5*B + C)
+    """
+    __Sx, __Sy, __B, __C = params
+    boxes = tf.reshape(tf.cast(boxes, tf.float32), (-1, 4))
+    classes = tf.cast(classes, tf.int32)
+
+    # Get the x and y indexes of the grid cells
+    __x = boxes[:, 0] * __Sx
+    __y = boxes[:, 1] * __Sy
+    cellIdxI = tf.clip_by_value(tf.cast(tf.floor(__x), tf.int32), 0, __Sx - 1)
+    cellIdxJ = tf.clip_by_value(tf.cast(tf.floor(__y), tf.int32), 0, __Sy - 1)
+    cells = tf.stack([cellIdxI, cellIdxJ], axis = -1)
+
+    # Keep only the last box of every grid cell. The (1-based) position of the last box of each cell
+    # is found by a scatter with max reduction.
+    __order = tf.range(1, tf.shape(boxes)[0] + 1)
+    __last = tf.tensor_scatter_nd_max(tf.zeros((__Sx, __Sy), tf.int32), cells, __order)
+    __keep = tf.equal(tf.gather_nd(__last, cells), __order)
+
+    # The relative coordinates of the bounding box to the grid cell's top-left corner except w and 
+    # h which are relative to the entire image.
+    __coords = tf.stack([__x - tf.cast(cellIdxI, tf.float32), __y - tf.cast(cellIdxJ, tf.float32), boxes[:, 2], boxes[:, 3]], axis = -1)
+    __vectors = tf.concat([
+        tf.one_hot(classes, __C), 
+        tf.ones((tf.shape(boxes)[0], __B)), 
+        tf.tile(__coords, (1, __B))
+    ], axis = -1)
+
+    return tf.scatter_nd(
+        tf.boolean_mask(cells, __keep), tf.boolean_mask(__vectors, __keep), (__Sx, __Sy, 5*__B + __C)
+    )
+
+def buildDataset_YOLOv1(imgDir, batchSize, imgSize, annotDf, nClass, shuffle, gridCells = (7, 7), 
+                        seed = None, cache = None, shuffleBuffer = 1024, imgDtype = np.float32, shard = (1, 0), 
+                        draftDecode = True, resample = "bicubic", augmenter = None):
+    """
+    Builds a tf.data pipeline that returns the same batches as dataGenerator_YOLOv1, from the same 
+    image directory and annotations. The files are read and decoded by tf.io.decode_jpeg, resized
+    and encoded with encodeGroundTruthTF_YOLOv1 in parallel (num_parallel_calls = AUTOTUNE). The 
+    decoded images can be cached as uint8 (normalization happens after the cache), then shuffled,
+    batched and prefetched.
+
+    Note: The annotations are grouped by indexAnnotations and embedded in the graph, each image 
+        slices its own boxes.
+
+    If an augmenter is passed, the ground truth tensors are not encoded per image. Instead, each 
+    uint8 batch is augmented with its boxes and encoded by encodeGroundTruth_YOLOv1 in a 
+    tf.numpy_function, then normalized. The batches are augmented sequentially and keyed by 
+    (epoch, batch index) like dataGenerator_YOLOv1, counting the batches since the dataset was built,
+    so the augmentation is reproducible as long as every epoch is iterated to its end.
+
+    Args:
+        imgDir: str: The directory which contains the images. Each file should be saved with jpg 
+            extension and its name should be the ID of the image.
+        batchSize: int: The size of training samples in each batch. The last incomplete batch is 
+            dropped, same as dataGenerator_YOLOv1.
+        imgSize: tuple: A tuple containing training image size (width,height) in pixels. (448,448) for
+            YOLOv1.
+        annotDf: pd.DataFrame: A pandas dataFrame containing all of the annotations.
+        nClass: int: Number of classes that are to be detected.
+        shuffle: bool: Weather to shuffle the data in each epoch. 
+        gridCells: tuple: Number of grid cells in each axis of the image (Sx, Sy). (7,7) for YOLOv1.
+        seed: int: The seed used for shuffling the data.
+        cache: str: Where to cache the decoded images. "" for caching in memory (The whole decoded 
+            dataset is kept in the host RAM, only for small datasets), a file path for caching on 
+            disk and None for no caching.
+        shuffleBuffer: int: Size of the shuffle buffer.
+        imgDtype: np.dtype: The data type of the images, np.float32 (normalized) or np.uint8.
+        shard: tuple: (numShards, shardIndex). Only the images of this shard (See shardIndexes) are 
+            read. If the data is sharded, the auto-sharding of tf.distribute is turned off.
+        draftDecode: bool: Whether to decode large JPEGs at a reduced resolution (The ratio argument
+            of tf.io.decode_jpeg), same as readImage. The ratio of each image is found from the 
+            header of its file when the pipeline is built.
+        resample: str: The filter of the resize: nearest, bilinear, bicubic, lanczos or box.
+        augmenter: batchAugmenter: Augments each batch before its ground truth tensors are encoded.
+            If None, the batches are not augmented.
+
+    Returns:
+        A tf.data.Dataset which returns (images, ground truth tensors) batches.
+    """
+    __params = tuple(gridCells) + (1, nClass)
+
+    # Acquire all the image IDs, same as dataGenerator_YOLOv1
+    __lst = sorted(item.replace(".jpg", "") for item in os.listdir(imgDir) if item.endswith(".jpg"))
+    __lst = [__lst[i] for i in shardIndexes(len(__lst), shard)]
+
+    offsets, boxes, classes = indexAnnotations(annotDf)
+    if 0 < classes.shape[0] and (classes.min() < 0 or nClass <= classes.max()):
+        raise Exception(f"Class ids should be in [0, {nClass}), got [{classes.min()}, {classes.max()}]")
+
+    __starts = np.array([offsets.get(id, (0, 0))[0] for id in __lst], dtype = np.int64)
+    __stops = np.array([offsets.get(id, (0, 0))[1] for id in __lst], dtype = np.int64)
+    __paths = [f"{imgDir}/{id}.jpg" for id in __lst]
+
+    # The filters of PIL (See resampleFilters) that tf.image.resize has
+    __methods = {"nearest": "nearest", "bilinear": "bilinear", "bicubic": "bicubic", "lanczos": "lanczos3", "box": "area"}
+    if resample not in __methods:
+        raise Exception(f"Invalid resampling filter: {resample}. Only {', '.join(__methods)} are acceptable.")
+
+    # decode_jpeg only takes a constant ratio, so each image picks one of the decoders by the 
+    # index of its ratio (1, 2, 4 or 8)
+    __ratioIdx = np.array([int(np.log2(jpegDraftRatio(path, imgSize))) if draftDecode else 0 for path in __paths], dtype = np.int32)
+
+    __nBatches = max(len(__lst) // batchSize, 1)
+    __boxes, __classes = boxes, classes
+    __calls = [0]
+
+    boxes = tf.constant(boxes)
+    classes = tf.constant(classes)
+
+    def __load(path, start, stop, ratioIdx):
+        __data = tf.io.read_file(path)
+        img = tf.switch_case(ratioIdx, [lambda r = r: tf.io.decode_jpeg(__data, channels = 3, ratio = r) for r in (1, 2, 4, 8)])
+        img = tf.image.resize(img, (imgSize[1], imgSize[0]), method = __methods[resample], antialias = True)
+        img = tf.cast(tf.clip_by_value(tf.round(img), 0., 255.), tf.uint8)
+
+        # The augmented batches are encoded after the augmentation
+        if augmenter is not None:
+            return img, tf.stack([start, stop])
+
+        return img, encodeGroundTruthTF_YOLOv1(boxes[start:stop], classes[start:stop], __params)
+
+    def __augmentBatch(images, ranges):
+        __imgIdx = np.concatenate([np.full(stop - start, i) for i, (start, stop) in enumerate(ranges)])
+        __rows = np.concatenate([np.arange(start, stop) for start, stop in ranges])
+
+        __key = divmod(__calls[0], __nBatches)
+        __calls[0] += 1
+        images, __b, __c, __imgIdx = augmenter(images, __boxes[__rows], __classes[__rows], __imgIdx, __key)
+
+        return images, encodeGroundTruth_YOLOv1(__b, __c, __imgIdx, images.shape[0], __params, np.float32)
+
+    def __augment(images, ranges):
+        images, tensor = tf.numpy_function(__augmentBatch, [images, ranges], [tf.uint8, tf.float32], stateful = True)
+        images.set_shape((batchSize, imgSize[1], imgSize[0], 3))
+        tensor.set_shape((batchSize,) + tuple(gridCells) + (5 + nClass,))
+        return images, tensor
+
+    def __normalize(img, tensor):
+        return tf.cast(img, imgDtype) / 255., tensor
+
+    ds = tf.data.Dataset.from_tensor_slices((__paths, __starts, __stops, __ratioIdx))
+    ds = ds.map(__load, num_parallel_calls = tf.data.AUTOTUNE)
+
+    if cache is not None:
+        ds = ds.cache(cache)
+
+    if shuffle == True:
+        ds = ds.shuffle(shuffleBuffer, seed = seed, reshuffle_each_iteration = True)
+
+    if augmenter is not None:
+        # Sequential, so the batches are augmented in order
+        ds = ds.batch(batchSize, drop_remainder = True)
+        ds = ds.map(__augment)
+        if np.dtype(imgDtype) != np.uint8:
+            ds = ds.map(__normalize, num_parallel_calls = tf.data.AUTOTUNE)
+    else:
+        if np.dtype(imgDtype) != np.uint8:
+            ds = ds.map(__normalize, num_parallel_calls = tf.data.AUTOTUNE)
+        ds = ds.batch(batchSize, drop_remainder = True)
+    ds = ds.prefetch(tf.data.AUTOTUNE)
+
+    # The shard is already chosen, tf.distribute should not shard the data again
+    if 1 < shard[0]:
+        __options = tf.data.Options()
+        __options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+        ds = ds.with_options(__options)
+
+    return ds
+
+def sequenceToDataset_YOLOv1(generator):
+    """
+    Wraps a dataGenerator_YOLOv1 in an endless tf.data.Dataset, so it can be passed to 
+    tf.distribute (e.g. strategy.distribute_datasets_from_function). Each pass over the dataset 
+    returns all the batches of the generator in order and then calls its on_epoch_end. The 
+    prefetching and caching of the generator still works as usual.
+
+    Args:
+        generator: dataGenerator_YOLOv1: The generator to wrap
+
+    Returns:
+        A tf.data.Dataset which returns (images, ground truth tensors) batches. Use len(generator)
+        as the number of steps of each epoch.
+    """
+    def __batches():
+        for i in range(len(generator)):
+            yield generator[i]
+        generator.on_epoch_end()
+
+    __imgShape = (generator.batchSize, generator.imgSize[1], generator.imgSize[0], 3)
+    __targetShape = (generator.batchSize,) + generator.gridCells + (5 + generator.nClass,)
+
+    ds = tf.data.Dataset.from_generator(__batches, output_signature = (
+        tf.TensorSpec(__imgShape, tf.as_dtype(generator.imgDtype)),
+        tf.TensorSpec(__targetShape, tf.as_dtype(generator.targetDtype))
+    ))
+
+    return ds.repeat()